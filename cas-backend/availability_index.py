@@ -0,0 +1,209 @@
+"""In-memory index of doctors' weekly schedules and booked slots.
+
+Answers "earliest open slots with any doctor of a specialization" without
+touching MongoDB. For every specialization the weekly schedules of its
+doctors are merged into one sorted template of (minute offset from Monday
+00:00, doctor) pairs. A query bisects to the requested time and walks the
+template forward, skipping booked slots, until it has `limit` results, so
+its cost depends on the number of results rather than the number of doctors.
+Templates are rebuilt lazily after a schedule or specialization changes;
+bookings only touch the per-doctor set of claimed cells. Each doctor's slots
+are as long as that doctor's default appointment duration.
+
+Date overrides (holidays, extra sessions) are kept per doctor: a template
+slot on an overridden date counts only if the override keeps it open, and
+override-only slots live in a small sorted list that is merged into the walk.
+"""
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from scheduling import CompiledSchedule
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def normalize_specialization(value):
+    return (value or '').strip().lower()
+
+
+class _DoctorEntry:
+    __slots__ = ('doctor_id', 'name', 'specialization', 'duration', 'schedule', 'week_offsets', 'overrides', 'extras', 'booked')
+
+    def __init__(self, doctor_id, name, specialization, duration):
+        self.doctor_id = doctor_id
+        self.name = name
+        self.specialization = specialization
+        self.duration = duration
+        self.schedule = None
+        self.week_offsets = []
+        self.overrides = {}  # date -> frozenset of open minute offsets that day
+        self.extras = []     # override slot datetimes not covered by the weekly offsets
+        self.booked = set()  # claimed cell starts
+
+
+class AvailabilityIndex:
+    """Thread-safe index of weekly availability and claimed cells per doctor.
+
+    slot_cells(slot, minutes) returns the claim cells an appointment of that
+    length would occupy, so slots are checked exactly the way bookings are
+    reserved. slot_minutes is the duration used for doctors without their own.
+    """
+
+    def __init__(self, slot_minutes, slot_cells):
+        self.slot_minutes = slot_minutes
+        self.slot_cells = slot_cells
+        self._doctors = {}
+        self._by_specialization = {}
+        self._templates = {}  # specialization key ('' = all doctors) -> (offsets, entries, extras)
+        self._lock = threading.RLock()
+        self.loaded_at = None
+
+    # --- Loading and incremental updates ---
+
+    def load(self, doctors, claims):
+        """Rebuilds the index from doctor documents and slot claim documents."""
+        with self._lock:
+            self._doctors.clear()
+            self._by_specialization.clear()
+            self._templates.clear()
+            for doc in doctors:
+                self.upsert_doctor(doc)
+            for claim in claims:
+                self.add_booking(claim['doctor_id'], (claim['slot_start'],))
+            self.loaded_at = datetime.utcnow()
+
+    def upsert_doctor(self, doc):
+        """Adds or refreshes a doctor from a document with name/specialization/availability_slots/appointment_durations."""
+        doctor_id = str(doc['_id'])
+        with self._lock:
+            entry = self._doctors.get(doctor_id)
+            if entry is None:
+                entry = _DoctorEntry(doctor_id, doc.get('name'), doc.get('specialization'), self.slot_minutes)
+                self._doctors[doctor_id] = entry
+            else:
+                self._by_specialization.get(normalize_specialization(entry.specialization), set()).discard(doctor_id)
+                self._invalidate_templates(entry)
+                entry.name = doc.get('name', entry.name)
+                entry.specialization = doc.get('specialization', entry.specialization)
+            if 'appointment_durations' in doc:
+                entry.duration = (doc.get('appointment_durations') or {}).get('default') or self.slot_minutes
+                if entry.schedule is not None:
+                    self._set_schedule(entry, entry.schedule)
+            self._by_specialization.setdefault(normalize_specialization(entry.specialization), set()).add(doctor_id)
+            if 'availability' in doc or 'availability_slots' in doc:
+                self._set_schedule(entry, CompiledSchedule.from_document(doc))
+            self._invalidate_templates(entry)
+
+    def set_availability(self, doctor_id, schedule):
+        """Replaces a doctor's schedule with a CompiledSchedule."""
+        with self._lock:
+            entry = self._doctors.get(str(doctor_id))
+            if entry is not None:
+                self._set_schedule(entry, schedule)
+                self._invalidate_templates(entry)
+
+    def add_booking(self, doctor_id, cells):
+        with self._lock:
+            entry = self._doctors.get(str(doctor_id))
+            if entry is not None:
+                entry.booked.update(cells)
+
+    def remove_booking(self, doctor_id, cells):
+        with self._lock:
+            entry = self._doctors.get(str(doctor_id))
+            if entry is not None:
+                entry.booked.difference_update(cells)
+
+    def move_booking(self, doctor_id, old_cells, new_cells):
+        with self._lock:
+            self.remove_booking(doctor_id, old_cells)
+            self.add_booking(doctor_id, new_cells)
+
+    def _set_schedule(self, entry, schedule):
+        entry.schedule = schedule
+        weekly = schedule.weekly_offsets(entry.duration)
+        entry.week_offsets = [day * MINUTES_PER_DAY + offset
+                              for day, offsets in enumerate(weekly) for offset in offsets]
+        entry.overrides = {}
+        entry.extras = []
+        for day in sorted(schedule.overrides):
+            offsets = schedule.day_offsets(day, entry.duration)
+            entry.overrides[day] = frozenset(offsets)
+            usual = set(weekly[day.weekday()])
+            midnight = datetime(day.year, day.month, day.day)
+            entry.extras.extend(midnight + timedelta(minutes=offset) for offset in offsets if offset not in usual)
+
+    def _invalidate_templates(self, entry):
+        self._templates.pop(normalize_specialization(entry.specialization), None)
+        self._templates.pop('', None)
+
+    def __len__(self):
+        return len(self._doctors)
+
+    # --- Queries ---
+
+    def _template(self, key):
+        """Returns the merged weekly template for a specialization key, building it if needed."""
+        template = self._templates.get(key)
+        if template is None:
+            doctor_ids = self._by_specialization.get(key, ()) if key else self._doctors.keys()
+            pairs = sorted(
+                ((offset, self._doctors[doctor_id]) for doctor_id in doctor_ids
+                 for offset in self._doctors[doctor_id].week_offsets),
+                key=lambda pair: pair[0]
+            )
+            extras = sorted(((slot, self._doctors[doctor_id]) for doctor_id in doctor_ids
+                             for slot in self._doctors[doctor_id].extras), key=lambda pair: pair[0])
+            template = ([offset for offset, _ in pairs], [entry for _, entry in pairs], extras)
+            self._templates[key] = template
+        return template
+
+    def earliest(self, specialization, after, limit, horizon_days):
+        """Returns up to `limit` (slot datetime, doctor entry) pairs in time order.
+
+        An empty specialization searches across all doctors.
+        """
+        horizon_end = after + timedelta(days=horizon_days)
+        with self._lock:
+            offsets, entries, extras = self._template(normalize_specialization(specialization))
+            slot_cells = self.slot_cells
+
+            # Override-only slots in range; merged with the template walk below
+            results = []
+            for slot, entry in extras[bisect_left(extras, after, key=lambda pair: pair[0]):]:
+                if slot >= horizon_end or len(results) == limit:
+                    break
+                if not entry.booked or entry.booked.isdisjoint(slot_cells(slot, entry.duration)):
+                    results.append((slot, entry))
+            if not offsets:
+                return results
+
+            week_start = datetime(after.year, after.month, after.day) - timedelta(days=after.weekday())
+            elapsed = after - week_start
+            minute = elapsed // timedelta(minutes=1)
+            if elapsed % timedelta(minutes=1):
+                minute += 1  # Slots only start on whole minutes
+            i = bisect_left(offsets, minute)
+
+            found = 0
+            while found < limit:
+                if i == len(offsets):
+                    # Wrap around into the next week
+                    week_start += timedelta(days=7)
+                    i = 0
+                slot = week_start + timedelta(minutes=offsets[i])
+                if slot >= horizon_end:
+                    break
+                entry = entries[i]
+                i += 1
+                if entry.overrides:
+                    day_offsets = entry.overrides.get(slot.date())
+                    if day_offsets is not None and (slot - datetime(slot.year, slot.month, slot.day)) \
+                            // timedelta(minutes=1) not in day_offsets:
+                        continue
+                if not entry.booked or entry.booked.isdisjoint(slot_cells(slot, entry.duration)):
+                    results.append((slot, entry))
+                    found += 1
+            results.sort(key=lambda pair: pair[0])
+            return results[:limit]
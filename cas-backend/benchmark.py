@@ -0,0 +1,575 @@
+"""Benchmarks for the Appointix backend.
+
+Requests are driven through the Flask test client from a pool of threads,
+so results measure the application and database, not the HTTP stack.
+Data goes to a scratch database (dropped first) on a local mongod, to a
+scratch SQLite file with --sqlite PATH, or with --in-memory to an
+in-process stand-in (requires the optional `mongomock` package; it is not
+thread-safe, so use it to exercise the suite and a real database for numbers).
+
+The `suite` scenario seeds a deterministic dataset straight into storage
+(--doctors/--patients/--appointments, inserted in batches so it scales to
+millions of rows) and then drives every API route in turn. Results can be
+saved with --output and later runs compared against them with --baseline;
+the exit status is 1 when a route regressed beyond --tolerance.
+
+    python benchmark.py suite --doctors 200 --patients 5000 --appointments 200000 --output base.json
+    python benchmark.py suite --doctors 200 --patients 5000 --appointments 200000 --baseline base.json
+    python benchmark.py login --in-memory --concurrency 16 --requests 400
+    python benchmark.py overload --sqlite /tmp/bench.sqlite3 --concurrency 64 --requests 2000
+    python benchmark.py serialize --rows 100000
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import jwt
+from bson.objectid import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import database
+import serializers
+import server
+from scheduling import CompiledSchedule
+from slot_claims import CLAIMS_COLLECTION, claim_cells
+
+
+# --- Harness ---
+
+def make_app(args, **config):
+    """Creates an app bound to the benchmark database, which is emptied first."""
+    if args.in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--in-memory requires the 'mongomock' package (pip install mongomock)")
+        database.MongoClient = mongomock.MongoClient
+    if args.sqlite:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+    app = server.create_app({
+        'STORAGE_BACKEND': 'sqlite' if args.sqlite else 'mongo',
+        'SQLITE_PATH': args.sqlite,
+        'MONGO_URI': args.mongo_uri,
+        'MONGO_DBNAME': args.db_name,
+        'VERIFY_QUERY_PLANS': False,
+        'SWEEPER_ENABLED': False, # Keep the seeded history in place while measuring
+        'RATE_LIMIT_ENABLED': False, # Every request comes from one address; see the overload scenario
+        'MAX_IN_FLIGHT_REQUESTS': 0,
+        **config
+    })
+    if not args.sqlite:
+        server.mongo.client.drop_database(args.db_name)
+    server.principal_cache.clear()
+    server.invalidate_doctor_directory()
+    return app
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, statuses):
+    """Latency percentiles in milliseconds plus throughput for one run."""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2) if ordered else None,
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2) if ordered else None,
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2) if ordered else None,
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 2) if ordered else None,
+        'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses))}
+    }
+
+
+def run_load(app, make_request, total, concurrency):
+    """Calls make_request(client, i) `total` times from `concurrency` threads.
+
+    make_request returns a response; its latency and status code are recorded.
+    """
+    local = threading.local()
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = time.perf_counter()
+        response = make_request(client, i)
+        duration = time.perf_counter() - start
+        with lock:
+            latencies.append(duration)
+            statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return summarize(latencies, time.perf_counter() - started, statuses)
+
+
+def seed_users(client, count, user_type='patient', password='benchmark-pw'):
+    emails = []
+    for i in range(count):
+        email = f'bench-{user_type}-{i}@example.com'
+        payload = {'email': email, 'password': password, 'userType': user_type, 'name': f'Bench {user_type} {i}'}
+        if user_type == 'doctor':
+            payload['specialization'] = 'General'
+        response = client.post('/api/register', json=payload)
+        if response.status_code != 201:
+            raise RuntimeError(f"Seeding {email} failed: {response.status_code} {response.get_json()}")
+        emails.append(email)
+    return emails
+
+
+def token_for(app, user_id, user_type, doctor_id=None):
+    """Mints the same JWT /api/login would, without paying for a password check."""
+    payload = {'user_id': str(user_id), 'user_type': user_type, 'exp': datetime.utcnow() + timedelta(hours=24)}
+    if doctor_id:
+        payload['doctor_id'] = str(doctor_id)
+    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+# --- Dataset ---
+
+SEED_PASSWORD = 'benchmark-pw'
+SEED_SPECIALIZATIONS = ('General', 'Cardiology', 'Dermatology', 'Pediatrics', 'Neurology')
+WORKDAY = {'startTime': '08:00', 'endTime': '20:00', 'isAvailable': True}
+WORKDAY_START_MINUTES = 8 * 60
+WORKDAY_MINUTES = 12 * 60
+
+
+class Dataset:
+    """Ids of the seeded documents, in seeding order."""
+
+    def __init__(self, doctor_ids, doctor_user_ids, patient_ids, slots_per_day):
+        self.doctor_ids = doctor_ids
+        self.doctor_user_ids = doctor_user_ids
+        self.patient_ids = patient_ids
+        self.slots_per_day = slots_per_day
+
+    def slot(self, day, index, slot_minutes):
+        """Start of the index-th slot of the workday `day` days from today."""
+        start = datetime.combine(date.today() + timedelta(days=day), datetime.min.time())
+        return start + timedelta(minutes=WORKDAY_START_MINUTES + index * slot_minutes)
+
+
+def insert_batches(collection, documents, batch_size):
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+
+def seed_dataset(app, doctors, patients, appointments, batch_size=10000):
+    """Bulk-inserts users, doctors and appointments, then creates indexes.
+
+    Appointment k belongs to doctor k % doctors and patient k % patients and
+    takes that doctor's next free workday slot. Every fifth one is upcoming
+    (with its slot claim); the rest lie in the past, completed or cancelled.
+    All users share one password hash, computed once.
+    """
+    slot_minutes = app.config['APPOINTMENT_SLOT_MINUTES']
+    dataset = Dataset([ObjectId() for _ in range(doctors)], [ObjectId() for _ in range(doctors)],
+                      [ObjectId() for _ in range(patients)], WORKDAY_MINUTES // slot_minutes)
+    now = datetime.utcnow()
+    with app.app_context():
+        db = server.db
+        password_hash = server.password_hasher.hash(SEED_PASSWORD)
+        availability = {day: dict(WORKDAY) for day in
+                        ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]}
+        availability_slots = CompiledSchedule.compile(
+            availability, [], app.config['AVAILABILITY_GRANULARITY_MINUTES']).to_document()
+
+        def users():
+            for i, user_id in enumerate(dataset.doctor_user_ids):
+                yield {'_id': user_id, 'email': f'bench-doctor-{i}@example.com', 'password_hash': password_hash,
+                       'user_type': 'doctor', 'name': f'Bench Doctor {i}', 'created_at': now}
+            for i, user_id in enumerate(dataset.patient_ids):
+                yield {'_id': user_id, 'email': f'bench-patient-{i}@example.com', 'password_hash': password_hash,
+                       'user_type': 'patient', 'name': f'Bench Patient {i}', 'created_at': now}
+
+        def doctor_docs():
+            for i, (doctor_id, user_id) in enumerate(zip(dataset.doctor_ids, dataset.doctor_user_ids)):
+                yield {'_id': doctor_id, 'user_id': user_id, 'name': f'Bench Doctor {i}',
+                       'specialization': SEED_SPECIALIZATIONS[i % len(SEED_SPECIALIZATIONS)],
+                       'email': f'bench-doctor-{i}@example.com', 'phone': None, 'bio': None,
+                       'profile_picture_url': None, 'availability': availability,
+                       'availability_slots': availability_slots, 'created_at': now}
+
+        claims = []
+
+        def appointment_docs():
+            for k in range(appointments):
+                d, j = k % doctors, k // doctors
+                upcoming = k % 5 == 0
+                day, index = divmod(j, dataset.slots_per_day)
+                when = dataset.slot(day + 1 if upcoming else -day - 1, index, slot_minutes)
+                end = when + timedelta(minutes=slot_minutes)
+                appointment_id = ObjectId()
+                if upcoming:
+                    claims.extend({'doctor_id': dataset.doctor_ids[d], 'slot_start': cell,
+                                   'appointment_id': appointment_id, 'claimed_at': now}
+                                  for cell in claim_cells(when, end, app.config['APPOINTMENT_CLAIM_MINUTES']))
+                    if len(claims) >= batch_size:
+                        db[CLAIMS_COLLECTION].insert_many(claims, ordered=False)
+                        claims.clear()
+                yield {'_id': appointment_id, 'doctor_id': dataset.doctor_ids[d],
+                       'patient_id': dataset.patient_ids[k % patients], 'patient_name': f'Bench Patient {k % patients}',
+                       'doctor_name': f'Bench Doctor {d}', 'appointment_datetime': when, 'appointment_end': end,
+                       'reason': 'benchmark',
+                       'status': 'upcoming' if upcoming else ('cancelled' if k % 5 == 4 else 'completed'),
+                       'created_at': now}
+
+        insert_batches(db.users, users(), batch_size)
+        insert_batches(db.doctors, doctor_docs(), batch_size)
+        insert_batches(db.appointments, appointment_docs(), batch_size)
+        if claims:
+            db[CLAIMS_COLLECTION].insert_many(claims, ordered=False)
+        server.bootstrap_database(verify=False)
+    server.availability_index.loaded_at = None
+    server.invalidate_doctor_directory()
+    return dataset
+
+
+# --- Scenarios ---
+
+def bench_login(args):
+    """Login throughput with hashing inline vs. in the process pool.
+
+    A cheap GET runs alongside the login burst to show whether it queues
+    behind hashing.
+    """
+    results = {}
+    modes = [('inline', 0), ('pool', args.hash_workers)]
+    for label, workers in modes:
+        app = make_app(args, PASSWORD_HASH_WORKERS=workers, PASSWORD_HASH_QUEUE_LIMIT=args.hash_queue)
+        emails = seed_users(app.test_client(), args.users)
+
+        def login(client, i):
+            return client.post('/api/login', json={
+                'email': emails[i % len(emails)], 'password': 'benchmark-pw', 'userType': 'patient'})
+
+        def cheap(client, i):
+            return client.get('/healthz')
+
+        background = {}
+        probe = threading.Thread(target=lambda: background.update(
+            run_load(app, cheap, args.requests, max(1, args.concurrency // 4))))
+        probe.start()
+        results[label] = {'login': run_load(app, login, args.requests, args.concurrency)}
+        probe.join()
+        results[label]['healthz_during_login'] = background
+        server.password_hasher.shutdown()
+    return results
+
+
+def bench_overload(args):
+    """A login flood from one client address, unprotected and behind the rate limiter and load shedding.
+
+    With protection, refused requests (429/503) should return far faster
+    than a login, and a cheap GET alongside should keep its latency.
+    """
+    results = {}
+    shared_path = os.path.join(tempfile.gettempdir(), f'appointix-bench-rate-limits-{os.getpid()}')
+    modes = [
+        ('unprotected', {}),
+        ('protected', {'RATE_LIMIT_ENABLED': True, 'RATE_LIMIT_STORAGE': 'shared',
+                       'RATE_LIMIT_SHARED_PATH': shared_path,
+                       'RATE_LIMITS_PER_IP': {'login_user': f'{args.users}/minute'}, # Registration stays open for seeding
+                       'MAX_IN_FLIGHT_REQUESTS': max(1, args.concurrency // 4)}),
+    ]
+    try:
+        for label, config in modes:
+            app = make_app(args, PASSWORD_HASH_WORKERS=args.hash_workers, PASSWORD_HASH_QUEUE_LIMIT=args.hash_queue,
+                           **config)
+            emails = seed_users(app.test_client(), args.users)
+
+            def login(client, i):
+                return client.post('/api/login', json={
+                    'email': emails[i % len(emails)], 'password': 'benchmark-pw', 'userType': 'patient'})
+
+            background = {}
+            probe = threading.Thread(target=lambda: background.update(
+                run_load(app, lambda c, i: c.get('/'), args.requests, max(1, args.concurrency // 8))))
+            probe.start()
+            results[label] = {'login flood': run_load(app, login, args.requests, args.concurrency)}
+            probe.join()
+            results[label]['GET / during flood'] = background
+            server.password_hasher.shutdown()
+    finally:
+        server.rate_limiter.use(server.MemoryBuckets())
+        if os.path.exists(shared_path):
+            os.remove(shared_path)
+    return results
+
+
+def bench_race(app, dataset, args):
+    """args.concurrency patients book the same free slot at once; exactly one may win."""
+    slot_minutes = app.config['APPOINTMENT_SLOT_MINUTES']
+    when = dataset.slot(RACE_DAY, 0, slot_minutes)
+    payload = {'doctorId': str(dataset.doctor_ids[0]), 'date': when.strftime('%Y-%m-%d'),
+               'time': when.strftime('%H:%M'), 'reason': 'race'}
+    tokens = [token_for(app, dataset.patient_ids[i % len(dataset.patient_ids)], 'patient')
+              for i in range(args.concurrency)]
+    barrier = threading.Barrier(args.concurrency)
+
+    def book(client, i):
+        barrier.wait()
+        return client.post('/api/appointments', json=payload, headers=auth(tokens[i]))
+
+    summary = run_load(app, book, args.concurrency, args.concurrency)
+    winners = summary['statuses'].get('201', 0)
+    if winners != 1 or summary['statuses'].get('409', 0) != args.concurrency - 1:
+        raise AssertionError(f"Booking race: expected one winner, got statuses {summary['statuses']}")
+    return summary
+
+
+# Far enough ahead that the suite's bookings never collide with seeded appointments
+BOOKING_DAY = 3000
+RESCHEDULE_DAY = 4000
+RACE_DAY = 5000
+
+
+def bench_suite(args):
+    """Seeds the dataset and measures every route, one phase after another."""
+    app = make_app(args, PASSWORD_HASH_WORKERS=args.hash_workers, PASSWORD_HASH_QUEUE_LIMIT=args.hash_queue)
+    started = time.perf_counter()
+    dataset = seed_dataset(app, args.doctors, args.patients, args.appointments, args.batch_size)
+    seed_seconds = round(time.perf_counter() - started, 2)
+    slot_minutes = app.config['APPOINTMENT_SLOT_MINUTES']
+    # Seeded rows bypass the handlers, so their daily counters come from a full rebuild
+    started = time.perf_counter()
+    with app.app_context():
+        server.rebuild_doctor_stats(server.db, ['appointments'], slot_minutes)
+    stats_rebuild_seconds = round(time.perf_counter() - started, 2)
+    doctors, patients = dataset.doctor_ids, dataset.patient_ids
+    patient_tokens = [token_for(app, p, 'patient') for p in patients[:args.users]]
+    doctor_tokens = {d: token_for(app, u, 'doctor', d) for d, u in zip(doctors, dataset.doctor_user_ids)}
+    total = args.requests
+    results = {}
+
+    def phase(name, make_request, requests=total):
+        results[name] = run_load(app, make_request, requests, args.concurrency)
+
+    phase('POST /api/login', lambda c, i: c.post('/api/login', json={
+        'email': f'bench-patient-{i % args.users}@example.com', 'password': SEED_PASSWORD, 'userType': 'patient'}))
+    phase('GET /api/doctors', lambda c, i: c.get('/api/doctors'))
+    # Name prefixes of growing length ('Bench Doctor 1', '12', ...) and a specialization prefix
+    phase('GET /api/doctors/search', lambda c, i: c.get(
+        f'/api/doctors/search?q=doc {i % len(doctors)}'
+        f'&specialization={SEED_SPECIALIZATIONS[i % len(SEED_SPECIALIZATIONS)][:4]}'))
+    phase('GET /api/doctors/<id>', lambda c, i: c.get(
+        f'/api/doctors/{doctors[i % len(doctors)]}', headers=auth(patient_tokens[i % len(patient_tokens)])))
+    today = date.today()
+    phase('GET /api/doctors/<id>/slots', lambda c, i: c.get(
+        f'/api/doctors/{doctors[i % len(doctors)]}/slots?from={today}&to={today + timedelta(days=14)}',
+        headers=auth(patient_tokens[i % len(patient_tokens)])))
+    phase('GET /api/search/earliest', lambda c, i: c.get(
+        f'/api/search/earliest?specialization={SEED_SPECIALIZATIONS[i % len(SEED_SPECIALIZATIONS)]}',
+        headers=auth(patient_tokens[i % len(patient_tokens)])))
+
+    # Booking i takes slot i of the booking window, spread over the doctors
+    booked = [None] * total
+
+    def book(client, i):
+        day, index = divmod(i // len(doctors), dataset.slots_per_day)
+        when = dataset.slot(BOOKING_DAY + day, index, slot_minutes)
+        response = client.post('/api/appointments', headers=auth(patient_tokens[i % len(patient_tokens)]), json={
+            'doctorId': str(doctors[i % len(doctors)]), 'date': when.strftime('%Y-%m-%d'),
+            'time': when.strftime('%H:%M'), 'reason': 'benchmark'})
+        if response.status_code == 201:
+            booked[i] = response.get_json()['appointment']['id']
+        return response
+
+    phase('POST /api/appointments', book)
+    phase('GET /api/appointments/patient', lambda c, i: c.get(
+        '/api/appointments/patient', headers=auth(patient_tokens[i % len(patient_tokens)])))
+    phase('GET /api/appointments/doctor', lambda c, i: c.get(
+        '/api/appointments/doctor', headers=auth(doctor_tokens[doctors[i % len(doctors)]])))
+    phase('GET /api/doctors/me/stats', lambda c, i: c.get(
+        f'/api/doctors/me/stats?from={today - timedelta(days=30)}&to={today}',
+        headers=auth(doctor_tokens[doctors[i % len(doctors)]])))
+
+    def reschedule(client, i):
+        day, index = divmod(i // len(doctors), dataset.slots_per_day)
+        when = dataset.slot(RESCHEDULE_DAY + day, index, slot_minutes)
+        return client.put(f'/api/appointments/{booked[i]}', headers=auth(patient_tokens[i % len(patient_tokens)]),
+                          json={'date': when.strftime('%Y-%m-%d'), 'time': when.strftime('%H:%M')})
+
+    owned = [i for i in range(total) if booked[i]]
+    to_complete, to_cancel = owned[::2], owned[1::2]
+    phase('PUT /api/appointments/<id>', lambda c, n: reschedule(c, owned[n]), len(owned))
+    phase('PUT /api/appointments/<id>/complete', lambda c, n: c.put(
+        f'/api/appointments/{booked[to_complete[n]]}/complete',
+        headers=auth(doctor_tokens[doctors[to_complete[n] % len(doctors)]])), len(to_complete))
+    phase('DELETE /api/appointments/<id>', lambda c, n: c.delete(
+        f'/api/appointments/{booked[to_cancel[n]]}',
+        headers=auth(patient_tokens[to_cancel[n] % len(patient_tokens)])), len(to_cancel))
+    results['booking race'] = bench_race(app, dataset, args)
+    server.password_hasher.shutdown()
+
+    return {'dataset': {'doctors': args.doctors, 'patients': args.patients, 'appointments': args.appointments,
+                        'seed_seconds': seed_seconds, 'stats_rebuild_seconds': stats_rebuild_seconds},
+            'routes': results}
+
+
+def handwritten_patient_row(appt):
+    # The listing row as handlers built it before serializers.py, for comparison
+    return {
+        "id": str(appt['_id']),
+        "doctorId": str(appt.get('doctor_id')),
+        "doctorName": appt.get('doctor_name'),
+        "date": appt.get('appointment_datetime').strftime('%Y-%m-%d') if appt.get('appointment_datetime') else None,
+        "time": appt.get('appointment_datetime').strftime('%H:%M') if appt.get('appointment_datetime') else None,
+        "endTime": appt.get('appointment_end').strftime('%H:%M') if appt.get('appointment_end') else None,
+        "reason": appt.get('reason'),
+        "status": appt.get('status')
+    }
+
+
+def bench_serialize(args):
+    """Per-row cost of turning --rows appointment documents into a JSON listing, no database involved.
+
+    'handwritten' is the old per-handler row function encoded with Flask's
+    default provider (sorted keys); 'compiled' is the declared shape with
+    AppointixJSONProvider.
+    """
+    start = datetime(2030, 1, 1, 9, 0)
+    docs = [{'_id': ObjectId(), 'doctor_id': ObjectId(), 'doctor_name': f'Bench Doctor {i % 50}',
+             'appointment_datetime': start + timedelta(minutes=30 * i),
+             'appointment_end': start + timedelta(minutes=30 * i + 30), 'reason': 'benchmark',
+             'status': 'upcoming'} for i in range(args.rows)]
+    app = Flask(__name__)
+    modes = [('handwritten', handwritten_patient_row, DefaultJSONProvider(app)),
+             ('compiled', serializers.patient_appointment_row, serializers.AppointixJSONProvider(app))]
+    results = {}
+    for label, to_row, provider in modes:
+        timings = {}
+        for _ in range(3):  # Best of three
+            started = time.perf_counter()
+            rows = [to_row(doc) for doc in docs]
+            built = time.perf_counter()
+            provider.dumps(rows)
+            encoded = time.perf_counter()
+            for phase, seconds in (('build', built - started), ('encode', encoded - built),
+                                   ('total', encoded - started)):
+                timings[phase] = min(timings.get(phase, seconds), seconds)
+        results[label] = {f'{phase}_ns_per_row': round(seconds / args.rows * 1e9) for phase, seconds in timings.items()}
+    assert serializers.patient_appointment_row(docs[0]) == handwritten_patient_row(docs[0])
+    results['rows'] = args.rows
+    return results
+
+
+SCENARIOS = {
+    'login': bench_login,
+    'overload': bench_overload,
+    'serialize': bench_serialize,
+    'suite': bench_suite,
+}
+
+
+def summaries(results, prefix=''):
+    """Flattens a scenario's results into {name: summary} for every run_load() summary in it."""
+    found = {}
+    for key, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        name = f'{prefix}{key}'
+        if 'p95_ms' in value:
+            found[name] = value
+        else:
+            found.update(summaries(value, f'{name} / '))
+    return found
+
+
+def compare(results, baseline, tolerance):
+    """Lists runs whose p95 grew or whose throughput fell by more than `tolerance` (a fraction)."""
+    regressions = []
+    current = summaries(results)
+    for name, before in summaries(baseline).items():
+        after = current.get(name)
+        if not after:
+            continue
+        if before['p95_ms'] and after['p95_ms'] and after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+        if before['rps'] and after['rps'] and after['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: rps {before['rps']} -> {after['rps']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--mongo-uri', default=os.environ.get('APPOINTIX_MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--db-name', default='appointix_benchmark')
+    parser.add_argument('--in-memory', action='store_true', help='Use mongomock instead of a mongod.')
+    parser.add_argument('--sqlite', metavar='PATH', help='Use the embedded SQLite backend with this (scratch) file.')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--users', type=int, default=20, help='Distinct users that log in / act.')
+    parser.add_argument('--doctors', type=int, default=50)
+    parser.add_argument('--patients', type=int, default=500)
+    parser.add_argument('--appointments', type=int, default=5000)
+    parser.add_argument('--rows', type=int, default=100000, help='Appointment documents serialized (serialize).')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Documents per insert_many while seeding.')
+    parser.add_argument('--hash-workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--hash-queue', type=int, default=64)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare with the JSON of an earlier run of the same scenario.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed p95 growth / rps drop against the baseline (fraction, default 0.2).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {
+        'scenario': args.scenario,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'in_memory': args.in_memory,
+                        'concurrency': args.concurrency, 'requests': args.requests,
+                        'started_at': datetime.utcnow().isoformat(timespec='seconds')},
+        'results': SCENARIOS[args.scenario](args)
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results['results'], baseline['results'], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
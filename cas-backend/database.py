@@ -0,0 +1,81 @@
+"""Per-process, lazily created MongoDB client.
+
+MongoClient is not fork-safe: a client created in a parent process must not
+be used by forked workers. The client here is only created on first use and
+is recreated whenever the current process id differs from the one that
+created it, so the app can be imported (or even used) before workers fork.
+"""
+import os
+import threading
+
+from pymongo import MongoClient
+
+
+class MongoConnection:
+    """Holds the connection settings and the client of the current process."""
+
+    def __init__(self):
+        self.uri = None
+        self.dbname = None
+        self.client_options = {}
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def configure(self, uri, dbname, **client_options):
+        """Sets connection settings. An existing client is dropped and reopened lazily."""
+        with self._lock:
+            self.uri = uri
+            self.dbname = dbname
+            self.client_options = client_options
+            self._client = None
+            self._pid = None
+
+    @property
+    def client(self):
+        pid = os.getpid()
+        if self._client is None or self._pid != pid:
+            with self._lock:
+                if self._client is None or self._pid != pid:
+                    if self.uri is None:
+                        raise RuntimeError("MongoDB connection used before configure() was called")
+                    # A client inherited from a parent process is abandoned, never reused
+                    self._client = MongoClient(self.uri, **self.client_options)
+                    self._pid = pid
+        return self._client
+
+    @property
+    def database(self):
+        return self.client[self.dbname]
+
+    def close(self):
+        """Closes this process's client, e.g. in a parent before forking workers."""
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+
+class DatabaseProxy:
+    """Stands in for a pymongo Database, resolving the current process's client on access.
+
+    The connection can be a MongoConnection or an sqlite_store.SQLiteConnection;
+    create_app() binds the one selected by STORAGE_BACKEND.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def bind(self, connection):
+        self._connection = connection
+
+    @property
+    def connection(self):
+        return self._connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection.database, name)
+
+    def __getitem__(self, name):
+        return self._connection.database[name]
@@ -0,0 +1,140 @@
+"""In-memory prefix index for doctor search by name and specialization.
+
+Names and specializations are normalized (accents stripped, lower case)
+and split into words; every (word, doctor) pair sits in one sorted list.
+A query word is looked up by bisecting to its prefix and walking the run of
+words that start with it, so a lookup costs O(log n + matches) rather than
+a scan of the directory. Every query word must prefix some word of a
+doctor's name or specialization; results are ranked by how well they
+matched and cut to the limit with a heap.
+
+Registration and profile writes update the index of the process that made
+them; like the availability index, it is rebuilt from MongoDB periodically
+to pick up writes made by other worker processes.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+_WORD = re.compile(r'[a-z0-9]+')
+# Titles that would otherwise match every doctor for 'd' or 'dr'
+_IGNORED_WORDS = frozenset({'dr', 'doctor'})
+
+
+def normalize(text):
+    """Lower-cased text without accents, e.g. 'Dr. José' -> 'dr. jose'."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def words(text):
+    return _WORD.findall(normalize(text))
+
+
+class _Entry:
+    __slots__ = ('doctor_id', 'card', 'name', 'name_words', 'specialization', 'words')
+
+    def __init__(self, doctor_id, card):
+        self.doctor_id = doctor_id
+        self.card = card
+        self.name = normalize(card.get('name')).strip()
+        self.name_words = [w for w in words(card.get('name')) if w not in _IGNORED_WORDS]
+        self.specialization = normalize(card.get('specialization')).strip()
+        self.words = set(self.name_words) | set(words(card.get('specialization')))
+
+
+class DoctorSearchIndex:
+    """Thread-safe prefix index over doctor cards (the JSON returned to the client)."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}  # doctor id -> _Entry
+        self._words = []    # sorted (word, doctor id)
+        self.loaded_at = None
+
+    def load(self, cards, loaded_at):
+        """Replaces the index with `cards` (dicts with at least 'id', 'name' and 'specialization')."""
+        entries = {card['id']: _Entry(card['id'], card) for card in cards}
+        pairs = sorted((word, doctor_id) for doctor_id, entry in entries.items() for word in entry.words)
+        with self._lock:
+            self._entries, self._words, self.loaded_at = entries, pairs, loaded_at
+
+    def upsert(self, card):
+        entry = _Entry(card['id'], card)
+        with self._lock:
+            self._remove_words(card['id'])
+            self._entries[card['id']] = entry
+            for word in entry.words:
+                insort(self._words, (word, entry.doctor_id))
+
+    def remove(self, doctor_id):
+        with self._lock:
+            self._remove_words(doctor_id)
+            self._entries.pop(doctor_id, None)
+
+    def _remove_words(self, doctor_id):
+        old = self._entries.get(doctor_id)
+        if old is not None:
+            for word in old.words:
+                i = bisect_left(self._words, (word, doctor_id))
+                if i < len(self._words) and self._words[i] == (word, doctor_id):
+                    del self._words[i]
+
+    def _prefixed(self, prefix):
+        """Ids of doctors with a word starting with prefix."""
+        found = set()
+        i = bisect_left(self._words, (prefix,))
+        while i < len(self._words) and self._words[i][0].startswith(prefix):
+            found.add(self._words[i][1])
+            i += 1
+        return found
+
+    def search(self, query='', specialization='', limit=20):
+        """Returns up to `limit` cards matching every word of `query`, best first.
+
+        `specialization` is a prefix of the normalized specialization (e.g.
+        'cardio'). Full-word name matches rank above prefix matches, name
+        matches above specialization ones; ties go by name.
+        """
+        query_words = [w for w in words(query) if w not in _IGNORED_WORDS]
+        specialization = normalize(specialization).strip()
+        # Without a query, the specialization's first word still narrows the candidates via the index
+        lookups = set(query_words) or set(words(specialization)[:1])
+        with self._lock:
+            if lookups:
+                # Longest (most selective) prefix first; the others only filter that set
+                candidates = None
+                for word in sorted(lookups, key=len, reverse=True):
+                    matched = self._prefixed(word)
+                    candidates = matched if candidates is None else candidates & matched
+                    if not candidates:
+                        return []
+                entries = [self._entries[doctor_id] for doctor_id in candidates]
+            else:
+                entries = list(self._entries.values())
+        if specialization:
+            entries = [entry for entry in entries if entry.specialization.startswith(specialization)]
+        if query_words:
+            ranked = heapq.nsmallest(limit, entries, key=lambda entry: (-_score(entry, query_words), entry.name,
+                                                                        entry.doctor_id))
+        else:
+            # Nothing to score: alphabetical
+            ranked = heapq.nsmallest(limit, entries, key=lambda entry: (entry.name, entry.doctor_id))
+        return [entry.card for entry in ranked]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _score(entry, query_words):
+    score = 0
+    for word in query_words:
+        if word in entry.name_words:
+            score += 4
+        elif any(name_word.startswith(word) for name_word in entry.name_words):
+            score += 3 if entry.name_words and entry.name_words[0].startswith(word) else 2
+        else:
+            score += 1  # Matched the specialization only
+    return score
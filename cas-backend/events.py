@@ -0,0 +1,198 @@
+"""Appointment change events for live dashboards (server-sent events).
+
+Every change to an appointment (created, rescheduled, cancelled, completed,
+expired) is published under the topics of its doctor and its patient, and
+each open /api/appointments/events stream subscribes to the caller's topic.
+
+EventBroker is an in-process pub/sub: with EVENTS_SOURCE='local' the write
+handlers publish to it directly, so a stream only sees changes made by its
+own worker process. With EVENTS_SOURCE='change-stream' (MongoDB replica set)
+the handlers stay silent and a ChangeStreamRelay in every worker feeds the
+broker from db.appointments.watch() instead, so every stream sees every
+change no matter which worker made it.
+
+Event ids are '<broker epoch>-<sequence>'. A reconnecting EventSource sends
+the last id it saw; if it came from this broker and is still in the recent
+history the missed events are replayed, otherwise the client gets a
+'resync' event telling it to refetch its list once.
+"""
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+from serializers import appointment_data
+
+
+EVENT_KINDS = ('created', 'rescheduled', 'cancelled', 'completed', 'expired')
+
+
+def doctor_topic(doctor_id):
+    return f"doctor:{doctor_id}"
+
+
+def patient_topic(patient_id):
+    return f"patient:{patient_id}"
+
+
+def appointment_event(kind, appointment):
+    """Returns (topics, payload) for a change to an appointment document."""
+    payload = {'type': kind, 'appointment': appointment_data(appointment)}
+    return [doctor_topic(appointment.get('doctor_id')), patient_topic(appointment.get('patient_id'))], payload
+
+
+class Subscription:
+    """Bounded queue of events for one stream. Overflow turns into a single 'resync' event."""
+    __slots__ = ('topics', '_queue', '_overflowed')
+
+    def __init__(self, topics, size):
+        self.topics = frozenset(topics)
+        self._queue = queue.Queue(maxsize=size)
+        self._overflowed = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout):
+        """Returns the next event, or None if none arrived within `timeout` seconds."""
+        if self._overflowed:
+            self._overflowed = False
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            return {'id': None, 'type': 'resync'}
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Thread-safe topic fan-out with a short replay history."""
+
+    def __init__(self, history=1000, queue_size=256):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}  # topic -> set of Subscription
+        self._history = deque(maxlen=history)  # (sequence, topics, event)
+        self._sequence = itertools.count(1)
+        self.epoch = uuid.uuid4().hex[:8]
+        self.published = 0
+
+    def configure(self, history, queue_size):
+        with self._lock:
+            self._history = deque(self._history, maxlen=history)
+            self.queue_size = queue_size
+
+    def publish(self, topics, payload):
+        with self._lock:
+            sequence = next(self._sequence)
+            event = {'id': f"{self.epoch}-{sequence}", **payload}
+            self._history.append((sequence, frozenset(topics), event))
+            self.published += 1
+            targets = set()
+            for topic in topics:
+                targets.update(self._subscribers.get(topic, ()))
+        for subscription in targets:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, topics, last_event_id=None):
+        """Registers a stream. Events missed since last_event_id are queued first (or a resync)."""
+        subscription = Subscription(topics, self.queue_size)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+            if last_event_id:
+                for event in self._replay(subscription.topics, last_event_id):
+                    subscription.put(event)
+        return subscription
+
+    def _replay(self, topics, last_event_id):
+        epoch, _, sequence = last_event_id.partition('-')
+        oldest = self._history[0][0] if self._history else None
+        if epoch != self.epoch or not sequence.isdigit() or oldest is None or int(sequence) < oldest - 1:
+            # Another worker, a restart, or too long ago: the client has to refetch
+            return [{'id': None, 'type': 'resync'}]
+        return [event for seq, event_topics, event in self._history
+                if seq > int(sequence) and not topics.isdisjoint(event_topics)]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._subscribers.values())) if self._subscribers else 0
+
+
+def change_to_event(change):
+    """Maps a db.appointments change stream document to (kind, appointment) or None."""
+    appointment = change.get('fullDocument')
+    if appointment is None:
+        return None  # Deletes (archiving) and updates of documents deleted since
+    operation = change.get('operationType')
+    if operation == 'insert':
+        return 'created', appointment
+    if operation in ('update', 'replace'):
+        fields = (change.get('updateDescription') or {}).get('updatedFields', {})
+        if fields.get('status') in EVENT_KINDS:
+            return fields['status'], appointment
+        if 'appointment_datetime' in fields:
+            return 'rescheduled', appointment
+    return None
+
+
+class ChangeStreamRelay:
+    """Feeds a broker from a MongoDB change stream on a daemon thread, resuming after errors.
+
+    Like Sweeper it is started lazily per worker process, since a thread (or
+    cursor) from before the workers fork would not exist in them.
+    """
+
+    def __init__(self, broker, collection, logger=None, retry_seconds=5.0):
+        self._broker = broker
+        self._collection = collection  # callable returning the collection to watch
+        self.logger = logger
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+        self._resume_token = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._resume_token = None
+                threading.Thread(target=self._loop, name='appointment-change-stream', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            try:
+                with self._collection().watch(full_document='updateLookup',
+                                              resume_after=self._resume_token) as stream:
+                    for change in stream:
+                        self._resume_token = stream.resume_token
+                        mapped = change_to_event(change)
+                        if mapped is not None:
+                            topics, payload = appointment_event(*mapped)
+                            self._broker.publish(topics, payload)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Appointment change stream failed, retrying in {self.retry_seconds}s: {e}")
+                time.sleep(self.retry_seconds)
@@ -0,0 +1,64 @@
+"""Gunicorn settings for running the Appointix backend in production.
+
+    cd cas-backend
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py 'server:create_app()'
+
+Every worker process builds its own create_app() instance, and with it its
+own MongoDB client or SQLite connections. Indexes are created once, in the
+master, before any worker starts. Workers are recycled after a few thousand
+requests and killed if they stop responding. On SIGTERM each worker drains
+first: readiness turns 503 and event streams close so browsers reconnect
+elsewhere. Settings below can be overridden on the command line or through
+GUNICORN_CMD_ARGS; the app itself still reads APPOINTIX_* variables.
+"""
+import os
+import signal
+
+bind = f"{os.environ.get('APPOINTIX_HOST', '0.0.0.0')}:{os.environ.get('APPOINTIX_PORT', 5001)}"
+workers = int(os.environ.get('APPOINTIX_WORKERS', os.cpu_count() or 1))
+# Threaded workers: each open event stream holds a thread for up to EVENTS_STREAM_MAX_SECONDS
+worker_class = 'gthread'
+threads = int(os.environ.get('APPOINTIX_THREADS', 32))
+backlog = 2048
+timeout = 60 # Seconds a worker may go silent before it is killed and replaced
+graceful_timeout = int(float(os.environ.get('APPOINTIX_GRACE_SECONDS', 30)))
+# Recycle workers so slow leaks cannot build up; the jitter keeps them from restarting together
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
+# %(U)s is the path without its query string: URLs may carry event stream tickets and cursors
+access_log_format = '%(h)s "%(m)s %(U)s %(H)s" %(s)s %(B)s %(M)sms'
+
+
+def on_starting(arbiter):
+    """Creates indexes (and verifies query plans) once, before the workers fork."""
+    if os.environ.get('APPOINTIX_SKIP_BOOTSTRAP'):
+        return
+    import server
+    app = server.create_app()
+    with app.app_context():
+        server.bootstrap_database(verify=app.config['VERIFY_QUERY_PLANS'])
+    # Never carry a MongoClient (or SQLite connection) across fork; each worker opens its own
+    server.db.connection.close()
+
+
+def post_worker_init(worker):
+    import server
+    app = worker.wsgi
+    try:
+        # Build the doctor search index before the first search has to wait for it
+        with app.app_context():
+            server.get_doctor_search_index()
+    except Exception as e:
+        worker.log.warning(f"Worker {os.getpid()} could not preload the doctor search index: {e}")
+
+    stop = worker.handle_exit
+
+    def drain(signum, frame):
+        # Readiness turns 503 and event streams end before gunicorn waits out in-flight requests
+        app.config['DRAINING'] = True
+        stop(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
@@ -0,0 +1,98 @@
+"""Password hashing off the request thread.
+
+PBKDF2/scrypt hashing is deliberately slow, so running it inline pins a
+request worker for the whole computation. PasswordHasher runs it in a
+process pool instead. Admission is bounded: at most `workers + queue_limit`
+hashes may be running or waiting, and callers beyond that get
+HasherBusyError immediately so the API can answer 503 instead of queueing.
+A hash whose caller timed out keeps its place until the pool finishes it.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusyError(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+def hash_method(pwhash):
+    """Returns the method part of a werkzeug hash, e.g. 'pbkdf2:sha256:600000'."""
+    return pwhash.split('$', 1)[0] if pwhash else ''
+
+
+class PasswordHasher:
+    """Bounded process pool for generate_password_hash / check_password_hash.
+
+    With workers=0 hashing runs inline on the calling thread (still subject
+    to the admission limit), which is useful on hosts where a process pool
+    is not wanted.
+    """
+
+    def __init__(self, method='scrypt:32768:8:1', workers=2, queue_limit=32, timeout=10.0):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.configure(method, workers, queue_limit, timeout)
+
+    def configure(self, method, workers, queue_limit, timeout):
+        with self._lock:
+            self.method = method
+            self.workers = workers
+            self.queue_limit = queue_limit
+            self.timeout = timeout
+            self._slots = threading.BoundedSemaphore(max(1, workers) + queue_limit)
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _pool(self):
+        # Created lazily per process: a pool inherited through fork is not usable
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = pid
+        return self._executor
+
+    def _run(self, fn, *args):
+        slots = self._slots  # configure() may swap it; release the one acquired
+        if not slots.acquire(blocking=False):
+            raise HasherBusyError("Password hashing capacity exhausted")
+        if self.workers <= 0:
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the hash really stops running, not until this caller gives up on it,
+        # so timed-out hashes still count against the limit while they burn CPU in the pool
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            future.cancel()  # Only stops it if it has not started yet
+            raise HasherBusyError("Password hashing timed out")
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if a stored hash was made with different parameters than the configured ones."""
+        return hash_method(pwhash) != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
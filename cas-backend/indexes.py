@@ -0,0 +1,146 @@
+"""Index bootstrap and query-plan verification for the Appointix collections.
+
+ensure_indexes() is idempotent: create_index is a no-op when an index with
+the same name and keys already exists. verify_query_plans() runs explain()
+for every query shape the API handlers issue and raises QueryPlanError if
+any of them would scan a whole collection.
+"""
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+from pagination import SORT as PAGE_SORT, SYNC_SORT, after_cursor, changed_after, encode_cursor
+from slot_claims import ensure_claim_indexes
+from stats import STATS_COLLECTION
+from sweeper import ARCHIVE_COLLECTION, FINISHED_STATUSES
+
+# collection -> list of (keys, options)
+INDEXES = {
+    'appointments': [
+        # Doctor dashboard pages: find({'doctor_id'}).sort([('appointment_datetime', -1), ('_id', -1)])
+        ([('doctor_id', ASCENDING), ('appointment_datetime', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'doctor_datetime_id'}),
+        # Patient dashboard pages: find({'patient_id'}).sort([('appointment_datetime', -1), ('_id', -1)])
+        ([('patient_id', ASCENDING), ('appointment_datetime', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'patient_datetime_id'}),
+        # Delta sync (?since=): find({'doctor_id', <changed after>}).sort([('updated_at', 1), ('_id', 1)])
+        ([('doctor_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)], {'name': 'doctor_updated_id'}),
+        ([('patient_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)], {'name': 'patient_updated_id'}),
+        # Sweeper: stale upcoming / old finished appointments across all doctors
+        ([('status', ASCENDING), ('appointment_datetime', ASCENDING)], {'name': 'status_datetime'}),
+    ],
+    # Listings with ?history=1 page through the archive with the same sort as the hot collection
+    ARCHIVE_COLLECTION: [
+        ([('doctor_id', ASCENDING), ('appointment_datetime', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'doctor_datetime_id'}),
+        ([('patient_id', ASCENDING), ('appointment_datetime', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'patient_datetime_id'}),
+    ],
+    # Per-doctor daily counters: one document per (doctor, day), read by day range
+    STATS_COLLECTION: [
+        ([('doctor_id', ASCENDING), ('day', ASCENDING)], {'name': 'doctor_day_unique', 'unique': True}),
+    ],
+    'users': [
+        ([('email', ASCENDING)], {'name': 'email_unique', 'unique': True}),
+    ],
+    'doctors': [
+        ([('user_id', ASCENDING)], {'name': 'user_id_unique', 'unique': True}),
+    ],
+}
+
+# Indexes superseded by the ones above, or serving queries no handler runs any more (conflict
+# checks now go through slot claims); dropped by ensure_indexes() if present
+RETIRED_INDEXES = {
+    'appointments': ['doctor_datetime', 'patient_datetime', 'doctor_status_datetime'],
+}
+
+
+class QueryPlanError(Exception):
+    """Raised when a handler query shape is not served by an index."""
+
+
+def ensure_indexes(db, logger=None):
+    """Creates every index the API relies on. Safe to run on every startup."""
+    for collection_name, names in RETIRED_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                db[collection_name].drop_index(name)
+                if logger:
+                    logger.info(f"Index dropped: {collection_name}.{name}")
+    for collection_name, specs in INDEXES.items():
+        for keys, options in specs:
+            name = db[collection_name].create_index(keys, **options)
+            if logger:
+                logger.info(f"Index ensured: {collection_name}.{name}")
+    ensure_claim_indexes(db)
+
+
+def query_shapes():
+    """Returns (label, collection, filter, sort) for each query the handlers run.
+
+    Values are placeholders; only the shape matters to the query planner.
+    """
+    oid = ObjectId()
+    now = datetime.utcnow()
+    return [
+        ('appointments by doctor', 'appointments',
+         {'doctor_id': oid}, PAGE_SORT),
+        ('appointments by patient', 'appointments',
+         {'patient_id': oid}, PAGE_SORT),
+        ('next appointment page by patient', 'appointments',
+         {'patient_id': oid, '$and': [after_cursor(encode_cursor({'appointment_datetime': now, '_id': oid}))]},
+         PAGE_SORT),
+        ('appointment changes by doctor', 'appointments',
+         {'doctor_id': oid, **changed_after((now, oid))}, SYNC_SORT),
+        ('appointment changes by patient', 'appointments',
+         {'patient_id': oid, **changed_after((now, oid))}, SYNC_SORT),
+        ('appointment by id', 'appointments', {'_id': oid}, None),
+        ('stale upcoming appointments', 'appointments',
+         {'status': 'upcoming', 'appointment_datetime': {'$lt': now}}, None),
+        ('finished appointments to archive', 'appointments',
+         {'status': {'$in': FINISHED_STATUSES}, 'appointment_datetime': {'$lt': now}}, None),
+        ('archived appointments by doctor', ARCHIVE_COLLECTION, {'doctor_id': oid}, PAGE_SORT),
+        ('archived appointments by patient', ARCHIVE_COLLECTION, {'patient_id': oid}, PAGE_SORT),
+        ('stats of doctor by day', STATS_COLLECTION, {'doctor_id': oid, 'day': {'$gte': now, '$lte': now}}, None),
+        ('stats of doctors by day', STATS_COLLECTION,
+         {'doctor_id': {'$in': [oid, oid]}, 'day': {'$gte': now, '$lte': now}}, None),
+        ('user by email', 'users', {'email': 'plan-check@example.com'}, None),
+        ('user by id', 'users', {'_id': oid}, None),
+        ('doctor by user', 'doctors', {'user_id': oid}, None),
+        ('doctor by id', 'doctors', {'_id': oid}, None),
+        ('claim by appointment', 'slot_claims', {'appointment_id': oid}, None),
+        ('claims of doctor in range', 'slot_claims',
+         {'doctor_id': oid, 'slot_start': {'$gte': now, '$lt': now}}, None),
+    ]
+
+
+def _plan_stages(plan):
+    """Yields every stage name in an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for key in ('inputStage', 'queryPlan', 'innerStage', 'outerStage'):
+            if key in plan:
+                yield from _plan_stages(plan[key])
+        for child in plan.get('inputStages', []):
+            yield from _plan_stages(child)
+
+
+def verify_query_plans(db, logger=None):
+    """Explains each handler query shape and raises QueryPlanError on any COLLSCAN."""
+    failures = []
+    for label, collection_name, query, sort in query_shapes():
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = cursor.limit(1).explain()
+        winning_plan = explanation.get('queryPlanner', {}).get('winningPlan', {})
+        stages = list(_plan_stages(winning_plan))
+        if logger:
+            logger.info(f"Query plan for {label}: {' <- '.join(stages) or 'unknown'}")
+        if 'COLLSCAN' in stages:
+            failures.append(f"{label} ({collection_name}: {query})")
+    if failures:
+        raise QueryPlanError("Collection scans detected for: " + "; ".join(failures))
@@ -0,0 +1,129 @@
+"""Content-addressed, reference-counted storage for uploaded profile pictures.
+
+Each file is stored once under '<sha256>.<ext>', the digest being computed
+while the upload is streamed to disk. A document in media_refs counts how
+many doctors point at each file; the file is removed only when that count
+drops to zero. Because names are derived from content, a URL never changes
+meaning and can be cached forever.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+MEDIA_COLLECTION = 'media_refs'
+CHUNK_SIZE = 64 * 1024
+CONTENT_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+def is_content_name(filename):
+    """True for files stored by this module (as opposed to legacy uuid-prefixed uploads)."""
+    return bool(CONTENT_NAME.match(filename or ''))
+
+
+def write_content_addressed(stream, folder, extension):
+    """Streams an upload into a temp file while hashing it.
+
+    Returns (filename, temp_path). The caller registers the reference and then
+    calls publish() to move the temp file into place.
+    """
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return f"{digest.hexdigest()}.{extension.lower()}", temp_path
+
+
+def publish(temp_path, folder, filename):
+    """Atomically moves a written upload to its content name (identical content may already be there)."""
+    os.replace(temp_path, os.path.join(folder, filename))
+
+
+def add_reference(db, filename):
+    """Takes one reference to a stored file; callers publish() the file right after.
+
+    If a concurrent release_reference() just dropped the last reference, the
+    upsert re-creates the document and publish() puts the file back.
+    """
+    db[MEDIA_COLLECTION].update_one(
+        {'_id': filename},
+        {'$inc': {'refcount': 1}, '$setOnInsert': {'created_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def release_reference(db, filename, folder, logger=None):
+    """Drops one reference to a stored file and deletes the file when none remain.
+
+    Legacy (non content-named) files were never shared, so they are deleted
+    directly. Returns True if a file was removed from disk.
+    """
+    path = os.path.join(folder, filename)
+    if not is_content_name(filename):
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    refs = db[MEDIA_COLLECTION]
+    remaining = refs.find_one_and_update({'_id': filename}, {'$inc': {'refcount': -1}},
+                                         return_document=ReturnDocument.AFTER)
+    if remaining is None or remaining.get('refcount', 0) > 0:
+        return False
+    # Only the request that removes the zero-count document deletes the file
+    if refs.find_one_and_delete({'_id': filename, 'refcount': {'$lte': 0}}) is None:
+        return False
+    # Move the file aside first: an upload of the same content may re-create the reference
+    # and publish it meanwhile, and then the (identical) file goes back instead
+    doomed = os.path.join(folder, f'.release-{uuid.uuid4().hex}')
+    try:
+        os.replace(path, doomed)
+        if refs.find_one({'_id': filename}, {'_id': 1}) is not None:
+            os.replace(doomed, path)
+            return False
+        os.remove(doomed)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        if logger:
+            logger.error(f"Failed to delete unreferenced profile picture {path}: {e}")
+        return False
+
+
+def migrate_legacy_uploads(db, folder, logger=None):
+    """Re-stores every doctor's legacy profile picture under its content name.
+
+    Byte-identical legacy copies collapse into one file with a reference per
+    doctor. Returns the number of doctors whose picture was migrated.
+    """
+    migrated = 0
+    for doctor in db.doctors.find({'profile_picture_url': {'$ne': None}}, {'profile_picture_url': 1}):
+        legacy_name = os.path.basename(doctor['profile_picture_url'])
+        legacy_path = os.path.join(folder, legacy_name)
+        if is_content_name(legacy_name) or not os.path.exists(legacy_path):
+            continue
+        with open(legacy_path, 'rb') as stream:
+            filename, temp_path = write_content_addressed(stream, folder, legacy_name.rsplit('.', 1)[-1])
+        add_reference(db, filename)
+        publish(temp_path, folder, filename)
+        db.doctors.update_one({'_id': doctor['_id']},
+                              {'$set': {'profile_picture_url': f"/uploads/profile_pics/{filename}"}})
+        os.remove(legacy_path)
+        migrated += 1
+        if logger:
+            logger.info(f"Migrated profile picture {legacy_name} -> {filename}")
+    return migrated
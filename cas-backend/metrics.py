@@ -0,0 +1,221 @@
+"""In-process request and MongoDB metrics in the Prometheus text format.
+
+Every request records its route template (e.g. '/api/doctors/<doctor_id>/slots'),
+method, status and latency; a pymongo CommandListener attributes each
+MongoDB command to the route whose thread issued it. Recording is a dict
+update and a bisect under one lock, cheap enough to leave on in production.
+
+Each worker process keeps its own numbers, so with several workers each one
+is a separate scrape target (or /metrics shows whichever worker answered).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+NO_ROUTE = '-'
+
+
+class Histogram:
+    """Bucket counts (non-cumulative until rendered), sum and count for one label set."""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * (size + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, buckets, value):
+        self.counts[bisect_left(buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_le(bound):
+    return '+Inf' if bound is None else repr(float(bound))
+
+
+class Metrics:
+    """Registry for one process. Call begin_request/end_request around each request."""
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS):
+        self.latency_buckets = tuple(latency_buckets)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = {}    # (route, method, status) -> count
+        self._latency = {}     # (route, method) -> Histogram
+        self._commands_per_request = {}  # route -> Histogram
+        self._mongo = {}       # (route, command) -> [count, failures, seconds]
+        self._gauges = []      # callables, see add_gauges()
+        self.start_time = time.time()
+        self.command_listener = _CommandListener(self)
+
+    # --- Request lifecycle (called from Flask hooks) ---
+
+    def begin_request(self, route):
+        state = self._local
+        state.route = route
+        state.started = time.perf_counter()
+        state.commands = 0
+
+    def end_request(self, method, status):
+        state = self._local
+        started = getattr(state, 'started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        state.started = None
+        route = state.route
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get((route, method))
+            if histogram is None:
+                histogram = self._latency[(route, method)] = Histogram(len(self.latency_buckets))
+            histogram.observe(self.latency_buckets, duration)
+            per_request = self._commands_per_request.get(route)
+            if per_request is None:
+                per_request = self._commands_per_request[route] = Histogram(len(COMMANDS_PER_REQUEST_BUCKETS))
+            per_request.observe(COMMANDS_PER_REQUEST_BUCKETS, state.commands)
+
+    # --- MongoDB commands (called from the listener, on the issuing thread) ---
+
+    def record_command(self, command, duration_micros, failed):
+        state = self._local
+        # Streamed responses fetch further batches after the request hooks ran; the route is
+        # left in place until the thread's next request so those getMores are still attributed.
+        route = getattr(state, 'route', NO_ROUTE)
+        if getattr(state, 'started', None) is not None:
+            state.commands += 1
+        with self._lock:
+            entry = self._mongo.get((route, command))
+            if entry is None:
+                entry = self._mongo[(route, command)] = [0, 0, 0.0]
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] += duration_micros / 1e6
+
+    def add_gauges(self, collect):
+        """Registers a callable returning [(name, help, label_names, {label_values: value})]."""
+        self._gauges.append(collect)
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._latency.clear()
+            self._commands_per_request.clear()
+            self._mongo.clear()
+
+    # --- Exposition ---
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = sorted((k, (list(h.counts), h.sum, h.count)) for k, h in self._latency.items())
+            per_request = sorted((k, (list(h.counts), h.sum, h.count))
+                                 for k, h in self._commands_per_request.items())
+            mongo = sorted((k, list(v)) for k, v in self._mongo.items())
+
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, label_names, buckets, rows):
+            for label_values, (counts, total, count) in rows:
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + [None], counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_le(bound)}"'
+                    lines.append(f'{name}_bucket{_labels(label_names, label_values, le)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(label_names, label_values)} {total}')
+                lines.append(f'{name}_count{_labels(label_names, label_values)} {count}')
+
+        header('appointix_http_requests_total', 'counter', 'HTTP requests by route template, method and status.')
+        for labels, count in requests:
+            lines.append(f"appointix_http_requests_total{_labels(('route', 'method', 'status'), labels)} {count}")
+
+        header('appointix_http_request_duration_seconds', 'histogram', 'Time spent handling a request.')
+        histogram('appointix_http_request_duration_seconds', ('route', 'method'), self.latency_buckets, latency)
+
+        header('appointix_http_request_mongo_commands', 'histogram', 'MongoDB commands issued per request.')
+        histogram('appointix_http_request_mongo_commands', ('route',), COMMANDS_PER_REQUEST_BUCKETS,
+                  [((route,), values) for route, values in per_request])
+
+        header('appointix_mongo_commands_total', 'counter', 'MongoDB commands by issuing route and command name.')
+        for labels, (count, _, _) in mongo:
+            lines.append(f"appointix_mongo_commands_total{_labels(('route', 'command'), labels)} {count}")
+        header('appointix_mongo_command_failures_total', 'counter', 'MongoDB commands that failed.')
+        for labels, (_, failures, _) in mongo:
+            lines.append(f"appointix_mongo_command_failures_total{_labels(('route', 'command'), labels)} {failures}")
+        header('appointix_mongo_command_seconds_total', 'counter', 'Time spent in MongoDB commands.')
+        for labels, (_, _, seconds) in mongo:
+            lines.append(f"appointix_mongo_command_seconds_total{_labels(('route', 'command'), labels)} {seconds}")
+
+        for name, text, label_names, values in self._process_gauges() + [
+                g for collect in self._gauges for g in collect()]:
+            header(name, 'gauge' if not name.endswith('_total') else 'counter', text)
+            for label_values, value in sorted(values.items()):
+                lines.append(f'{name}{_labels(label_names, label_values)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _process_gauges(self):
+        cpu = os.times()
+        gauges = [
+            ('process_cpu_seconds_total', 'User and system CPU time of this process.', (),
+             {(): cpu.user + cpu.system}),
+            ('process_start_time_seconds', 'Start time of this process (Unix time).', (), {(): self.start_time}),
+            ('appointix_process_threads', 'Live Python threads in this process.', (),
+             {(): threading.active_count()}),
+            ('appointix_process_info', 'Worker process id.', ('pid',), {(os.getpid(),): 1}),
+        ]
+        rss = _resident_memory_bytes()
+        if rss is not None:
+            gauges.append(('process_resident_memory_bytes', 'Resident memory size.', (), {(): rss}))
+        try:
+            gauges.append(('process_open_fds', 'Open file descriptors.', (), {(): len(os.listdir('/proc/self/fd'))}))
+        except OSError:
+            pass
+        return gauges
+
+
+def _resident_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None  # Not Linux
+
+
+class _CommandListener(monitoring.CommandListener):
+    """Feeds every MongoDB command of the clients it is registered with into a Metrics registry."""
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._metrics.record_command(event.command_name, event.duration_micros, 0)
+
+    def failed(self, event):
+        self._metrics.record_command(event.command_name, event.duration_micros, 1)
@@ -0,0 +1,133 @@
+"""Keyset pagination over (appointment_datetime, _id), newest first.
+
+Cursors are opaque to clients: URL-safe base64 of the sort key of the last
+row on the previous page. Each page is a bounded index range scan, so the
+cost of a page does not depend on how much history precedes it.
+
+Sync tokens work the same way over (updated_at, _id), oldest change first:
+every appointment write stamps updated_at, and ?since=<token> returns the
+rows changed after the token's position, read from an index range that
+only holds those changes.
+
+Both kinds of token carry their kind and issue time and are signed with an
+HMAC of the app's SECRET_KEY (see configure()), so a client cannot forge a
+position, pass a cursor as a sync token, or keep using a token past its
+maximum age.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+SORT = [('appointment_datetime', DESCENDING), ('_id', DESCENDING)]
+SYNC_SORT = [('updated_at', ASCENDING), ('_id', ASCENDING)]
+# Sorts before every real id; a token at (t, MIN_ID) selects every change from t on
+MIN_ID = ObjectId('0' * 24)
+
+CURSOR, SYNC = 'cursor', 'sync'
+_settings = {'secret': b'', 'max_age': {CURSOR: None, SYNC: None}}
+
+
+class TokenExpiredError(ValueError):
+    """Raised for a well-formed token older than its maximum age; the client should reload the list."""
+
+
+def configure(secret_key, cursor_max_age=None, sync_max_age=None):
+    """Sets the signing key and the maximum ages (seconds, None for no limit) of cursors and sync tokens."""
+    _settings['secret'] = secret_key.encode() if isinstance(secret_key, str) else secret_key
+    _settings['max_age'] = {CURSOR: cursor_max_age, SYNC: sync_max_age}
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode((text + '=' * (-len(text) % 4)).encode())
+
+
+def _signature(kind, body):
+    return hmac.new(_settings['secret'], f'{kind}.{body}'.encode(), hashlib.sha256).digest()[:16]
+
+
+def _encode(kind, when, oid, now=None):
+    issued = int(time.time() if now is None else now)
+    body = _b64(json.dumps({'t': when.isoformat(), 'id': str(oid), 'iat': issued}, separators=(',', ':')).encode())
+    return f'{body}.{_b64(_signature(kind, body))}'
+
+
+def _decode(kind, token, now=None):
+    body, signature = token.split('.')
+    if not hmac.compare_digest(_unb64(signature), _signature(kind, body)):
+        raise ValueError('bad signature')
+    key = json.loads(_unb64(body))
+    position = datetime.fromisoformat(key['t']), ObjectId(key['id'])
+    max_age = _settings['max_age'][kind]
+    now = time.time() if now is None else now
+    if max_age is not None and now - key['iat'] > max_age:
+        raise TokenExpiredError(f"The {'pagination cursor' if kind == CURSOR else 'sync token'} has expired")
+    return position
+
+
+def encode_cursor(appt, now=None):
+    """Builds the next-page token from the last appointment document of a page."""
+    return _encode(CURSOR, appt['appointment_datetime'], appt['_id'], now)
+
+
+def sort_key(appt):
+    """The key SORT orders documents by, for merging already sorted result sets (use reverse=True)."""
+    return appt['appointment_datetime'], appt['_id']
+
+
+def decode_cursor(token, now=None):
+    """Returns (datetime, ObjectId) from a token.
+
+    Raises TokenExpiredError if it is too old and ValueError if it is malformed or not signed by us.
+    """
+    try:
+        return _decode(CURSOR, token, now)
+    except TokenExpiredError:
+        raise
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+def after_cursor(token):
+    """Returns the filter selecting rows that sort after the cursor position."""
+    cursor_datetime, cursor_id = decode_cursor(token)
+    return {'$or': [
+        {'appointment_datetime': {'$lt': cursor_datetime}},
+        {'appointment_datetime': cursor_datetime, '_id': {'$lt': cursor_id}}
+    ]}
+
+
+def encode_sync_token(updated_at, oid=MIN_ID, now=None):
+    """Builds a sync token for the position (updated_at, oid) in SYNC_SORT order."""
+    return _encode(SYNC, updated_at, oid, now)
+
+
+def decode_sync_token(token, now=None):
+    """Returns (datetime, ObjectId) from a sync token.
+
+    Raises TokenExpiredError if it is too old and ValueError if it is malformed or not signed by us.
+    """
+    try:
+        return _decode(SYNC, token, now)
+    except TokenExpiredError:
+        raise
+    except Exception:
+        raise ValueError("Invalid sync token")
+
+
+def changed_after(position):
+    """Returns the filter selecting rows changed after a decoded sync token position."""
+    updated_at, oid = position
+    return {'$or': [
+        {'updated_at': {'$gt': updated_at}},
+        {'updated_at': updated_at, '_id': {'$gt': oid}}
+    ]}
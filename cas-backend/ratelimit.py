@@ -0,0 +1,176 @@
+"""Token-bucket rate limiting and load shedding.
+
+A budget such as '10/minute' is a bucket of 10 tokens that refills at 10
+per minute; each request takes one token and is refused with 429 while the
+bucket is empty. Buckets are keyed by route plus client IP or user id.
+
+Buckets live either in this process (MemoryBuckets) or in a memory-mapped
+file that every worker on the host opens (SharedBuckets, the default where
+fcntl exists), so a client cannot multiply its budget by the number of
+worker processes. The file is a fixed-size hash table: a take() is one
+locked read-modify-write of a 24-byte slot, and when a probe window is
+full the bucket touched longest ago is recycled (it has refilled anyway).
+
+AdmissionControl caps the requests one worker handles at a time and lets
+the caller shed the rest with a fast 503 instead of queueing them.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: one worker process there (no fork), so memory buckets suffice
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(text):
+    """Returns (capacity, period_seconds) for '<count>/<second|minute|hour|day>'. Raises ValueError."""
+    try:
+        count, _, period = str(text).partition('/')
+        capacity, seconds = int(count), PERIODS[period.strip().rstrip('s') or 'second']
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate '{text}' (expected e.g. '10/minute')")
+    if capacity < 1:
+        raise ValueError(f"Invalid rate '{text}': the count must be at least 1")
+    return capacity, seconds
+
+
+def _take(tokens, stamp, now, capacity, seconds):
+    """Refills a bucket to `now` and takes a token. Returns (tokens, retry_after or None)."""
+    tokens = min(capacity, tokens + max(0.0, now - stamp) * capacity / seconds)
+    if tokens >= 1:
+        return tokens - 1, None
+    return tokens, (1 - tokens) * seconds / capacity
+
+
+class MemoryBuckets:
+    """Buckets of one process, LRU-bounded to max_keys."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, stamp)
+
+    def take(self, key, capacity, seconds, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (capacity, now))
+            tokens, retry_after = _take(tokens, stamp, now, capacity, seconds)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SharedBuckets:
+    """Buckets in a memory-mapped file shared by every process that opens the same path."""
+    SLOT = struct.Struct('<Qdd')  # key hash (0 = empty), tokens, last update (Unix time)
+    PROBES = 8
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()  # flock does not exclude threads sharing the descriptor
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def _mapped(self):
+        # Opened per process: a descriptor inherited across fork would share one flock
+        if self._pid != os.getpid():
+            size = self.slots * self.SLOT.size
+            f = open(self.path, 'a+b')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            self._file, self._map, self._pid = f, mmap.mmap(f.fileno(), size), os.getpid()
+        return self._map
+
+    def take(self, key, capacity, seconds, now=None):
+        now = time.time() if now is None else now
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        with self._lock:
+            buckets = self._mapped()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                offset, tokens, stamp = self._find(buckets, digest, capacity, now)
+                tokens, retry_after = _take(tokens, stamp, now, capacity, seconds)
+                self.SLOT.pack_into(buckets, offset, digest, tokens, now)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        return retry_after
+
+    def _find(self, buckets, digest, capacity, now):
+        """Returns (offset, tokens, stamp) of the key's slot, claiming an empty or stalest one if new."""
+        stalest = None
+        for probe in range(self.PROBES):
+            offset = ((digest + probe) % self.slots) * self.SLOT.size
+            slot_digest, tokens, stamp = self.SLOT.unpack_from(buckets, offset)
+            if slot_digest == digest:
+                return offset, tokens, stamp
+            if slot_digest == 0:
+                return offset, capacity, now
+            if stalest is None or stamp < stalest[1]:
+                stalest = (offset, stamp)
+        return stalest[0], capacity, now
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._map.close()
+            self._file.close()
+        self._pid = self._file = self._map = None
+
+
+class RateLimiter:
+    """Per-route budgets over a bucket store. check() returns None or the seconds to wait."""
+
+    def __init__(self):
+        self.buckets = MemoryBuckets()
+        self._lock = threading.Lock()
+        self.limited = {}  # (route, scope) -> requests refused
+
+    def use(self, buckets):
+        previous, self.buckets = self.buckets, buckets
+        if previous is not buckets and hasattr(previous, 'close'):
+            previous.close()
+
+    def check(self, route, scope, identity, rate):
+        """Takes a token from the (route, scope, identity) bucket for a parse_rate() budget."""
+        capacity, seconds = rate
+        retry_after = self.buckets.take(f"{route}:{scope}:{identity}", capacity, seconds)
+        if retry_after is not None:
+            with self._lock:
+                self.limited[(route, scope)] = self.limited.get((route, scope), 0) + 1
+        return retry_after
+
+
+class AdmissionControl:
+    """Counts the requests in flight in this process and refuses those beyond `limit` (0 = no limit)."""
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.shed = 0
+
+    def enter(self):
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
@@ -0,0 +1,208 @@
+"""Slot arithmetic over a doctor's weekly availability schedule.
+
+The schedule is the dict stored on the doctor document, e.g.
+{'Monday': {'startTime': '09:00', 'endTime': '17:00', 'isAvailable': True}, ...}.
+Bookable slots start at startTime and repeat every slot_minutes while the
+start is still before endTime, matching check_backend_availability().
+
+On write the schedule (plus date-specific overrides such as holidays or
+extra sessions) is validated and compiled into a CompiledSchedule: one
+bitmap per weekday whose bit i covers minutes [i*g, (i+1)*g) of the day,
+g being the granularity every start/end time is aligned to. The compiled
+form is stored next to the doctor as `availability_slots`, and "is this
+time range open?" becomes a single masked bit test.
+"""
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+MINUTES_PER_DAY = 24 * 60
+MAX_OVERRIDES = 366
+DATE_FORMAT = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def parse_hhmm(value):
+    """Converts 'HH:MM' to minutes after midnight. Raises ValueError on bad input."""
+    hours, minutes = value.split(':')
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60) or len(value) != 5:
+        raise ValueError(f"Invalid time '{value}'")
+    return hours * 60 + minutes
+
+
+def _day_entry(entry, where, granularity):
+    """Validates one {startTime, endTime, isAvailable} entry and returns it normalized."""
+    if not isinstance(entry, dict):
+        raise ValueError(f"{where}: expected an object with startTime, endTime and isAvailable.")
+    is_available = entry.get('isAvailable', False)
+    if not isinstance(is_available, bool):
+        raise ValueError(f"{where}: isAvailable must be true or false.")
+    start_time, end_time = entry.get('startTime') or '', entry.get('endTime') or ''
+    if not is_available:
+        return {'startTime': start_time, 'endTime': end_time, 'isAvailable': False}
+    try:
+        start, end = parse_hhmm(start_time), parse_hhmm(end_time)
+    except (ValueError, AttributeError):
+        raise ValueError(f"{where}: startTime and endTime must be HH:MM.")
+    if start >= end:
+        raise ValueError(f"{where}: startTime must be before endTime.")
+    if start % granularity or end % granularity:
+        raise ValueError(f"{where}: times must be multiples of {granularity} minutes.")
+    return {'startTime': start_time, 'endTime': end_time, 'isAvailable': True}
+
+
+def validate_availability(payload, granularity):
+    """Checks an availability PUT body and returns (weekly schedule, overrides or None).
+
+    The body holds the seven weekday entries (missing days are unavailable)
+    and optionally 'overrides': [{date, isAvailable, startTime, endTime}, ...].
+    An override replaces the weekly hours for its date; several overrides of
+    the same date add up (e.g. two extra sessions). Overrides are None when
+    the body does not mention them. Raises ValueError with a client-facing message.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid availability data format. Expected a JSON object.")
+    unknown = set(payload) - set(DAY_NAMES) - {'overrides'}
+    if unknown:
+        raise ValueError(f"Unknown availability keys: {', '.join(sorted(unknown))}. Use weekday names and 'overrides'.")
+    weekly = {}
+    for day in DAY_NAMES:
+        entry = payload.get(day, {'startTime': '', 'endTime': '', 'isAvailable': False})
+        weekly[day] = _day_entry(entry, day, granularity)
+
+    overrides = payload.get('overrides')
+    if overrides is None:
+        return weekly, None
+    if not isinstance(overrides, list):
+        raise ValueError("'overrides' must be a list.")
+    if len(overrides) > MAX_OVERRIDES:
+        raise ValueError(f"At most {MAX_OVERRIDES} overrides are allowed.")
+    normalized = []
+    for item in overrides:
+        day = item.get('date') if isinstance(item, dict) else None
+        try:
+            if not isinstance(day, str) or not DATE_FORMAT.match(day):
+                raise ValueError
+            date.fromisoformat(day)
+        except ValueError:
+            raise ValueError(f"Override date {day!r} must be YYYY-MM-DD.")
+        normalized.append({'date': day, **_day_entry(item, f"Override {day}", granularity)})
+    normalized.sort(key=lambda item: (item['date'], item['startTime']))
+    return weekly, normalized
+
+
+def _range_bitmap(start_minute, end_minute, granularity):
+    first, last = start_minute // granularity, -(-end_minute // granularity)
+    return ((1 << (last - first)) - 1) << first
+
+
+def _entry_bitmap(entry, granularity):
+    if not entry or not entry.get('isAvailable'):
+        return 0
+    try:
+        start, end = parse_hhmm(entry.get('startTime', '')), parse_hhmm(entry.get('endTime', ''))
+    except (ValueError, AttributeError):
+        return 0
+    return _range_bitmap(start, end, granularity) if start < end else 0
+
+
+@lru_cache(maxsize=4096)
+def bitmap_slot_offsets(bitmap, granularity, slot_minutes):
+    """Slot start offsets (minutes after midnight) for a day bitmap.
+
+    Each open run is cut into consecutive slots of slot_minutes; only slots
+    that end within the run are offered.
+    """
+    offsets = []
+    cell = 0
+    while bitmap >> cell:
+        if not (bitmap >> cell) & 1:
+            # Skip to the next set bit
+            cell = ((bitmap >> cell) & -(bitmap >> cell)).bit_length() - 1 + cell
+            continue
+        run_end = cell
+        while (bitmap >> run_end) & 1:
+            run_end += 1
+        offsets.extend(range(cell * granularity, run_end * granularity - slot_minutes + 1, slot_minutes))
+        cell = run_end
+    return tuple(offsets)
+
+
+class CompiledSchedule:
+    """Weekly availability and date overrides as bitmaps of `granularity`-minute cells."""
+    __slots__ = ('granularity', 'week', 'overrides')
+
+    def __init__(self, granularity, week, overrides=None):
+        self.granularity = granularity
+        self.week = week  # 7 ints, Monday first
+        self.overrides = overrides or {}  # date -> int
+
+    @classmethod
+    def compile(cls, weekly, overrides, granularity):
+        week = [_entry_bitmap(weekly.get(day) if weekly else None, granularity) for day in DAY_NAMES]
+        compiled = {}
+        for item in overrides or ():
+            day = date.fromisoformat(item['date'])
+            compiled[day] = compiled.get(day, 0) | _entry_bitmap(item, granularity)
+        return cls(granularity, week, compiled)
+
+    @classmethod
+    def from_document(cls, doctor):
+        """Reads `availability_slots`, compiling the raw schedule of documents stored before it existed."""
+        stored = (doctor or {}).get('availability_slots')
+        if stored:
+            return cls(stored['granularity'], [int(bits, 16) for bits in stored['week']],
+                       {date.fromisoformat(day): int(bits, 16) for day, bits in stored.get('overrides', {}).items()})
+        # Legacy schedules may use any minute, so compile them at one-minute resolution
+        return cls.compile((doctor or {}).get('availability'), (doctor or {}).get('availability_overrides'), 1)
+
+    def to_document(self):
+        return {
+            'granularity': self.granularity,
+            'week': [format(bits, 'x') for bits in self.week],
+            'overrides': {day.isoformat(): format(bits, 'x') for day, bits in sorted(self.overrides.items())}
+        }
+
+    def day_bitmap(self, day):
+        bits = self.overrides.get(day)
+        return self.week[day.weekday()] if bits is None else bits
+
+    def available_minutes(self, day):
+        return bin(self.day_bitmap(day)).count('1') * self.granularity
+
+    def covers(self, start, end):
+        """True if every minute of [start, end) lies inside the doctor's hours for start's date."""
+        midnight = datetime(start.year, start.month, start.day)
+        first = (start - midnight) // timedelta(minutes=1)
+        last = -(-((end - midnight) // timedelta(seconds=1)) // 60)  # Round a partial minute up
+        if last > MINUTES_PER_DAY or last <= first:
+            return False
+        mask = _range_bitmap(first, last, self.granularity)
+        return self.day_bitmap(start.date()) & mask == mask
+
+    def day_offsets(self, day, slot_minutes):
+        return bitmap_slot_offsets(self.day_bitmap(day), self.granularity, slot_minutes)
+
+    def weekly_offsets(self, slot_minutes):
+        return [bitmap_slot_offsets(bits, self.granularity, slot_minutes) for bits in self.week]
+
+
+def iter_free_slots(schedule, booked_cells, start_date, end_date, slot_minutes,
+                    slot_cells, not_before=None):
+    """Yields free slot datetimes between two dates (inclusive), in order.
+
+    schedule is a CompiledSchedule; booked_cells is a set of claimed cell
+    starts; slot_cells maps a slot datetime to the claim cells it would occupy.
+    """
+    day = datetime(start_date.year, start_date.month, start_date.day)
+    last_day = datetime(end_date.year, end_date.month, end_date.day)
+    while day <= last_day:
+        for offset in schedule.day_offsets(day.date(), slot_minutes):
+            slot = day + timedelta(minutes=offset)
+            if not_before is not None and slot < not_before:
+                continue
+            if booked_cells and not booked_cells.isdisjoint(slot_cells(slot)):
+                continue
+            yield slot
+        day += timedelta(days=1)
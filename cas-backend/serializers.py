@@ -0,0 +1,129 @@
+"""Response serialization: declared shapes compiled into plain functions.
+
+A shape maps each output key to a source field and a conversion:
+
+    PATIENT_ROW = {'id': object_id('_id'), 'date': day('appointment_datetime'), ...}
+
+compile_shape() turns it into one generated function whose body is a
+single dict literal. Every source field is read once, however many keys
+use it, and a datetime is formatted once with isoformat() (a C call) and
+sliced for both its date and its time, instead of two strftime() calls.
+Missing fields come out as null.
+
+AppointixJSONProvider makes jsonify() understand ObjectId and datetime
+values too, and keeps keys in declaration order rather than sorting every
+dict it encodes.
+"""
+from datetime import date, datetime
+
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+# Conversions; each returns an expression over the field's local variable
+_CONVERSIONS = {
+    'raw': lambda var: var,
+    'id': lambda var: f"None if {var} is None else str({var})",
+    # isoformat(): 'YYYY-MM-DDTHH:MM:SS[.ffffff]'
+    'day': lambda var: f"{var}_iso and {var}_iso[:10]",
+    'time': lambda var: f"{var}_iso and {var}_iso[11:16]",
+}
+
+
+def field(source):
+    return ('raw', source)
+
+
+def object_id(source):
+    return ('id', source)
+
+
+def day(source):
+    """'YYYY-MM-DD' of a datetime field."""
+    return ('day', source)
+
+
+def time_of_day(source):
+    """'HH:MM' of a datetime field."""
+    return ('time', source)
+
+
+def compile_shape(name, shape):
+    """Returns a function doc -> dict producing `shape` (output key -> field(), object_id(), ...)."""
+    sources = {}  # source field -> local variable
+    formatted = set()  # variables whose isoformat() is already taken
+    body = []
+    for kind, source in shape.values():
+        if source not in sources:
+            sources[source] = f"v{len(sources)}"
+            body.append(f"    {sources[source]} = get({source!r})")
+        var = sources[source]
+        if kind in ('day', 'time') and var not in formatted:
+            formatted.add(var)
+            body.append(f"    {var}_iso = None if {var} is None else {var}.isoformat()")
+    items = ', '.join(f"{key!r}: {_CONVERSIONS[kind](sources[source])}" for key, (kind, source) in shape.items())
+    source_code = f"def {name}(doc):\n    get = doc.get\n" + '\n'.join(body) + f"\n    return {{{items}}}\n"
+    namespace = {}
+    exec(compile(source_code, f"<shape {name}>", 'exec'), namespace)
+    serializer = namespace[name]
+    serializer.source_code = source_code  # For debugging: the generated function
+    return serializer
+
+
+# Rows of GET /api/appointments/patient (the patient is the caller)
+PATIENT_APPOINTMENT_ROW = {
+    "id": object_id('_id'),
+    "doctorId": object_id('doctor_id'),
+    "doctorName": field('doctor_name'),
+    "date": day('appointment_datetime'),
+    "time": time_of_day('appointment_datetime'),
+    # Appointments booked before durations existed have no stored end
+    "endTime": time_of_day('appointment_end'),
+    "reason": field('reason'),
+    "status": field('status'),
+}
+
+# Rows of GET /api/appointments/doctor (the doctor is the caller)
+DOCTOR_APPOINTMENT_ROW = {
+    "id": object_id('_id'),
+    "patientId": object_id('patient_id'),
+    "patientName": field('patient_name'),
+    "date": day('appointment_datetime'),
+    "time": time_of_day('appointment_datetime'),
+    "endTime": time_of_day('appointment_end'),
+    "reason": field('reason'),
+    "status": field('status'),
+}
+
+# A whole appointment: booking and reschedule responses, change events
+APPOINTMENT = {
+    "id": object_id('_id'),
+    "doctorId": object_id('doctor_id'),
+    "doctorName": field('doctor_name'),
+    "patientId": object_id('patient_id'),
+    "patientName": field('patient_name'),
+    "date": day('appointment_datetime'),
+    "time": time_of_day('appointment_datetime'),
+    "endTime": time_of_day('appointment_end'),
+    "visitType": field('visit_type'),
+    "reason": field('reason'),
+    "status": field('status'),
+}
+
+patient_appointment_row = compile_shape('patient_appointment_row', PATIENT_APPOINTMENT_ROW)
+doctor_appointment_row = compile_shape('doctor_appointment_row', DOCTOR_APPOINTMENT_ROW)
+appointment_data = compile_shape('appointment_data', APPOINTMENT)
+
+
+def json_default(value):
+    """json.dumps default= hook for the BSON and date types documents carry."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class AppointixJSONProvider(DefaultJSONProvider):
+    default = staticmethod(json_default)
+    # Shapes already fix the key order; sorting every dict is wasted work
+    sort_keys = False
@@ -0,0 +1,161 @@
+"""Multi-worker launcher for development and load testing. Not for production.
+
+Each worker runs werkzeug's development server, which has no request
+timeouts or worker recycling and logs whole request lines, query strings
+included. In production run the same app under gunicorn instead (see
+gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py 'server:create_app()'
+
+Binds one listening socket, then forks N worker processes that accept on it,
+each running a threaded WSGI server around its own create_app() instance
+(and therefore its own MongoDB client or SQLite connections). The parent only supervises: it
+restarts workers that die and, on SIGTERM/SIGINT, asks every worker to
+drain, waits up to --grace seconds and kills whatever is left.
+
+    python serve.py --port 5001 --workers 4
+
+Configuration is read from APPOINTIX_* environment variables (see
+DEFAULT_CONFIG in server.py). On platforms without fork (Windows) a single
+threaded process is started instead.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import server
+
+log = logging.getLogger('appointix.serve')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Appointix API with multiple worker processes "
+                                                 "(development only; use gunicorn in production).")
+    parser.add_argument('--host', default=os.environ.get('APPOINTIX_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('APPOINTIX_PORT', 5001)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('APPOINTIX_WORKERS', os.cpu_count() or 1)),
+                        help='Number of worker processes (default: one per CPU core).')
+    parser.add_argument('--grace', type=float, default=float(os.environ.get('APPOINTIX_GRACE_SECONDS', 30)),
+                        help='Seconds workers get to finish in-flight requests on shutdown.')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--skip-bootstrap', action='store_true',
+                        help='Do not create indexes / verify query plans before starting workers.')
+    return parser.parse_args(argv)
+
+
+def run_worker(listen_socket, args):
+    """Serves requests on the shared socket until SIGTERM/SIGINT, then drains and exits."""
+    app = server.create_app()
+    try:
+        # Build the doctor search index before the first search has to wait for it
+        with app.app_context():
+            server.get_doctor_search_index()
+    except Exception as e:
+        log.warning(f"Worker {os.getpid()} could not preload the doctor search index: {e}")
+    httpd = make_server(args.host, args.port, app, threaded=True, fd=listen_socket.fileno())
+    # Request threads are joined by server_close(), so in-flight requests finish on shutdown
+    httpd.daemon_threads = False
+    httpd.block_on_close = True
+
+    def drain(signum, frame):
+        # Readiness turns 503 right away; the accept loop stops from another thread
+        app.config['DRAINING'] = True
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+
+    log.info(f"Worker {os.getpid()} serving on {args.host}:{args.port}")
+    httpd.serve_forever()
+    httpd.server_close()
+    log.info(f"Worker {os.getpid()} stopped")
+
+
+def spawn_worker(listen_socket, args):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(listen_socket, args)
+        except Exception:
+            log.exception(f"Worker {os.getpid()} crashed")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def supervise(listen_socket, args):
+    """Keeps args.workers children alive until a shutdown signal arrives."""
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    workers = set(spawn_worker(listen_socket, args) for _ in range(args.workers))
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid, status = 0, 0
+        if pid and pid in workers:
+            workers.discard(pid)
+            if not stopping.is_set():
+                log.warning(f"Worker {pid} exited with status {status}; starting a replacement")
+                workers.add(spawn_worker(listen_socket, args))
+        else:
+            stopping.wait(0.5)
+
+    log.info(f"Shutting down {len(workers)} workers (grace {args.grace}s)")
+    for pid in workers:
+        try: os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError: pass
+    deadline = time.monotonic() + args.grace
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        log.warning(f"Worker {pid} did not stop within the grace period; killing it")
+        try: os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError: pass
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    args = parse_args(argv)
+
+    if not args.skip_bootstrap:
+        app = server.create_app()
+        with app.app_context():
+            server.bootstrap_database(verify=app.config['VERIFY_QUERY_PLANS'])
+    # Never carry a MongoClient (or SQLite connection) across fork; each worker opens its own
+    server.db.connection.close()
+
+    listen_socket = socket.create_server((args.host, args.port), backlog=args.backlog)
+    listen_socket.set_inheritable(True)
+
+    if not hasattr(os, 'fork') or args.workers <= 1:
+        run_worker(listen_socket, args)
+    else:
+        supervise(listen_socket, args)
+    listen_socket.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,76 +1,422 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, abort, current_app, g, request, jsonify
+from flask.cli import with_appcontext
 # Removed flask_sqlalchemy import
 from flask_cors import CORS
-from pymongo import MongoClient
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+import click
 from bson.objectid import ObjectId # Import ObjectId
 import jwt
 from datetime import datetime, timedelta
 import os
 import json
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import uuid
+import time
+import hashlib
+import hmac
+import re
+import tempfile
+from functools import partial
+
+from availability_index import AvailabilityIndex
+from caching import TTLCache
+from database import DatabaseProxy, MongoConnection
+from doctor_search import DoctorSearchIndex
+from events import ChangeStreamRelay, EventBroker, appointment_event, doctor_topic, patient_topic
+from hashing import HasherBusyError, PasswordHasher
+from indexes import ensure_indexes, verify_query_plans
+from metrics import NO_ROUTE, Metrics
+from media_store import (add_reference, is_content_name, migrate_legacy_uploads, publish,
+                         release_reference, write_content_addressed)
+from sqlite_store import SQLiteConnection
+from ratelimit import AdmissionControl, MemoryBuckets, RateLimiter, SharedBuckets, fcntl, parse_rate
+from pagination import (MIN_ID, SORT as PAGE_SORT, SYNC_SORT, TokenExpiredError, after_cursor, changed_after,
+                        configure as configure_page_tokens, decode_sync_token, encode_cursor, encode_sync_token,
+                        sort_key)
+from scheduling import CompiledSchedule, iter_free_slots, validate_availability
+from serializers import AppointixJSONProvider, appointment_data, doctor_appointment_row, patient_appointment_row
+from stats import COUNTERS as STATS_COUNTERS, appointment_minutes, read_counters, rebuild as rebuild_doctor_stats
+from stats import record as record_doctor_stats
+from streaming import stream_cursor, stream_merged
+from sweeper import ARCHIVE_COLLECTION, Sweeper, acquire_lease, archive_finished, expire_stale, lease_owner
+from slot_claims import (CLAIMS_COLLECTION, SlotTakenError, backfill_claims, claim_cells, claim_slot, claim_slots,
+                         move_claim, release_claim, release_claims, slot_start_for)
 
-# Initialize Flask app
-app = Flask(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Configure Database & Uploads
 UPLOAD_FOLDER = os.path.join(basedir, 'uploads', 'profile_pics')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
-app.config['UPLOAD_FOLDER'] = 
 
-# MongoDB Configuration
-app.config['MONGO_URI'] = 'mongodb://localhost:27017/'
-app.config['MONGO_DBNAME'] = 'appointix'
-app.config['SECRET_KEY'] = 'awt_project_secret_key123'
+# Defaults for current_app.config. Any key can be overridden from the environment with an
+# APPOINTIX_ prefix (e.g. APPOINTIX_MONGO_URI, APPOINTIX_PRINCIPAL_CACHE_TTL=60);
+# values are parsed as JSON when possible.
+DEFAULT_CONFIG = {
+    'UPLOAD_FOLDER': UPLOAD_FOLDER,
+
+    # Storage engine: 'mongo', or 'sqlite' for an embedded database file (single-host deployments)
+    'STORAGE_BACKEND': 'mongo',
+    'SQLITE_PATH': os.path.join(basedir, 'appointix.sqlite3'),
+    'SQLITE_POOL_SIZE': 8,  # Idle connections kept per worker for the next requests
+
+    # MongoDB Configuration
+    'MONGO_URI': 'mongodb://localhost:27017/',
+    'MONGO_DBNAME': 'appointix',
+    'MONGO_MAX_POOL_SIZE': 100, # Connections per worker process
+    'SECRET_KEY': 'awt_project_secret_key123',
+    'VERIFY_QUERY_PLANS': True, # Refuse to start if a handler query would be a COLLSCAN
+
+    # Length of a bookable slot, and the duration of appointments whose doctor sets no default
+    'APPOINTMENT_SLOT_MINUTES': 60,
+    # Upcoming appointments claim every cell of this size their interval touches; durations are multiples of it
+    'APPOINTMENT_CLAIM_MINUTES': 15,
+    'APPOINTMENT_MAX_DURATION_MINUTES': 240,
+
+    # Availability times must be multiples of this; schedules are compiled to bitmaps of these cells
+    'AVAILABILITY_GRANULARITY_MINUTES': 5,
+
+    # Most visits one batch / recurring booking request may create
+    'BATCH_BOOKING_MAX_OCCURRENCES': 52,
+
+    # Free-slot listings: longest range served by one request, and how long a listing may be reused
+    'SLOT_QUERY_MAX_DAYS': 62,
+    'SLOT_CACHE_SIZE': 2048,
+    'SLOT_CACHE_TTL': 60, # Seconds; bookings for the doctor invalidate sooner
+
+    # "Earliest available" search over the in-memory availability index
+    'EARLIEST_SEARCH_HORIZON_DAYS': 60, # How far ahead a search may look
+    'EARLIEST_SEARCH_MAX_LIMIT': 50,
+    'AVAILABILITY_INDEX_REFRESH': 300, # Seconds before the index is rebuilt from MongoDB
+
+    # Appointment list pages (keyset pagination; see pagination.py), for requests sending ?limit=
+    # or ?cursor=; without either a listing returns every matching row
+    'APPOINTMENTS_PAGE_SIZE': 50,
+    'APPOINTMENTS_MAX_PAGE_SIZE': 200,
+    # Delta sync (?since=): changes this recent are sent again by the next sync, so a write still
+    # in flight or stamped by a worker with a slightly slow clock is never skipped
+    'APPOINTMENT_SYNC_LAG_SECONDS': 5,
+    # Cursors and sync tokens are signed with SECRET_KEY and refused (410) after these many seconds;
+    # the client then reloads the list without them
+    'APPOINTMENT_CURSOR_MAX_AGE_SECONDS': 24 * 3600,
+    'APPOINTMENT_SYNC_TOKEN_MAX_AGE_SECONDS': 30 * 24 * 3600,
+
+    # Background sweeper (one worker at a time): upcoming appointments this long past their start
+    # become 'expired' (keep it above APPOINTMENT_MAX_DURATION_MINUTES), and finished ones older
+    # than the archive horizon move to appointments_archive, read only with ?history=1
+    'SWEEPER_ENABLED': True,
+    'SWEEPER_INTERVAL': 300, # Seconds
+    'SWEEPER_BATCH_SIZE': 500,
+    'APPOINTMENT_EXPIRE_AFTER_HOURS': 24,
+    'APPOINTMENT_ARCHIVE_AFTER_DAYS': 90,
+
+    # Live appointment changes for dashboards (GET /api/appointments/events, server-sent events).
+    # 'local' publishes from the handlers of this worker only; 'change-stream' relays every change
+    # from a MongoDB change stream (requires a replica set) so all workers see all of them.
+    'EVENTS_SOURCE': 'local',
+    'EVENTS_HISTORY_SIZE': 1000, # Recent events kept for Last-Event-ID replay
+    'EVENTS_QUEUE_SIZE': 256, # Undelivered events per stream before it is told to resync
+    'EVENTS_KEEPALIVE_SECONDS': 15,
+    'EVENTS_STREAM_MAX_SECONDS': 3600, # Streams are closed after this; EventSource reconnects
+    'EVENTS_RETRY_MS': 5000, # Reconnect delay suggested to the browser
+    # Lifetime of the ticket a stream is opened with (POST /api/appointments/events/ticket). It
+    # travels in the URL, so it only opens streams and expires quickly; login tokens never do.
+    'EVENTS_TICKET_SECONDS': 60,
+
+    # Longest date range one doctor statistics request may cover
+    'STATS_MAX_DAYS': 366,
+
+    # Public doctor directory: cached serialized listing, paginated with ?limit=&offset= (a request
+    # sending neither gets every doctor)
+    'DOCTOR_DIRECTORY_PAGE_SIZE': 100,
+    'DOCTOR_DIRECTORY_MAX_PAGE_SIZE': 500,
+    'DOCTOR_DIRECTORY_CACHE_TTL': 300, # Seconds; doctor profile writes invalidate sooner
+
+    # Doctor search (GET /api/doctors/search): in-process prefix index over names and specializations
+    'DOCTOR_SEARCH_PAGE_SIZE': 20,
+    'DOCTOR_SEARCH_MAX_PAGE_SIZE': 100,
+    'DOCTOR_SEARCH_REFRESH': 300, # Seconds before the index is rebuilt from MongoDB
+
+    # Streaming responses (?stream=1): documents fetched per cursor batch and flushed per chunk
+    'STREAM_BATCH_SIZE': 500,
+
+    # Principal cache: authenticated user context keyed by user id
+    'PRINCIPAL_CACHE_SIZE': 10000, # Max cached users (LRU eviction beyond this)
+    'PRINCIPAL_CACHE_TTL': 300, # Seconds before a cached user is re-read from MongoDB
+
+    # Password hashing runs in a bounded process pool (see hashing.py). The method must be
+    # spelled out in full; stored hashes with other parameters are upgraded on next login.
+    'PASSWORD_HASH_METHOD': 'scrypt:32768:8:1', # e.g. 'pbkdf2:sha256:600000'
+    'PASSWORD_HASH_WORKERS': 2, # Processes per worker; 0 hashes inline on the request thread
+    'PASSWORD_HASH_QUEUE_LIMIT': 32, # Waiting hashes beyond the pool before answering 503
+    'PASSWORD_HASH_TIMEOUT': 10, # Seconds
+
+    # Rate limits ('<count>/<second|minute|hour|day>' token buckets) by view function name, per
+    # client IP and per authenticated user. 'shared' buckets live in a memory-mapped file used by
+    # every worker on the host (falls back to per-process 'memory' buckets without fcntl).
+    'RATE_LIMIT_ENABLED': True,
+    'RATE_LIMITS_PER_IP': {
+        'login_user': '20/minute',
+        'register_user': '10/minute',
+        'book_appointment': '120/minute', # Several patients may share one clinic or carrier IP
+        'book_appointments_batch': '30/minute',
+    },
+    'RATE_LIMITS_PER_USER': {
+        'book_appointment': '20/minute',
+        'book_appointments_batch': '5/minute',
+        'update_appointment': '20/minute',
+        'cancel_appointment': '20/minute',
+    },
+    'RATE_LIMIT_STORAGE': 'shared', # 'shared' or 'memory'
+    'RATE_LIMIT_SHARED_PATH': os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                           'appointix-rate-limits'),
+    'RATE_LIMIT_SHARED_SLOTS': 65536, # Buckets the shared file holds (24 bytes each)
+    # Requests one worker handles at once; beyond this it answers 503 right away (0 = unlimited)
+    'MAX_IN_FLIGHT_REQUESTS': 64,
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted for the client IP
+    'TRUSTED_PROXY_COUNT': 0,
+
+    # Browser origin allowed to call the API
+    'CORS_ORIGIN': 'http://localhost:3000',
+
+    # Profile picture delivery. Content-named files never change, so browsers may keep them for
+    # a year without revalidating; legacy uuid-named files get a short max-age plus ETag checks.
+    'UPLOAD_IMMUTABLE_MAX_AGE': 31536000,
+    'UPLOAD_LEGACY_MAX_AGE': 3600,
+    # None streams bytes from the worker. 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache,
+    # lighttpd) hands the transfer to the fronting server; for nginx, UPLOAD_ACCEL_PREFIX must
+    # be an `internal` location aliased to UPLOAD_FOLDER.
+    'UPLOAD_SENDFILE_MODE': None,
+    'UPLOAD_ACCEL_PREFIX': '/protected/profile_pics/',
+
+    # Prometheus-style /metrics (per worker process; see metrics.py), behind OPERATOR_TOKEN
+    'METRICS_ENABLED': True,
+
+    # Shared secret for /metrics and the /api/internal/ routes, sent as the X-Operator-Token
+    # header. Unset (the default) disables those routes altogether.
+    'OPERATOR_TOKEN': None,
+}
+
+# MongoDB client, created lazily in each process (see database.py)
+mongo = MongoConnection()
+# Embedded alternative selected with STORAGE_BACKEND='sqlite' (see sqlite_store.py)
+sqlite_storage = SQLiteConnection()
+db = DatabaseProxy(mongo) # Get database object
+metrics = Metrics()
+metrics.add_gauges(lambda: cache_gauges())
+metrics.add_gauges(lambda: event_gauges())
+metrics.add_gauges(lambda: admission_gauges())
+
+# All routes live on this blueprint; create_app() registers it
+bp = Blueprint('appointix', __name__)
+
+# Request budgets and per-worker load shedding (see ratelimit.py)
+rate_limiter = RateLimiter()
+admission_control = AdmissionControl(DEFAULT_CONFIG['MAX_IN_FLIGHT_REQUESTS'])
+# Never limited or shed: probes and scrapes must keep answering under load
+UNLIMITED_ENDPOINTS = {'health_check', 'readiness_check', 'get_metrics'}
+
+# Appointment change fan-out for /api/appointments/events (see events.py)
+event_broker = EventBroker(DEFAULT_CONFIG['EVENTS_HISTORY_SIZE'], DEFAULT_CONFIG['EVENTS_QUEUE_SIZE'])
+# JWT audience of the tickets that open event streams
+EVENTS_TICKET_AUDIENCE = 'events'
+
+
+def publish_appointment_event(kind, appointment):
+    # With EVENTS_SOURCE='change-stream' the relay publishes every change instead
+    if current_app.config['EVENTS_SOURCE'] == 'local':
+        event_broker.publish(*appointment_event(kind, appointment))
+
+
+def record_stats(doctor_id, when, **increments):
+    # Counters are secondary to the appointment itself; `flask rebuild-stats` repairs any that drift
+    try:
+        record_doctor_stats(db, doctor_id, when, **increments)
+    except Exception as e:
+        current_app.logger.error(f"Failed to update stats of doctor {doctor_id}: {e}")
+
+# Password hashing pool shared by /api/register and /api/login
+password_hasher = PasswordHasher(DEFAULT_CONFIG['PASSWORD_HASH_METHOD'], DEFAULT_CONFIG['PASSWORD_HASH_WORKERS'],
+                                 DEFAULT_CONFIG['PASSWORD_HASH_QUEUE_LIMIT'], DEFAULT_CONFIG['PASSWORD_HASH_TIMEOUT'])
+
+# Cache of user documents (without password hash) used by get_user_from_token()
+principal_cache = TTLCache(maxsize=DEFAULT_CONFIG['PRINCIPAL_CACHE_SIZE'],
+                           ttl=DEFAULT_CONFIG['PRINCIPAL_CACHE_TTL'])
+
+
+# Serialized free-slot listings keyed by (doctor_id, generation, from, to).
+# Bumping a doctor's generation makes all of their cached listings unreachable.
+slot_cache = TTLCache(maxsize=DEFAULT_CONFIG['SLOT_CACHE_SIZE'], ttl=DEFAULT_CONFIG['SLOT_CACHE_TTL'])
+slot_cache_generations = {}
+
+
+def invalidate_doctor_slots(doctor_id):
+    """Discards cached free-slot listings for a doctor after a booking or schedule change."""
+    doctor_id = str(doctor_id)
+    slot_cache_generations[doctor_id] = slot_cache_generations.get(doctor_id, 0) + 1
+
+
+# The doctor directory (one entry) and serialized pages of it, keyed by directory version
+directory_cache = TTLCache(maxsize=1, ttl=DEFAULT_CONFIG['DOCTOR_DIRECTORY_CACHE_TTL'])
+directory_page_cache = TTLCache(maxsize=256, ttl=DEFAULT_CONFIG['DOCTOR_DIRECTORY_CACHE_TTL'])
+
+
+def invalidate_doctor_directory():
+    """Drops the cached directory. Call after any write to a doctor document."""
+    directory_cache.clear()
+    directory_page_cache.clear()
+
+
+DIRECTORY_PROJECTION = {
+    "_id": 1, # Include the ID
+    "name": 1,
+    "specialization": 1,
+    "profile_picture_url": 1,
+    "availability": 1 # Include availability schedule
+}
+
+
+def directory_entry(doc):
+    return {
+        # Convert ObjectId to string for JSON serialization
+        "id": str(doc['_id']),
+        "name": doc.get('name'),
+        "specialization": doc.get('specialization'),
+        "profilePictureUrl": doc.get('profile_picture_url'),
+        # Availability should already be stored as an object/dict
+        "availability": doc.get('availability', {})
+    }
+
+
+def get_doctor_directory():
+    """Returns (version, doctors, doctors_by_specialization), loading from MongoDB on a miss."""
+    directory = directory_cache.get('directory')
+    if directory is None:
+        # Fetch only necessary fields from the doctors collection
+        doctors_cursor = db.doctors.find(
+            {}, # Empty filter to get all doctors
+            DIRECTORY_PROJECTION
+        )
+
+        doctor_list = []
+        by_specialization = {}
+        for doc in doctors_cursor:
+            entry = directory_entry(doc)
+            doctor_list.append(entry)
+            by_specialization.setdefault((entry['specialization'] or '').strip().lower(), []).append(entry)
+
+        # The version changes whenever any directory content changes
+        version = hashlib.md5(json.dumps(doctor_list, sort_keys=True).encode()).hexdigest()
+        directory = (version, doctor_list, by_specialization)
+        directory_cache.set('directory', directory)
+    return directory
+
+
+# Directory cards indexed by name and specialization words, kept current by the doctor
+# write handlers of this process and rebuilt periodically like the availability index.
+doctor_search_index = DoctorSearchIndex()
+
+
+def get_doctor_search_index():
+    """Returns the doctor search index, (re)building it from MongoDB when missing or stale."""
+    loaded_at = doctor_search_index.loaded_at
+    refresh = timedelta(seconds=current_app.config['DOCTOR_SEARCH_REFRESH'])
+    if loaded_at is None or datetime.utcnow() - loaded_at > refresh:
+        doctor_search_index.load([directory_entry(doc) for doc in db.doctors.find({}, DIRECTORY_PROJECTION)],
+                                 datetime.utcnow())
+    return doctor_search_index
+
+
+def update_doctor_search(doctor_oid):
+    # Re-reads the card after a write; an index not loaded yet will read it on first use anyway
+    if doctor_search_index.loaded_at is not None:
+        doc = db.doctors.find_one({'_id': doctor_oid}, DIRECTORY_PROJECTION)
+        if doc:
+            doctor_search_index.upsert(directory_entry(doc))
+        else:
+            doctor_search_index.remove(str(doctor_oid))
+
+
+# Weekly schedules and booked slots of every doctor, kept current by the write handlers
+# of this process and rebuilt periodically to pick up writes made by other processes.
+availability_index = AvailabilityIndex(DEFAULT_CONFIG['APPOINTMENT_SLOT_MINUTES'],
+                                       lambda slot, minutes: appointment_cells(slot, slot + timedelta(minutes=minutes)))
+
+
+def get_availability_index():
+    """Returns the availability index, (re)building it from MongoDB when missing or stale."""
+    loaded_at = availability_index.loaded_at
+    refresh = timedelta(seconds=current_app.config['AVAILABILITY_INDEX_REFRESH'])
+    if loaded_at is None or datetime.utcnow() - loaded_at > refresh:
+        availability_index.load(
+            db.doctors.find({}, {'name': 1, 'specialization': 1, 'availability': 1, 'availability_slots': 1,
+                                 'appointment_durations': 1}),
+            db[CLAIMS_COLLECTION].find({'slot_start': {'$gte': slot_start_for(datetime.now(), current_app.config['APPOINTMENT_CLAIM_MINUTES'])}},
+                                       {'doctor_id': 1, 'slot_start': 1})
+        )
+    return availability_index
+
+
+def invalidate_principal(user_id):
+    """Drops a cached user context. Call whenever the user or doctor document changes."""
+    if user_id:
+        principal_cache.invalidate(str(user_id))
 
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Initialize MongoDB Client
-client = MongoClient(app.config['MONGO_URI'])
-db = client[app.config['MONGO_DBNAME']] # Get database object
+def load_principal(user_id_str, doctor_id_claim=None):
+    """Returns the cached user context for a user id, reading MongoDB only on a miss."""
+    principal = principal_cache.get(user_id_str)
+    if principal is None:
+        user = db.users.find_one({'_id': ObjectId(user_id_str)}, {'password_hash': 0})
+        if not user:
+            return None
+
+        # attach doctor_id if user is a doctor
+        if user.get('user_type') == 'doctor':
+            if doctor_id_claim:
+                # Tokens issued at login carry the doctor profile id, so no lookup is needed
+                user['doctor_id'] = doctor_id_claim
+            else:
+                doctor_profile = db.doctors.find_one({'user_id': user['_id']}, {'_id': 1})
+                user['doctor_id'] = str(doctor_profile['_id']) if doctor_profile else None
+        else:
+            user['doctor_id'] = None
+
+        user['_id'] = str(user['_id'])
+        # Doctors without a profile yet (mid-registration) are not cached
+        if user['user_type'] != 'doctor' or user['doctor_id']:
+            principal_cache.set(user_id_str, user)
+        principal = user
 
-# Allow API requests
-CORS(app, resources={
-    r"/api/*": {"origins": "http://localhost:3000"},
-    r"/uploads/*": {"origins": "http://localhost:3000"}
-})
+    # Handlers receive their own copy so per-request keys never leak into the cache
+    return dict(principal)
 
 
-def get_user_from_token():
-    token = None
+def get_user_from_token(ticket_audience=None):
+    token, audience = None, None
     auth_header = request.headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
         token = auth_header.split(" ")[1]
+    elif ticket_audience:
+        # EventSource cannot send headers, so event streams pass a short-lived ticket as ?ticket=.
+        # URLs end up in access logs: the login token itself is never accepted there.
+        token, audience = request.args.get('ticket'), ticket_audience
     if not token:
         return None, {"error": "Authorization token is missing!"}, 401
     try:
+        # Tickets carry an audience, so one is rejected wherever a login token is expected
         payload = jwt.decode(
-            token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        user = db.users.find_one({'_id': ObjectId(payload['user_id'])}
-        )
+            token, current_app.config['SECRET_KEY'], algorithms=['HS256'], audience=audience)
+        user = load_principal(payload['user_id'], payload.get('doctor_id'))
 
         if not user:
             return None, {"error": "User not found for token"}, 401
 
         user['token_user_type'] = payload.get('user_type')
 
-        # attach doctor_id if user is a doctor
-        if user.get('user_type') == 'doctor':
-            doctor_profile = db.doctors.find_one({'user_id': user['_id']})
-            user['doctor_id'] = str(doctor_profile['_id']) if doctor_profile else None
-        else:
-            user['doctor_id'] = None
-
-        
-        user['_id'] = str(user['_id'])
-
         return user, None, None
 
     except Exception as e:
-        app.logger.error(f"Token processing error: {e}") # Log the error
+        current_app.logger.error(f"Token processing error: {e}") # Log the error
         return None, {"error": f'Token processing error: {e}'}, 401
 
 
@@ -80,119 +426,441 @@ def allowed_file(filename):
 # Helper function for availability check (backend version) - Moved here
 
 
-def check_backend_availability(doctor_id_str, appt_date_str, appt_time_str):
-    """Checks if a doctor is available at a specific date and time, including conflict checks."""
-    try:
-        doctor_oid = ObjectId(doctor_id_str)
-    except Exception: # Catches InvalidId from bson.objectid
-        app.logger.error(f"Invalid doctor_id format for availability check: {doctor_id_str}")
-        return False # Invalid ID format
-
-    doctor = db.doctors.find_one({'_id': doctor_oid})
-    availability_schedule = doctor.get('availability') if doctor else None
+def check_backend_availability(doctor, appt_datetime, appt_end):
+    """Checks if an appointment [start, end) lies entirely within the doctor's schedule for that date.
 
-    if not doctor or not availability_schedule:
-        app.logger.warning(f"Availability check: Doctor {doctor_id_str} not found or has no availability schedule.")
+    Conflicts with other appointments are not checked here: they are enforced
+    atomically by the slot claim taken when the appointment is booked.
+    """
+    if not doctor or not (doctor.get('availability_slots') or doctor.get('availability')):
+        current_app.logger.warning(f"Availability check: Doctor {doctor.get('_id') if doctor else None} not found or has no availability schedule.")
         return False
 
+    # One masked test against the compiled weekday (or date override) bitmap
+    return CompiledSchedule.from_document(doctor).covers(appt_datetime, appt_end)
+
+
+def appointment_cells(start, end):
+    """Returns the claim cells an appointment occupying [start, end) reserves."""
+    return claim_cells(start, end, current_app.config['APPOINTMENT_CLAIM_MINUTES'])
+
+
+def appointment_end(appointment):
+    """End of a stored appointment; ones booked before durations existed last one slot."""
+    return appointment.get('appointment_end') or \
+        appointment['appointment_datetime'] + timedelta(minutes=current_app.config['APPOINTMENT_SLOT_MINUTES'])
+
+
+# Statuses whose appointments keep their slot claims (cancel, expiry and archiving release them)
+CLAIM_HOLDING_STATUSES = ('upcoming', 'completed')
+
+
+def resync_claims(appointment_oid, doctor_oid, moved_cells):
+    """Points an appointment's claims back at what is stored, after a reschedule that moved
+    them to moved_cells but whose update did not apply (or may not have)."""
+    stored = db.appointments.find_one({'_id': appointment_oid},
+                                      {'status': 1, 'appointment_datetime': 1, 'appointment_end': 1})
+    cells = []
+    if stored and stored.get('status') in CLAIM_HOLDING_STATUSES and stored.get('appointment_datetime'):
+        cells = appointment_cells(stored['appointment_datetime'], appointment_end(stored))
+        try:
+            move_claim(db, appointment_oid, doctor_oid, cells)
+        except SlotTakenError:
+            # Another booking took the old cells after the move released them; nothing to give back
+            current_app.logger.error(f"Could not restore the slot claims of appointment {appointment_oid}: taken meanwhile")
+            cells = []
+        # A cancel that landed after the read above releases after its update, but check once more
+        stored = db.appointments.find_one({'_id': appointment_oid}, {'status': 1})
+    if not stored or stored.get('status') not in CLAIM_HOLDING_STATUSES:
+        release_claim(db, appointment_oid)
+        cells = []
+    invalidate_doctor_slots(doctor_oid)
+    availability_index.move_booking(doctor_oid, moved_cells, cells)
+
+
+def check_duration(minutes):
+    """Validates a duration in minutes and returns it as an int. Raises ValueError."""
+    cell = current_app.config['APPOINTMENT_CLAIM_MINUTES']
+    maximum = current_app.config['APPOINTMENT_MAX_DURATION_MINUTES']
     try:
-        appt_datetime = datetime.strptime(f"{appt_date_str} {appt_time_str}", "%Y-%m-%d %H:%M")
-        day_of_week = appt_datetime.strftime('%A') # e.g., 'Monday'
-        day_schedule = availability_schedule.get(day_of_week)
-
-        if not day_schedule or not day_schedule.get('isAvailable'):
-            # Not available on this day or schedule missing for the day
-            return False
-
-        # Check time range based on stored start/end times
-        is_within_time = day_schedule.get('startTime', '') <= appt_time_str < day_schedule.get('endTime', '')
-        if not is_within_time:
-            # Requested time is outside the doctor's working hours for that day
-            return False
-
-        # --- Check for existing appointments blocking this slot ---
-        # Convert appointment datetime to check range.
-        # MongoDB stores datetime objects natively (BSON Date).
-        appt_start_time = appt_datetime
-        # Define the end of the potential appointment slot. Adjust duration as needed (e.g., 1 hour).
-        appt_end_time = appt_datetime + timedelta(hours=1)
-
-        # Query for appointments that overlap with the requested slot.
-        # This requires 'appointment_datetime' to be stored as ISODate in MongoDB.
-        conflicting_appointment = db.appointments.find_one({
-            'doctor_id': doctor_oid, # Match the doctor
-            'status': 'upcoming',    # Only check against active appointments
-            'appointment_datetime': {
-                # Appointment starts before the requested slot ends AND
-                # Appointment ends after the requested slot starts
-                # This covers all overlap scenarios.
-                '$lt': appt_end_time,
-                '$gte': appt_start_time
-            }
-        })
+        minutes = int(minutes)
+    except (TypeError, ValueError):
+        raise ValueError("Durations must be whole minutes.")
+    if minutes <= 0 or minutes > maximum or minutes % cell:
+        raise ValueError(f"Durations must be multiples of {cell} minutes, at most {maximum}.")
+    return minutes
 
-        if conflicting_appointment:
-            # A conflicting appointment exists
-            app.logger.info(f"Availability check failed: Conflicting appointment found for Dr {doctor_id_str} at {appt_date_str} {appt_time_str}")
-            return False
 
-        # If we reach here, the doctor is generally available and the specific slot is free
-        return True
+def appointment_duration(doctor, duration=None, visit_type=None):
+    """Returns the length in minutes of a requested appointment. Raises ValueError on a bad duration.
 
-    except ValueError:
-        # Error parsing the provided date/time strings
-        app.logger.error(f"Error parsing date/time for availability check: {appt_date_str} {appt_time_str}")
-        return False
-    except Exception as e:
-        # Catch other potential errors during the check
-        app.logger.error(f"Error checking availability for doctor {doctor_id_str}: {e}")
-        return False
+    An explicit duration wins; otherwise the doctor's duration for the visit
+    type, then the doctor's default, then APPOINTMENT_SLOT_MINUTES.
+    """
+    if duration not in (None, ''):
+        return check_duration(duration)
+    durations = doctor.get('appointment_durations') or {}
+    return durations.get(visit_type) or durations.get('default') or current_app.config['APPOINTMENT_SLOT_MINUTES']
+
+APPOINTMENT_STATUSES = {'upcoming', 'completed', 'cancelled', 'expired'}
+
+
+def appointment_list_query(owner_filter):
+    """Builds the filter and page size for an appointment listing from the query string.
+
+    Supports ?limit=, ?cursor= (from X-Next-Cursor), ?status= (comma separated)
+    and ?from= / ?to= (YYYY-MM-DD, inclusive), or ?since= (from X-Sync-Token)
+    alone for delta sync. Raises ValueError on bad input.
+    """
+    query = dict(owner_filter)
+    conditions = []
+
+    limit = int(request.args.get('limit', current_app.config['APPOINTMENTS_PAGE_SIZE']))
+    limit = max(1, min(limit, current_app.config['APPOINTMENTS_MAX_PAGE_SIZE']))
+
+    if request.args.get('since'):
+        # Delta sync reports every change after the token, whatever its status or date
+        combined = [name for name in ('cursor', 'status', 'from', 'to', 'history', 'stream') if request.args.get(name)]
+        if combined:
+            raise ValueError(f"'since' cannot be combined with {', '.join(combined)}")
+        query.update(changed_after(decode_sync_token(request.args['since'])))
+        return query, limit
+
+    if request.args.get('status'):
+        statuses = [status.strip() for status in request.args['status'].split(',')]
+        if not set(statuses) <= APPOINTMENT_STATUSES:
+            raise ValueError(f"Invalid status filter. Allowed: {', '.join(sorted(APPOINTMENT_STATUSES))}")
+        query['status'] = statuses[0] if len(statuses) == 1 else {'$in': statuses}
+
+    date_range = {}
+    if request.args.get('from'):
+        date_range['$gte'] = datetime.strptime(request.args['from'], '%Y-%m-%d')
+    if request.args.get('to'):
+        date_range['$lt'] = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1)
+    if date_range:
+        conditions.append({'appointment_datetime': date_range})
+
+    if request.args.get('cursor'):
+        conditions.append(after_cursor(request.args['cursor']))
+
+    if conditions:
+        query['$and'] = conditions
+    return query, limit
+
+
+def history_requested():
+    return request.args.get('history', '').lower() in ('1', 'true', 'yes')
+
+
+def listing_collections(query):
+    """The collections a listing reads: the archive only with ?history=1 and if it can hold matches."""
+    if history_requested() and query.get('status') != 'upcoming':
+        return [db.appointments, db[ARCHIVE_COLLECTION]]
+    return [db.appointments]
+
+
+def fetch_appointment_page(query, projection, limit, collections):
+    """Returns one page of appointments (newest first) and the cursor for the next page."""
+    # One extra row tells us whether another page exists without a count query
+    rows = []
+    for collection in collections:
+        rows.extend(collection.find(query, projection).sort(PAGE_SORT).limit(limit + 1))
+    if len(collections) > 1:
+        rows.sort(key=sort_key, reverse=True)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+# Only the fields each listing row uses are read from MongoDB
+PATIENT_LIST_PROJECTION = {'doctor_id': 1, 'doctor_name': 1, 'appointment_datetime': 1, 'appointment_end': 1,
+                           'reason': 1, 'status': 1}
+DOCTOR_LIST_PROJECTION = {'patient_id': 1, 'patient_name': 1, 'appointment_datetime': 1, 'appointment_end': 1,
+                          'reason': 1, 'status': 1}
+
+
+def stream_requested():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def paging_requested():
+    # Clients that never page (the dashboards) get the whole list, as before pagination existed
+    return bool(request.args.get('limit') or request.args.get('cursor'))
+
+
+def streamed_json(cursor, to_row):
+    """Wraps a cursor in a streaming JSON array response."""
+    return current_app.response_class(stream_cursor(cursor, to_row, current_app.config['STREAM_BATCH_SIZE']),
+                              mimetype='application/json')
+
+
+def sync_horizon():
+    """Position up to which changes are settled: now minus APPOINTMENT_SYNC_LAG_SECONDS."""
+    return datetime.utcnow() - timedelta(seconds=current_app.config['APPOINTMENT_SYNC_LAG_SECONDS']), MIN_ID
+
+
+def appointment_changes_response(query, projection, to_row, limit):
+    """Rows changed after ?since=, oldest change first, with the token for the next sync.
+
+    The new token never passes the sync horizon, so recent changes are sent
+    again next time rather than risk skipping a late write. X-Sync-More means
+    the page was full and the caller should sync again right away.
+    """
+    since = decode_sync_token(request.args['since'])
+    rows = list(db.appointments.find(query, {**projection, 'updated_at': 1}).sort(SYNC_SORT).limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    position = (rows[-1]['updated_at'], rows[-1]['_id']) if rows else since
+    if not more:
+        position = max(since, min(position, sync_horizon()))
+    response = jsonify([to_row(appt) for appt in rows])
+    response.headers['X-Sync-Token'] = encode_sync_token(*position)
+    if more:
+        response.headers['X-Sync-More'] = 'true'
+    return response
+
+
+def paged_response(items, next_cursor):
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+def appointment_list_response(query, projection, to_row, limit):
+    """Returns one page of rows with ?limit= or ?cursor=, otherwise every matching row as a streamed array.
+
+    With ?history=1 archived appointments are merged in by the same sort order.
+    With ?since= only the changed rows are returned (see appointment_changes_response).
+    Every listing carries an X-Sync-Token to pass as ?since= later.
+    """
+    if request.args.get('since'):
+        return appointment_changes_response(query, projection, to_row, limit)
+    # Taken before the read, so nothing written while it runs can fall behind the token
+    sync_token = encode_sync_token(*sync_horizon())
+    collections = listing_collections(query)
+    if stream_requested() or not paging_requested():
+        # Export mode: no page limit, constant memory per request
+        if len(collections) > 1:
+            response = current_app.response_class(stream_merged(
+                [collection.find(query, projection).sort(PAGE_SORT) for collection in collections], sort_key,
+                to_row, current_app.config['STREAM_BATCH_SIZE']), mimetype='application/json')
+        else:
+            response = streamed_json(db.appointments.find(query, projection).sort(PAGE_SORT), to_row)
+    else:
+        rows, next_cursor = fetch_appointment_page(query, projection, limit, collections)
+        response = paged_response([to_row(appt) for appt in rows], next_cursor)
+    response.headers['X-Sync-Token'] = sync_token
+    return response
 
 # --- API Endpoints ---
 
 
-@app.route('/')
+@bp.route('/')
 def index(): return "Appointix Backend is Running!"
 
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Request, MongoDB and process metrics of this worker in the Prometheus text format
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    # Cache, load and process internals: operators only, like /api/internal/
+    error, status_code = check_operator()
+    if error: return jsonify(error), status_code
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def cache_gauges():
+    stats = {'principal': principal_cache.stats(), 'slots': slot_cache.stats(),
+             'directory': directory_cache.stats(), 'directoryPages': directory_page_cache.stats()}
+    return [
+        (metric, text, ('cache',), {(name,): values[field] for name, values in stats.items()})
+        for metric, field, text in (
+            ('appointix_cache_entries', 'size', 'Entries held by an in-process cache.'),
+            ('appointix_cache_hits_total', 'hits', 'In-process cache hits.'),
+            ('appointix_cache_misses_total', 'misses', 'In-process cache misses.'),
+            ('appointix_cache_evictions_total', 'evictions', 'In-process cache LRU evictions.'))
+    ]
+
+
+def event_gauges():
+    return [
+        ('appointix_event_streams', 'Open appointment event streams.', (), {(): event_broker.subscriber_count()}),
+        ('appointix_events_published_total', 'Appointment change events published.', (),
+         {(): event_broker.published}),
+    ]
+
+
+def admission_gauges():
+    return [
+        ('appointix_in_flight_requests', 'Requests being handled by this worker.', (),
+         {(): admission_control.in_flight}),
+        ('appointix_shed_requests_total', 'Requests refused with 503 because the worker was at capacity.', (),
+         {(): admission_control.shed}),
+        ('appointix_rate_limited_total', 'Requests refused with 429 by a rate limit.', ('route', 'scope'),
+         dict(rate_limiter.limited)),
+    ]
+
+
+def token_user_id():
+    # Only the verified token is needed to key a user budget; the principal is loaded by the handler
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    try:
+        return jwt.decode(auth_header[7:], current_app.config['SECRET_KEY'], algorithms=['HS256']).get('user_id')
+    except jwt.InvalidTokenError:
+        return None
+
+
+def admit_request():
+    """Sheds the request with 503 if the worker is at capacity, or refuses it with 429 over a rate budget."""
+    route = (request.endpoint or '').rpartition('.')[2]
+    if route in UNLIMITED_ENDPOINTS:
+        return None
+    if not admission_control.enter():
+        response = jsonify({"error": "Server is busy, please retry shortly."})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    g.admitted = True
+
+    if not current_app.config['RATE_LIMIT_ENABLED']:
+        return None
+    budgets = current_app.extensions['appointix_rate_budgets']
+    checks = []
+    if route in budgets['ip']:
+        checks.append(('ip', request.remote_addr, budgets['ip'][route]))
+    if route in budgets['user']:
+        user_id = token_user_id()
+        if user_id:
+            checks.append(('user', user_id, budgets['user'][route]))
+    for scope, identity, rate in checks:
+        retry_after = rate_limiter.check(route, scope, identity, rate)
+        if retry_after is not None:
+            current_app.logger.info(f"Rate limit hit: {route} by {scope} {identity}")
+            response = jsonify({"error": "Too many requests, please slow down."})
+            response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+            return response, 429
+    return None
+
+
+def release_admission(exc):
+    # Streamed responses leave here when the view returns, so open event streams hold no slot
+    if g.pop('admitted', False):
+        admission_control.leave()
+
+
+def release_storage_connection(exc):
+    # Request threads come and go; their connection goes back to the pool instead of staying open
+    sqlite_storage.release()
+
+
+def begin_request_metrics():
+    rule = request.url_rule
+    metrics.begin_request(rule.rule if rule is not None else NO_ROUTE)
+
+
+def end_request_metrics(response):
+    metrics.end_request(request.method, response.status_code)
+    return response
+
+
+def check_operator():
+    """Returns (error, status_code) unless the request carries the configured OPERATOR_TOKEN."""
+    expected = current_app.config['OPERATOR_TOKEN']
+    if not expected:
+        # Not configured: the internal routes do not exist
+        return {"error": "Not found."}, 404
+    supplied = request.headers.get('X-Operator-Token', '')
+    if not hmac.compare_digest(supplied.encode(), str(expected).encode()):
+        return {"error": "Operator token missing or invalid."}, 401
+    return None, None
+
+
+@bp.route('/api/internal/cache-stats', methods=['GET'])
+def get_cache_stats():
+    error, status_code = check_operator()
+    if error: return jsonify(error), status_code
+    # Hit/miss counters for the in-process caches of this worker
+    return jsonify({
+        "principal": principal_cache.stats(),
+        "slots": slot_cache.stats(),
+        "directory": directory_cache.stats(),
+        "directoryPages": directory_page_cache.stats()
+    })
+
 # --- Doctor Endpoints ---
 
 
-@app.route('/api/doctors', methods=['GET'])
+@bp.route('/api/doctors', methods=['GET'])
 def get_doctors():
-    # Public endpoint - returns limited info from MongoDB
+    # Public endpoint - returns limited info, served from the in-process directory cache
+    specialization = request.args.get('specialization', '').strip().lower()
     try:
-        # Fetch only necessary fields from the doctors collection
-        doctors_cursor = db.doctors.find(
-            {}, # Empty filter to get all doctors
-            {
-                "_id": 1, # Include the ID
-                "name": 1,
-                "specialization": 1,
-                "profile_picture_url": 1,
-                "availability": 1 # Include availability schedule
-            }
-        )
-
-        doctor_list = []
-        for doc in doctors_cursor:
-            doctor_list.append({
-                # Convert ObjectId to string for JSON serialization
-                "id": str(doc['_id']),
-                "name": doc.get('name'),
-                "specialization": doc.get('specialization'),
-                "profilePictureUrl": doc.get('profile_picture_url'),
-                # Availability should already be stored as an object/dict
-                "availability": doc.get('availability', {})
-            })
+        limit = int(request.args.get('limit', current_app.config['DOCTOR_DIRECTORY_PAGE_SIZE']))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "'limit' and 'offset' must be integers."}), 400
+    limit = max(1, min(limit, current_app.config['DOCTOR_DIRECTORY_MAX_PAGE_SIZE']))
+    offset = max(0, offset)
+    if not (request.args.get('limit') or request.args.get('offset')):
+        limit = None # Clients that never page (the doctor list page) get the whole directory
+
+    if stream_requested():
+        # Export mode: every matching doctor streamed straight from the cursor, bypassing the cache
+        query = {}
+        if specialization:
+            query['specialization'] = {'$regex': rf'^\s*{re.escape(specialization)}\s*$', '$options': 'i'}
+        return streamed_json(db.doctors.find(query, DIRECTORY_PROJECTION), directory_entry)
 
-        return jsonify(doctor_list)
+    try:
+        version, doctor_list, by_specialization = get_doctor_directory()
+        matching = by_specialization.get(specialization, []) if specialization else doctor_list
+
+        page_key = (version, specialization, offset, limit)
+        etag = hashlib.md5(repr(page_key).encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            # Unchanged page: skip serialization entirely
+            response = current_app.response_class(status=304)
+        else:
+            body = directory_page_cache.get(page_key)
+            if body is None:
+                body = json.dumps(matching[offset:offset + limit] if limit else matching[offset:])
+                directory_page_cache.set(page_key, body)
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, no-cache'
+        response.headers['X-Total-Count'] = str(len(matching))
+        return response
     except Exception as e:
-        app.logger.error(f"Failed to fetch doctors: {e}")
+        current_app.logger.error(f"Failed to fetch doctors: {e}")
         return jsonify({"error": f"Failed to fetch doctors: {e}"}), 500
 
 
+@bp.route('/api/doctors/search', methods=['GET'])
+def search_doctors():
+    """Public doctor search: ?q= (words matched as prefixes of name or specialization words),
+    ?specialization= (prefix) and ?limit=. Returns directory cards, best match first.
+    """
+    query = request.args.get('q', '')[:100] # Bounded: every word is an index lookup
+    specialization = request.args.get('specialization', '')[:100]
+    try:
+        limit = int(request.args.get('limit', current_app.config['DOCTOR_SEARCH_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer."}), 400
+    limit = max(1, min(limit, current_app.config['DOCTOR_SEARCH_MAX_PAGE_SIZE']))
+
+    try:
+        return jsonify(get_doctor_search_index().search(query, specialization, limit))
+    except Exception as e:
+        current_app.logger.error(f"Doctor search failed: {e}")
+        return jsonify({"error": f"Doctor search failed: {e}"}), 500
+
+
 # Use string for ObjectId
-@app.route('/api/doctors/<string:doctor_id_str>', methods=['GET'])
+@bp.route('/api/doctors/<string:doctor_id_str>', methods=['GET'])
 def get_doctor_details(doctor_id_str):
     """Returns details for a specific doctor. Requires authentication."""
     # 1. Authentication Check
@@ -214,7 +882,7 @@ def get_doctor_details(doctor_id_str):
         # Doctors can only access their own profile
         if requesting_doctor_id is None:
              # This indicates an issue - a doctor user should have a doctor_id in their token context
-             app.logger.error(f"Doctor user {requesting_user_id} is missing doctor_id in token context.")
+             current_app.logger.error(f"Doctor user {requesting_user_id} is missing doctor_id in token context.")
              return jsonify({"error": "Internal server error: Doctor profile context missing."}), 500
         # Compare the requested doctor ID string with the one from the token
         if requesting_doctor_id != doctor_id_str:
@@ -225,7 +893,7 @@ def get_doctor_details(doctor_id_str):
         pass # Proceed
     else:
         # Block any other user type or if type is missing
-        app.logger.warning(f"Unauthorized access attempt to doctor details by user {requesting_user_id} with type {requesting_user_type}")
+        current_app.logger.warning(f"Unauthorized access attempt to doctor details by user {requesting_user_id} with type {requesting_user_type}")
         return jsonify({"error": "Unauthorized user type."}), 403
     # --- END Authorization Logic ---
 
@@ -254,15 +922,130 @@ def get_doctor_details(doctor_id_str):
             "bio": doctor.get('bio'),
             "profilePictureUrl": doctor.get('profile_picture_url'),
             # Availability should be stored as an object
-            "availability": doctor.get('availability', {})
+            "availability": doctor.get('availability', {}),
+            "availabilityOverrides": doctor.get('availability_overrides', []),
+            "appointmentDurations": doctor.get('appointment_durations', {})
         }
         return jsonify(doctor_details)
     except Exception as e:
-        app.logger.error(f"Failed to fetch doctor details for {doctor_id_str}: {e}")
+        current_app.logger.error(f"Failed to fetch doctor details for {doctor_id_str}: {e}")
         return jsonify({"error": f"Failed to fetch doctor details: {e}"}), 500
 
 
-@app.route('/api/doctors/me/availability', methods=['PUT'])
+@bp.route('/api/doctors/<string:doctor_id_str>/slots', methods=['GET'])
+def get_doctor_free_slots(doctor_id_str):
+    """Returns every free slot of a doctor between ?from= and ?to= (inclusive, YYYY-MM-DD).
+
+    Slots are as long as ?duration= (minutes), the doctor's duration for
+    ?visitType=, or the doctor's default duration.
+    """
+    requesting_user, error, status_code = get_user_from_token()
+    if error:
+        return jsonify(error), status_code
+
+    try:
+        doctor_oid = ObjectId(doctor_id_str)
+    except Exception:
+        return jsonify({"error": "Invalid doctor ID format"}), 400
+
+    try:
+        today = datetime.now().date()
+        from_date = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else today
+        to_date = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else from_date + timedelta(days=6)
+    except ValueError:
+        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD for 'from' and 'to'."}), 400
+    if to_date < from_date:
+        return jsonify({"error": "'to' must not be before 'from'."}), 400
+    if (to_date - from_date).days + 1 > current_app.config['SLOT_QUERY_MAX_DAYS']:
+        return jsonify({"error": f"Date range too large. Maximum is {current_app.config['SLOT_QUERY_MAX_DAYS']} days."}), 400
+
+    duration_arg, visit_type = request.args.get('duration'), request.args.get('visitType')
+    cache_key = (doctor_id_str, slot_cache_generations.get(doctor_id_str, 0), from_date, to_date, duration_arg, visit_type)
+    cached = slot_cache.get(cache_key)
+
+    if cached is None:
+        try:
+            doctor = db.doctors.find_one({'_id': doctor_oid},
+                                         {'availability': 1, 'availability_slots': 1, 'appointment_durations': 1})
+            if not doctor:
+                return jsonify({"error": "Doctor not found"}), 404
+            try:
+                duration = appointment_duration(doctor, duration_arg, visit_type)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            # One range query over the claimed slots of this doctor
+            range_start = datetime(from_date.year, from_date.month, from_date.day)
+            range_end = datetime(to_date.year, to_date.month, to_date.day) + timedelta(days=1)
+            booked = set(
+                claim['slot_start'] for claim in db[CLAIMS_COLLECTION].find(
+                    {'doctor_id': doctor_oid, 'slot_start': {'$gte': range_start, '$lt': range_end}},
+                    {'slot_start': 1, '_id': 0}
+                )
+            )
+
+            free_slots = iter_free_slots(
+                CompiledSchedule.from_document(doctor), booked, from_date, to_date, duration,
+                lambda slot: appointment_cells(slot, slot + timedelta(minutes=duration)), not_before=datetime.now()
+            )
+            body = json.dumps({
+                "doctorId": doctor_id_str,
+                "from": from_date.strftime('%Y-%m-%d'),
+                "to": to_date.strftime('%Y-%m-%d'),
+                "slotMinutes": duration,
+                "slots": [{"date": slot.strftime('%Y-%m-%d'), "time": slot.strftime('%H:%M')} for slot in free_slots]
+            })
+            cached = (hashlib.md5(body.encode()).hexdigest(), body)
+            slot_cache.set(cache_key, cached)
+        except Exception as e:
+            current_app.logger.error(f"Failed to compute free slots for doctor {doctor_id_str}: {e}")
+            return jsonify({"error": f"Failed to compute free slots: {e}"}), 500
+
+    etag, body = cached
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Clients revalidate every time; unchanged listings cost a 304 with no body
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+@bp.route('/api/search/earliest', methods=['GET'])
+def search_earliest_slots():
+    """Returns the earliest open slots across all doctors of a specialization."""
+    requesting_user, error, status_code = get_user_from_token()
+    if error:
+        return jsonify(error), status_code
+
+    specialization = request.args.get('specialization', '')
+    try:
+        after = datetime.strptime(request.args['after'], '%Y-%m-%dT%H:%M') if request.args.get('after') else datetime.now()
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({"error": "Invalid parameters. 'after' must be YYYY-MM-DDTHH:MM and 'limit' an integer."}), 400
+    limit = max(1, min(limit, current_app.config['EARLIEST_SEARCH_MAX_LIMIT']))
+    # Never offer slots in the past
+    after = max(after, datetime.now())
+
+    try:
+        results = get_availability_index().earliest(
+            specialization, after, limit, current_app.config['EARLIEST_SEARCH_HORIZON_DAYS'])
+    except Exception as e:
+        current_app.logger.error(f"Earliest slot search failed for specialization '{specialization}': {e}")
+        return jsonify({"error": f"Search failed: {e}"}), 500
+
+    return jsonify({
+        "specialization": specialization,
+        "slots": [{
+            "doctorId": entry.doctor_id,
+            "doctorName": entry.name,
+            "specialization": entry.specialization,
+            "date": slot.strftime('%Y-%m-%d'),
+            "time": slot.strftime('%H:%M')
+        } for slot, entry in results]
+    })
+
+
+@bp.route('/api/doctors/me/availability', methods=['PUT'])
 def update_doctor_availability():
     # doctor_user is a dictionary
     doctor_user, error, status_code = get_user_from_token()
@@ -275,14 +1058,15 @@ def update_doctor_availability():
     # Get the doctor's profile ID (string) from the token context
     doctor_id_str = doctor_user.get('doctor_id')
     if not doctor_id_str:
-        app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during availability update.")
+        current_app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during availability update.")
         return jsonify({"error": "Internal server error: Doctor context missing."}), 500
 
-    new_availability = request.get_json()
-    # Basic validation for the availability data structure
-    if not new_availability or not isinstance(new_availability, dict):
-        return jsonify({"error": "Invalid availability data format. Expected a JSON object."}), 400
-    # TODO: Add more specific validation for the structure of the availability object (days, times, etc.)
+    # Weekday entries plus optional date overrides; times must sit on the bitmap grid
+    try:
+        new_availability, overrides = validate_availability(
+            request.get_json(silent=True), current_app.config['AVAILABILITY_GRANULARITY_MINUTES'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
         doctor_oid = ObjectId(doctor_id_str)
@@ -290,15 +1074,28 @@ def update_doctor_availability():
         return jsonify({"error": "Invalid doctor ID format in token."}), 500 # Should not happen if token generation is correct
 
     try:
+        update = {'availability': new_availability}
+        if overrides is None:
+            # Overrides not sent: keep the stored ones and recompile them with the new week
+            current = db.doctors.find_one({'_id': doctor_oid}, {'availability_overrides': 1}) or {}
+            overrides = current.get('availability_overrides') or []
+        else:
+            update['availability_overrides'] = overrides
+        schedule = CompiledSchedule.compile(new_availability, overrides,
+                                            current_app.config['AVAILABILITY_GRANULARITY_MINUTES'])
+        update['availability_slots'] = schedule.to_document()
+
         # --- MongoDB Update ---
-        update_result = db.doctors.update_one(
-            {'_id': doctor_oid}, # Filter by the doctor's ObjectId
-            {'$set': {'availability': new_availability}} # Set the new availability object
-        )
+        update_result = db.doctors.update_one({'_id': doctor_oid}, {'$set': update})
+        invalidate_principal(doctor_user.get('_id'))
+        invalidate_doctor_slots(doctor_id_str)
+        invalidate_doctor_directory()
+        availability_index.set_availability(doctor_id_str, schedule)
+        update_doctor_search(doctor_oid)
 
         if update_result.matched_count == 0:
             # This means the doctor_oid from the token didn't match any document
-            app.logger.error(f"Attempted to update availability for non-existent doctor ID: {doctor_id_str}")
+            current_app.logger.error(f"Attempted to update availability for non-existent doctor ID: {doctor_id_str}")
             return jsonify({"error": "Doctor profile not found for update."}), 404
         elif update_result.modified_count == 0 and update_result.matched_count == 1:
              # Found the doctor, but the data was the same as existing data
@@ -308,12 +1105,116 @@ def update_doctor_availability():
             return jsonify({"message": "Availability updated successfully."}), 200
 
     except Exception as e:
-        app.logger.error(f"Failed to update availability for doctor {doctor_id_str}: {e}")
+        current_app.logger.error(f"Failed to update availability for doctor {doctor_id_str}: {e}")
         # No db.session.rollback() needed with PyMongo for single operations
         return jsonify({"error": f"Failed to update availability: {e}"}), 500
 
 
-@app.route('/api/doctors/me/profile', methods=['PUT'])
+STATS_DOCTOR_PROJECTION = {'name': 1, 'availability': 1, 'availability_slots': 1, 'availability_overrides': 1}
+
+
+def stats_request():
+    """Parses ?from= / ?to= (YYYY-MM-DD, inclusive; default the last 7 days) and ?period=day|week.
+
+    Raises ValueError on bad input.
+    """
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else datetime.now().date()
+    start = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+             else end - timedelta(days=6))
+    if start > end:
+        raise ValueError("'from' must not be after 'to'.")
+    if (end - start).days >= current_app.config['STATS_MAX_DAYS']:
+        raise ValueError(f"At most {current_app.config['STATS_MAX_DAYS']} days can be requested at once.")
+    period = request.args.get('period', 'day')
+    if period not in ('day', 'week'):
+        raise ValueError("Invalid period. Allowed: day, week")
+    return start, end, period
+
+
+def doctor_stats(doctors, start, end, period):
+    """Counters, available minutes and utilization per doctor and day (or ISO week starting Monday).
+
+    Reads one counter document per doctor and day; available minutes come
+    from each doctor's compiled schedule.
+    """
+    counters = read_counters(db, [doctor['_id'] for doctor in doctors], start, end)
+    result = []
+    for doctor in doctors:
+        schedule = CompiledSchedule.from_document(doctor)
+        periods = {}
+        day = start
+        while day <= end:
+            key = day if period == 'day' else day - timedelta(days=day.weekday())
+            totals = periods.get(key)
+            if totals is None:
+                totals = periods[key] = {**dict.fromkeys(STATS_COUNTERS, 0), 'available_minutes': 0}
+            for counter, value in counters.get((doctor['_id'], day), {}).items():
+                totals[counter] += value
+            totals['available_minutes'] += schedule.available_minutes(day)
+            day += timedelta(days=1)
+        result.append({
+            "doctorId": str(doctor['_id']),
+            "name": doctor.get('name'),
+            "periods": [{
+                "start": key.isoformat(),
+                "booked": totals['booked'],
+                "cancelled": totals['cancelled'],
+                "completed": totals['completed'],
+                "expired": totals['expired'],
+                "bookedMinutes": totals['booked_minutes'],
+                "availableMinutes": totals['available_minutes'],
+                # Share of the doctor's hours taken by appointments that were not cancelled
+                "utilization": round(totals['booked_minutes'] / totals['available_minutes'], 4)
+                if totals['available_minutes'] else None
+            } for key, totals in periods.items()]
+        })
+    return result
+
+
+@bp.route('/api/doctors/me/stats', methods=['GET'])
+def get_my_doctor_stats():
+    # Bookings, cancellations, completions and utilization of the logged-in doctor
+    doctor_user, error, status_code = get_user_from_token()
+    if error: return jsonify(error), status_code
+
+    if doctor_user.get('token_user_type') != 'doctor':
+        return jsonify({"error": "Unauthorized: Only doctors can view their statistics."}), 403
+    doctor_id_str = doctor_user.get('doctor_id')
+    if not doctor_id_str:
+        return jsonify({"error": "Internal server error: Doctor context missing."}), 500
+
+    try:
+        start, end, period = stats_request()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid statistics parameters: {e}"}), 400
+
+    doctor = db.doctors.find_one({'_id': ObjectId(doctor_id_str)}, STATS_DOCTOR_PROJECTION)
+    if not doctor:
+        return jsonify({"error": "Doctor profile not found."}), 404
+    stats = doctor_stats([doctor], start, end, period)[0]
+    return jsonify({"from": start.isoformat(), "to": end.isoformat(), "period": period, **stats})
+
+
+@bp.route('/api/internal/doctor-stats', methods=['GET'])
+def get_doctor_stats():
+    # Clinic-wide statistics for operators, like cache-stats (operator token required).
+    # ?doctorId= (comma separated) narrows it to some doctors.
+    error, status_code = check_operator()
+    if error: return jsonify(error), status_code
+    try:
+        start, end, period = stats_request()
+        doctor_filter = {}
+        if request.args.get('doctorId'):
+            doctor_filter['_id'] = {'$in': [ObjectId(value.strip()) for value in request.args['doctorId'].split(',')]}
+    except Exception as e:
+        return jsonify({"error": f"Invalid statistics parameters: {e}"}), 400
+
+    doctors = list(db.doctors.find(doctor_filter, STATS_DOCTOR_PROJECTION))
+    return jsonify({"from": start.isoformat(), "to": end.isoformat(), "period": period,
+                    "doctors": doctor_stats(doctors, start, end, period) if doctors else []})
+
+
+@bp.route('/api/doctors/me/profile', methods=['PUT'])
 def update_doctor_profile():
     # doctor_user is a dictionary
     doctor_user, error, status_code = get_user_from_token()
@@ -326,7 +1227,7 @@ def update_doctor_profile():
     # Get doctor's profile ID string from token context
     doctor_id_str = doctor_user.get('doctor_id')
     if not doctor_id_str:
-        app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during profile update.")
+        current_app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during profile update.")
         return jsonify({"error": "Internal server error: Doctor context missing."}), 500
 
     data = request.get_json()
@@ -339,6 +1240,15 @@ def update_doctor_profile():
         update_fields['phone'] = data['phone']
     if 'bio' in data:
         update_fields['bio'] = data['bio']
+    if 'appointmentDurations' in data:
+        # {"default": 30, "<visit type>": minutes, ...}
+        durations = data['appointmentDurations'] or {}
+        if not isinstance(durations, dict) or not all(isinstance(k, str) and k for k in durations):
+            return jsonify({"error": "appointmentDurations must map visit types (or 'default') to minutes."}), 400
+        try:
+            update_fields['appointment_durations'] = {k: check_duration(v) for k, v in durations.items()}
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     # Only proceed if there's something to update
     if not update_fields:
@@ -355,9 +1265,15 @@ def update_doctor_profile():
             {'_id': doctor_oid}, # Filter by doctor's ObjectId
             {'$set': update_fields} # Set the fields provided
         )
+        invalidate_principal(doctor_user.get('_id'))
+        invalidate_doctor_directory()
+        update_doctor_search(doctor_oid)
+        if 'appointment_durations' in update_fields:
+            invalidate_doctor_slots(doctor_id_str)
+            availability_index.upsert_doctor({'_id': doctor_oid, **update_fields})
 
         if update_result.matched_count == 0:
-            app.logger.error(f"Attempted to update profile for non-existent doctor ID: {doctor_id_str}")
+            current_app.logger.error(f"Attempted to update profile for non-existent doctor ID: {doctor_id_str}")
             return jsonify({"error": "Doctor profile not found for update."}), 404
         elif update_result.modified_count == 0 and update_result.matched_count == 1:
              # Found the doctor, but the data was the same as existing data
@@ -367,23 +1283,24 @@ def update_doctor_profile():
             # Fetch the updated document to return the current state (optional but good practice)
             updated_profile = db.doctors.find_one(
                 {'_id': doctor_oid},
-                {'phone': 1, 'bio': 1} # Project only the updated fields
+                {'phone': 1, 'bio': 1, 'appointment_durations': 1} # Project only the updated fields
             )
             return jsonify({
                 "message": "Profile updated successfully.",
                 # Return only the fields that could have been updated
                 "profile": {
                     "phone": updated_profile.get('phone'),
-                    "bio": updated_profile.get('bio')
+                    "bio": updated_profile.get('bio'),
+                    "appointmentDurations": updated_profile.get('appointment_durations', {})
                 }
              }), 200
 
     except Exception as e:
-        app.logger.error(f"Failed to update profile for doctor {doctor_id_str}: {e}")
+        current_app.logger.error(f"Failed to update profile for doctor {doctor_id_str}: {e}")
         return jsonify({"error": f"Failed to update profile: {e}"}), 500
 
 
-@app.route('/api/doctors/me/profile-picture', methods=['POST'])
+@bp.route('/api/doctors/me/profile-picture', methods=['POST'])
 def upload_profile_picture():
     # doctor_user is a dictionary
     doctor_user, error, status_code = get_user_from_token()
@@ -396,7 +1313,7 @@ def upload_profile_picture():
     # Get doctor's profile ID string from token context
     doctor_id_str = doctor_user.get('doctor_id')
     if not doctor_id_str:
-        app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during picture upload.")
+        current_app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during picture upload.")
         return jsonify({"error": "Internal server error: Doctor context missing."}), 500
 
     # --- File Handling ---
@@ -407,10 +1324,8 @@ def upload_profile_picture():
         return jsonify({"error": "No selected file."}), 400
 
     if file and allowed_file(file.filename):
-        # Generate unique filename
-        filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        new_file_url = f"/uploads/profile_pics/{filename}" # URL path for frontend
+        upload_folder = current_app.config['UPLOAD_FOLDER']
+        extension = file.filename.rsplit('.', 1)[1].lower()
 
         try:
             doctor_oid = ObjectId(doctor_id_str)
@@ -418,6 +1333,8 @@ def upload_profile_picture():
             return jsonify({"error": "Invalid doctor ID format in token."}), 500
 
         old_file_url = None
+        temp_path = None
+        referenced_filename = None
         try:
             # --- Fetch old URL before saving new file ---
             doctor_profile = db.doctors.find_one({'_id': doctor_oid}, {'profile_picture_url': 1})
@@ -426,45 +1343,53 @@ def upload_profile_picture():
                  return jsonify({"error": "Doctor profile not found."}), 404
             old_file_url = doctor_profile.get('profile_picture_url')
 
-            # --- Save the new file ---
-            file.save(filepath)
+            # --- Save the new file under its content hash ---
+            # Identical pictures end up under the same name and are stored only once
+            filename, temp_path = write_content_addressed(file.stream, upload_folder, extension)
+            add_reference(db, filename)
+            referenced_filename = filename
+            publish(temp_path, upload_folder, filename)
+            temp_path = None
+            new_file_url = f"/uploads/profile_pics/{filename}" # URL path for frontend
 
             # --- Update MongoDB ---
             update_result = db.doctors.update_one(
                 {'_id': doctor_oid},
                 {'$set': {'profile_picture_url': new_file_url}}
             )
+            invalidate_principal(doctor_user.get('_id'))
+            invalidate_doctor_directory()
+            update_doctor_search(doctor_oid)
 
             if update_result.matched_count == 0:
                 # Should not happen if find_one succeeded, but good to check
-                app.logger.error(f"Failed to update profile picture URL for doctor {doctor_id_str} after saving file.")
-                # Attempt to delete the newly saved file if DB update failed
-                try: os.remove(filepath)
-                except OSError as remove_error: app.logger.error(f"Failed to remove orphaned profile picture {filepath}: {remove_error}")
+                current_app.logger.error(f"Failed to update profile picture URL for doctor {doctor_id_str} after saving file.")
+                # Drop the reference taken for this doctor (removes the file if nobody else uses it)
+                release_reference(db, filename, upload_folder, logger=current_app.logger)
                 return jsonify({"error": "Failed to update profile picture reference."}), 500
 
-            # --- Attempt to delete old file (if it existed) ---
+            # --- Release the old file (deleted once no doctor references it) ---
             if old_file_url:
                 try:
-                    # Construct full path from URL (assuming URL structure matches file storage)
+                    # Construct file name from URL (assuming URL structure matches file storage)
                     old_filename = os.path.basename(old_file_url)
-                    old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_filename)
-                    if os.path.exists(old_filepath):
-                        os.remove(old_filepath)
-                        app.logger.info(f"Successfully deleted old profile picture: {old_filepath}")
+                    if release_reference(db, old_filename, upload_folder, logger=current_app.logger):
+                        current_app.logger.info(f"Deleted unreferenced profile picture: {old_filename}")
                 except Exception as delete_error:
                     # Log error but don't fail the request, as the main goal (upload) succeeded
-                    app.logger.error(f"Failed to delete old profile picture {old_file_url}: {delete_error}")
+                    current_app.logger.error(f"Failed to release old profile picture {old_file_url}: {delete_error}")
 
             return jsonify({"message": "Profile picture updated", "profilePictureUrl": new_file_url}), 200
 
         except Exception as e:
-            app.logger.error(f"Failed during profile picture upload for doctor {doctor_id_str}: {e}")
-            # No db.session.rollback() needed
-            # Consider deleting the saved file if an error occurred during DB update or fetch
-            if os.path.exists(filepath):
-                 try: os.remove(filepath)
-                 except OSError as remove_error: app.logger.error(f"Failed to remove partially uploaded file {filepath}: {remove_error}")
+            current_app.logger.error(f"Failed during profile picture upload for doctor {doctor_id_str}: {e}")
+            # Clean up whatever part of the upload already happened
+            if temp_path and os.path.exists(temp_path):
+                 try: os.remove(temp_path)
+                 except OSError as remove_error: current_app.logger.error(f"Failed to remove partially uploaded file {temp_path}: {remove_error}")
+            if referenced_filename:
+                 try: release_reference(db, referenced_filename, upload_folder, logger=current_app.logger)
+                 except Exception as release_error: current_app.logger.error(f"Failed to release reference to {referenced_filename}: {release_error}")
             return jsonify({"error": f"Failed to save or update picture: {e}"}), 500
     else:
         return jsonify({"error": "File type not allowed. Allowed types: " + ", ".join(ALLOWED_EXTENSIONS)}), 400
@@ -472,7 +1397,27 @@ def upload_profile_picture():
 # --- Auth Endpoints ---
 
 
-@app.route('/api/register', methods=['POST'])
+def busy_response():
+    # Fast rejection while the hashing pool is saturated; clients should retry shortly
+    response = jsonify({"error": "Server is busy, please retry in a moment."})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def upgrade_password_hash(user, password):
+    """Re-hashes a password with the configured parameters after a successful login."""
+    try:
+        new_hash = password_hasher.hash(password)
+        # Only replace the hash we verified, in case the password changed meanwhile
+        db.users.update_one({'_id': user['_id'], 'password_hash': user['password_hash']},
+                            {'$set': {'password_hash': new_hash}})
+    except HasherBusyError:
+        pass # Try again on a later login
+    except Exception as e:
+        current_app.logger.error(f"Failed to upgrade password hash for user {user['_id']}: {e}")
+
+
+@bp.route('/api/register', methods=['POST'])
 def register_user():
     data = request.get_json()
     if not data or not data.get('email') or not data.get('password') or not data.get('userType') or not data.get('name'):
@@ -493,7 +1438,10 @@ def register_user():
     if user_type == 'doctor' and not specialization:
         return jsonify({"error": "Specialization required for doctors"}), 400
 
-    password_hash = generate_password_hash(password)
+    try:
+        password_hash = password_hasher.hash(password)
+    except HasherBusyError:
+        return busy_response()
 
     # --- Create User Document ---
     user_doc = {
@@ -522,23 +1470,31 @@ def register_user():
                 "bio": data.get('bio'),
                 "profile_picture_url": None,
                 "availability": default_availability, # Store availability object directly
+                "availability_slots": CompiledSchedule.compile(
+                    default_availability, [], current_app.config['AVAILABILITY_GRANULARITY_MINUTES']).to_document(),
                 "created_at": datetime.utcnow()
             }
             # --- Insert Doctor ---
             db.doctors.insert_one(doctor_doc)
+            availability_index.upsert_doctor(doctor_doc)
+            invalidate_doctor_directory()
+            if doctor_search_index.loaded_at is not None:
+                doctor_search_index.upsert(directory_entry(doctor_doc))
+
+        invalidate_principal(new_user_id)
 
         return jsonify({"message": f"{user_type.capitalize()} registered successfully!"}), 201
 
     except Exception as e:
         # Basic error handling, consider more specific exceptions like pymongo.errors.DuplicateKeyError
-        app.logger.error(f"Registration failed: {e}")
+        current_app.logger.error(f"Registration failed: {e}")
         # If user insert succeeded but doctor failed, you might want to remove the user.
         # This requires more complex transaction logic or cleanup steps.
         # For simplicity, we are not implementing that rollback here.
         return jsonify({"error": f"Registration failed due to server error: {e}"}), 500
 
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login_user():
     data = request.get_json()
     if not data or not data.get('email') or not data.get('password') or not data.get('userType'):
@@ -551,8 +1507,17 @@ def login_user():
     # --- MongoDB Find User ---
     user = db.users.find_one({'email': email})
 
-    # Check if user exists, password matches, and user type matches request
-    if user and check_password_hash(user['password_hash'], password) and user['user_type'] == user_type_from_request:
+    # Check if user exists, user type matches request, and password matches (hashed in the pool)
+    try:
+        authenticated = bool(user) and user['user_type'] == user_type_from_request \
+            and password_hasher.verify(user['password_hash'], password)
+    except HasherBusyError:
+        return busy_response()
+
+    if authenticated:
+        if password_hasher.needs_rehash(user['password_hash']):
+            upgrade_password_hash(user, password)
+
         # --- Create JWT Token ---
         # Use string representation of ObjectId for user_id in token
         token_payload = {
@@ -560,28 +1525,34 @@ def login_user():
             'user_type': user['user_type'],
             'exp': datetime.utcnow() + timedelta(hours=24) # Token expiry
         }
-        token = jwt.encode(token_payload, app.config['SECRET_KEY'], algorithm='HS256')
-
-        response_data = {
-            "message": "Login successful!",
-            "token": token,
-            "userType": user['user_type']
-        }
+        doctor_id_str = None
 
         # If the user is a doctor, find their Doctor profile ID and add it
         if user['user_type'] == 'doctor':
             # --- MongoDB Find Doctor Profile ---
             # Find doctor profile linked by the user's ObjectId
-            doctor_profile = db.doctors.find_one({'user_id': user['_id']})
+            doctor_profile = db.doctors.find_one({'user_id': user['_id']}, {'_id': 1})
             if doctor_profile:
-                # Add the doctor's *own* ObjectId (as string) from the doctors collection
-                response_data['doctorId'] = str(doctor_profile['_id'])
+                # The doctor's *own* ObjectId (as string) from the doctors collection
+                doctor_id_str = str(doctor_profile['_id'])
+                # Carried in the token so authenticated requests skip the doctors lookup
+                token_payload['doctor_id'] = doctor_id_str
             else:
                 # Log a warning if a doctor user logs in but has no doctor profile
-                app.logger.warning(f"Doctor user {user['_id']} logged in but has no corresponding Doctor profile.")
+                current_app.logger.warning(f"Doctor user {user['_id']} logged in but has no corresponding Doctor profile.")
                 # Depending on requirements, you might want to return an error here
                 # return jsonify({"error": "Doctor profile configuration error."}), 500
 
+        token = jwt.encode(token_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+
+        response_data = {
+            "message": "Login successful!",
+            "token": token,
+            "userType": user['user_type']
+        }
+        if doctor_id_str:
+            response_data['doctorId'] = doctor_id_str
+
         return jsonify(response_data), 200
     else:
         # Authentication failed (user not found, wrong password, or wrong user type)
@@ -590,7 +1561,7 @@ def login_user():
 # --- Appointment Endpoints ---
 
 
-@app.route('/api/appointments', methods=['POST'])
+@bp.route('/api/appointments', methods=['POST'])
 def book_appointment():
     # patient_user is a dictionary
     patient_user, error, status_code = get_user_from_token()
@@ -611,69 +1582,254 @@ def book_appointment():
     patient_id_str = patient_user.get('_id') # Get patient's ID string from token context
 
     # --- Log IDs before conversion for debugging ---
-    app.logger.info(f"Attempting to book appointment. Doctor ID received: '{doctor_id_str}', Patient ID from token: '{patient_id_str}'")
+    current_app.logger.info(f"Attempting to book appointment. Doctor ID received: '{doctor_id_str}', Patient ID from token: '{patient_id_str}'")
 
     try:
         doctor_oid = ObjectId(doctor_id_str)
         patient_oid = ObjectId(patient_id_str)
     except Exception as e:
         # Log the specific error during conversion
-        app.logger.error(f"ObjectId conversion failed. Doctor ID: '{doctor_id_str}', Patient ID: '{patient_id_str}'. Error: {e}")
+        current_app.logger.error(f"ObjectId conversion failed. Doctor ID: '{doctor_id_str}', Patient ID: '{patient_id_str}'. Error: {e}")
         return jsonify({"error": "Invalid ID format for doctor or patient."}), 400
 
+    try:
+        appointment_datetime = datetime.strptime(f"{appt_date_str} {appt_time_str}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        return jsonify({"error": "Invalid date or time format provided."}), 400
+
     # --- Fetch Doctor Info ---
-    doctor = db.doctors.find_one({'_id': doctor_oid}, {'name': 1}) # Get only name
+    doctor = db.doctors.find_one({'_id': doctor_oid}, {'name': 1, 'availability': 1, 'availability_slots': 1,
+                                                       'appointment_durations': 1}) # Name, schedule and durations only
     if not doctor:
         return jsonify({"error": "Doctor not found."}), 404
     doctor_name = doctor.get('name', 'N/A') # Get doctor's name
+    unavailable_error = {"error": f"Dr. {doctor_name} is not available at the selected time or the slot is booked."}
 
-    # --- Check Availability (using the updated function) ---
-    if not check_backend_availability(doctor_id_str, appt_date_str, appt_time_str):
-        # check_backend_availability now handles logging internally
-        return jsonify({"error": f"Dr. {doctor_name} is not available at the selected time or the slot is booked."}), 409
+    try:
+        duration = appointment_duration(doctor, data.get('durationMinutes'), data.get('visitType'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    appointment_end_datetime = appointment_datetime + timedelta(minutes=duration)
+
+    # --- Check Availability against the weekly schedule ---
+    if not check_backend_availability(doctor, appointment_datetime, appointment_end_datetime):
+        return jsonify(unavailable_error), 409
+
+    # --- Reserve the interval ---
+    # The claim insert is the single atomic step that decides who gets the time
+    new_appointment_id = ObjectId()
+    cells = appointment_cells(appointment_datetime, appointment_end_datetime)
+    try:
+        claim_slot(db, doctor_oid, cells, new_appointment_id)
+    except SlotTakenError:
+        current_app.logger.info(f"Booking rejected: slot already claimed for Dr {doctor_id_str} at {appt_date_str} {appt_time_str}")
+        return jsonify(unavailable_error), 409
 
     try:
         # --- Prepare Appointment Document ---
-        appointment_datetime = datetime.strptime(f"{appt_date_str} {appt_time_str}", "%Y-%m-%d %H:%M")
         patient_name = patient_user.get('name', f"Patient {patient_id_str}") # Use name from user doc
+        created_at = datetime.utcnow()
 
         appointment_doc = {
+            "_id": new_appointment_id, # Same id the slot claim points to
             "doctor_id": doctor_oid, # Store as ObjectId
             "patient_id": patient_oid, # Store as ObjectId
             "patient_name": patient_name,
             "doctor_name": doctor_name,
             "appointment_datetime": appointment_datetime, # Store as BSON datetime
+            "appointment_end": appointment_end_datetime,
+            "visit_type": data.get('visitType'),
             "reason": reason,
             "status": "upcoming", # Default status
-            "created_at": datetime.utcnow()
+            "created_at": created_at,
+            "updated_at": created_at # Stamped by every write; drives ?since= delta sync
         }
 
         # --- Insert Appointment ---
-        insert_result = db.appointments.insert_one(appointment_doc)
-        new_appointment_id = insert_result.inserted_id
-
-        # --- Prepare Response Data ---
-        appointment_data = {
-            "id": str(new_appointment_id), # Convert ObjectId to string
-            "doctorId": str(appointment_doc['doctor_id']),
-            "doctorName": appointment_doc['doctor_name'],
-            "patientId": str(appointment_doc['patient_id']),
-            "patientName": appointment_doc['patient_name'],
-            "date": appointment_doc['appointment_datetime'].strftime('%Y-%m-%d'),
-            "time": appointment_doc['appointment_datetime'].strftime('%H:%M'),
-            "reason": appointment_doc['reason'],
-            "status": appointment_doc['status']
-        }
-        return jsonify({"message": "Appointment booked successfully!", "appointment": appointment_data}), 201
+        db.appointments.insert_one(appointment_doc)
+        invalidate_doctor_slots(doctor_id_str)
+        availability_index.add_booking(doctor_id_str, cells)
+        publish_appointment_event('created', appointment_doc)
+        record_stats(doctor_oid, appointment_datetime, booked=1, booked_minutes=duration)
 
-    except ValueError:
-         return jsonify({"error": "Invalid date or time format provided."}), 400
+        return jsonify({"message": "Appointment booked successfully!", "appointment": appointment_data(appointment_doc)}), 201
+
+    except Exception as e:
+        current_app.logger.error(f"Booking failed for patient {patient_id_str} with doctor {doctor_id_str}: {e}")
+        # Give the slot back so it does not stay reserved by an appointment that was never stored
+        try: release_claim(db, new_appointment_id)
+        except Exception as release_error: current_app.logger.error(f"Failed to release slot claim for {new_appointment_id}: {release_error}")
+        return jsonify({"error": f"Booking failed due to server error: {e}"}), 500
+
+RECURRENCE_STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(weeks=1)}
+
+
+def batch_occurrences(data):
+    """Returns the datetimes a batch booking asks for, in request order. Raises ValueError on bad input.
+
+    Either an explicit list, occurrences=[{date, time}, ...], or a first visit
+    (date, time) plus recurrence={frequency: daily|weekly, interval, count}.
+    """
+    max_occurrences = current_app.config['BATCH_BOOKING_MAX_OCCURRENCES']
+    if data.get('occurrences') is not None:
+        occurrences = data['occurrences']
+        if not isinstance(occurrences, list) or not occurrences:
+            raise ValueError("'occurrences' must be a non-empty list of {date, time}.")
+        if len(occurrences) > max_occurrences:
+            raise ValueError(f"At most {max_occurrences} occurrences can be booked at once.")
+        try:
+            return [datetime.strptime(f"{item['date']} {item['time']}", "%Y-%m-%d %H:%M") for item in occurrences]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Invalid date or time format in 'occurrences'.")
+
+    recurrence = data.get('recurrence')
+    if not isinstance(recurrence, dict) or not data.get('date') or not data.get('time'):
+        raise ValueError("Provide 'occurrences', or 'date', 'time' and 'recurrence'.")
+    step = RECURRENCE_STEPS.get(recurrence.get('frequency', 'weekly'))
+    if step is None:
+        raise ValueError(f"Invalid recurrence frequency. Allowed: {', '.join(sorted(RECURRENCE_STEPS))}")
+    try:
+        interval = int(recurrence.get('interval', 1))
+        count = int(recurrence['count'])
+        first = datetime.strptime(f"{data['date']} {data['time']}", "%Y-%m-%d %H:%M")
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Recurrence needs an integer 'count' (and optional 'interval') and a valid date and time.")
+    if interval < 1 or count < 1:
+        raise ValueError("Recurrence 'interval' and 'count' must be at least 1.")
+    if count > max_occurrences:
+        raise ValueError(f"At most {max_occurrences} occurrences can be booked at once.")
+    return [first + step * interval * i for i in range(count)]
+
+
+@bp.route('/api/appointments/batch', methods=['POST'])
+def book_appointments_batch():
+    """Books several visits with one doctor in a single request (e.g. every Tuesday 10:00 for 12 weeks).
+
+    All occurrences are checked against the schedule and one range query over
+    the doctor's claims, then claimed and inserted with one insert_many each.
+    With atomic=true nothing is booked unless every occurrence is free;
+    otherwise free occurrences are booked and the rest reported as conflicts.
+    """
+    patient_user, error, status_code = get_user_from_token()
+    if error: return jsonify(error), status_code
+
+    if patient_user.get('token_user_type') != 'patient':
+        return jsonify({"error": "Unauthorized: Only patients can book appointments."}), 403
+
+    data = request.get_json()
+    if not data or not data.get('doctorId'):
+        return jsonify({"error": "Missing required field doctorId."}), 400
+    doctor_id_str = data['doctorId']
+    patient_id_str = patient_user.get('_id')
+    atomic = data.get('atomic', False)
+    if not isinstance(atomic, bool):
+        # "false" or 0 must not silently mean all-or-nothing (or the reverse)
+        return jsonify({"error": "'atomic' must be true or false."}), 400
+
+    try:
+        doctor_oid = ObjectId(doctor_id_str)
+        patient_oid = ObjectId(patient_id_str)
+    except Exception:
+        return jsonify({"error": "Invalid ID format for doctor or patient."}), 400
+
+    try:
+        requested = batch_occurrences(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    doctor = db.doctors.find_one({'_id': doctor_oid}, {'name': 1, 'availability': 1, 'availability_slots': 1,
+                                                       'appointment_durations': 1})
+    if not doctor:
+        return jsonify({"error": "Doctor not found."}), 404
+    doctor_name = doctor.get('name', 'N/A')
+    try:
+        length = timedelta(minutes=appointment_duration(doctor, data.get('durationMinutes'), data.get('visitType')))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # --- Check every occurrence: schedule, overlaps within the request, and one range query for taken cells ---
+    occurrence_cells = [appointment_cells(when, when + length) for when in requested]
+    taken = set(
+        claim['slot_start'] for claim in db[CLAIMS_COLLECTION].find(
+            {'doctor_id': doctor_oid, 'slot_start': {'$gte': min(cells[0] for cells in occurrence_cells),
+                                                     '$lte': max(cells[-1] for cells in occurrence_cells)}},
+            {'slot_start': 1, '_id': 0}
+        )
+    )
+    conflicts, candidates, seen = [], [], set()
+    for when, cells in zip(requested, occurrence_cells):
+        if not check_backend_availability(doctor, when, when + length):
+            reason = 'unavailable'
+        elif not seen.isdisjoint(cells):
+            reason = 'duplicate'
+        elif not taken.isdisjoint(cells):
+            reason = 'booked'
+        else:
+            seen.update(cells)
+            candidates.append((when, cells, ObjectId()))
+            continue
+        conflicts.append({"date": when.strftime('%Y-%m-%d'), "time": when.strftime('%H:%M'), "reason": reason})
+
+    def conflict_response(message):
+        conflicts.sort(key=lambda c: (c['date'], c['time']))
+        return jsonify({"error": message, "conflicts": conflicts}), 409
+
+    if not candidates or (atomic and conflicts):
+        return conflict_response(f"Dr. {doctor_name} is not available for {len(conflicts)} of the requested times; nothing was booked.")
+
+    # --- Reserve the intervals; collisions with concurrent bookings surface here ---
+    lost = claim_slots(db, [(doctor_oid, cells, appointment_oid) for _, cells, appointment_oid in candidates])
+    if lost:
+        for when, _, appointment_oid in candidates:
+            if appointment_oid in lost:
+                conflicts.append({"date": when.strftime('%Y-%m-%d'), "time": when.strftime('%H:%M'), "reason": 'booked'})
+        claimed = [c for c in candidates if c[2] not in lost]
+        if atomic or not claimed:
+            release_claims(db, [appointment_oid for _, _, appointment_oid in claimed])
+            return conflict_response(f"Dr. {doctor_name} is not available for {len(conflicts)} of the requested times; nothing was booked.")
+        candidates = claimed
+
+    try:
+        now = datetime.utcnow()
+        patient_name = patient_user.get('name', f"Patient {patient_id_str}")
+        appointment_docs = [{
+            "_id": appointment_oid,
+            "doctor_id": doctor_oid,
+            "patient_id": patient_oid,
+            "patient_name": patient_name,
+            "doctor_name": doctor_name,
+            "appointment_datetime": when,
+            "appointment_end": when + length,
+            "visit_type": data.get('visitType'),
+            "reason": data.get('reason', ''),
+            "status": "upcoming",
+            "created_at": now,
+            "updated_at": now
+        } for when, _, appointment_oid in candidates]
+        db.appointments.insert_many(appointment_docs)
     except Exception as e:
-        app.logger.error(f"Booking failed for patient {patient_id_str} with doctor {doctor_id_str}: {e}")
-        # No db.session.rollback() needed
+        current_app.logger.error(f"Batch booking failed for patient {patient_id_str} with doctor {doctor_id_str}: {e}")
+        try: release_claims(db, [appointment_oid for _, _, appointment_oid in candidates])
+        except Exception as release_error: current_app.logger.error(f"Failed to release batch slot claims: {release_error}")
         return jsonify({"error": f"Booking failed due to server error: {e}"}), 500
 
-@app.route('/api/appointments/patient', methods=['GET'])
+    invalidate_doctor_slots(doctor_id_str)
+    for _, cells, _ in candidates:
+        availability_index.add_booking(doctor_id_str, cells)
+    for doc in appointment_docs:
+        publish_appointment_event('created', doc)
+        record_stats(doctor_oid, doc['appointment_datetime'], booked=1, booked_minutes=length // timedelta(minutes=1))
+    current_app.logger.info(f"Batch booking: {len(candidates)} of {len(requested)} appointments booked for patient {patient_id_str} with Dr {doctor_id_str}")
+
+    conflicts.sort(key=lambda c: (c['date'], c['time']))
+    return jsonify({
+        "message": f"Booked {len(candidates)} of {len(requested)} appointments.",
+        "appointments": [appointment_data(doc) for doc in appointment_docs],
+        "conflicts": conflicts
+    }), 201
+
+
+@bp.route('/api/appointments/patient', methods=['GET'])
 def get_patient_appointments():
     # patient_user is a dictionary
     patient_user, error, status_code = get_user_from_token()
@@ -687,36 +1843,25 @@ def get_patient_appointments():
         patient_id_str = patient_user.get('_id')
         patient_oid = ObjectId(patient_id_str)
     except Exception:
-        app.logger.error(f"Invalid patient ID format in token: {patient_user.get('_id')}")
+        current_app.logger.error(f"Invalid patient ID format in token: {patient_user.get('_id')}")
         return jsonify({"error": "Internal server error: Invalid user context."}), 500
 
     try:
-        # --- MongoDB Query ---
-        # Find appointments for the patient, sorted by date descending
-        patient_appointments_cursor = db.appointments.find(
-            {'patient_id': patient_oid} # Filter by patient's ObjectId
-        ).sort('appointment_datetime', -1) # Sort descending (-1)
-
-        appointments_list = []
-        for appt in patient_appointments_cursor:
-            appointments_list.append({
-                "id": str(appt['_id']), # Convert appointment ObjectId
-                "doctorId": str(appt.get('doctor_id')), # Convert doctor ObjectId
-                "doctorName": appt.get('doctor_name'),
-                # Patient ID is implicitly known, but can include if needed
-                # "patientId": str(appt.get('patient_id')),
-                "date": appt.get('appointment_datetime').strftime('%Y-%m-%d') if appt.get('appointment_datetime') else None,
-                "time": appt.get('appointment_datetime').strftime('%H:%M') if appt.get('appointment_datetime') else None,
-                "reason": appt.get('reason'),
-                "status": appt.get('status')
-            })
+        query, limit = appointment_list_query({'patient_id': patient_oid}) # Filter by patient's ObjectId
+    except TokenExpiredError as e:
+        return jsonify({"error": f"{e}. Reload the list without it."}), 410
+    except ValueError as e:
+        return jsonify({"error": f"Invalid listing parameters: {e}"}), 400
 
-        return jsonify(appointments_list)
+    try:
+        # --- MongoDB Query ---
+        # One page (or a stream) of the patient's appointments, newest first
+        return appointment_list_response(query, PATIENT_LIST_PROJECTION, patient_appointment_row, limit)
     except Exception as e:
-        app.logger.error(f"Failed to fetch appointments for patient {patient_id_str}: {e}")
+        current_app.logger.error(f"Failed to fetch appointments for patient {patient_id_str}: {e}")
         return jsonify({"error": f"Failed to fetch appointments: {e}"}), 500
 
-@app.route('/api/appointments/doctor', methods=['GET'])
+@bp.route('/api/appointments/doctor', methods=['GET'])
 def get_doctor_appointments():
     # doctor_user is a dictionary
     doctor_user, error, status_code = get_user_from_token()
@@ -729,43 +1874,106 @@ def get_doctor_appointments():
     # Get the doctor's profile ID (string) from the token context
     doctor_id_str = doctor_user.get('doctor_id')
     if not doctor_id_str:
-        app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context when fetching appointments.")
+        current_app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context when fetching appointments.")
         return jsonify({"error": "Internal server error: Doctor context missing."}), 500
 
     try:
         doctor_oid = ObjectId(doctor_id_str)
     except Exception:
-        app.logger.error(f"Invalid doctor ID format in token: {doctor_id_str}")
+        current_app.logger.error(f"Invalid doctor ID format in token: {doctor_id_str}")
         return jsonify({"error": "Internal server error: Invalid doctor context."}), 500
 
     try:
-        # --- MongoDB Query ---
-        # Find appointments for the doctor, sorted by date descending
-        doctor_appointments_cursor = db.appointments.find(
-            {'doctor_id': doctor_oid} # Filter by doctor's ObjectId
-        ).sort('appointment_datetime', -1) # Sort descending
-
-        appointments_list = []
-        for appt in doctor_appointments_cursor:
-            appointments_list.append({
-                "id": str(appt['_id']), # Convert appointment ObjectId
-                "patientId": str(appt.get('patient_id')), # Convert patient ObjectId
-                "patientName": appt.get('patient_name'),
-                # Doctor ID is implicitly known, but can include if needed
-                # "doctorId": str(appt.get('doctor_id')),
-                "date": appt.get('appointment_datetime').strftime('%Y-%m-%d') if appt.get('appointment_datetime') else None,
-                "time": appt.get('appointment_datetime').strftime('%H:%M') if appt.get('appointment_datetime') else None,
-                "reason": appt.get('reason'),
-                "status": appt.get('status')
-            })
+        query, limit = appointment_list_query({'doctor_id': doctor_oid}) # Filter by doctor's ObjectId
+    except TokenExpiredError as e:
+        return jsonify({"error": f"{e}. Reload the list without it."}), 410
+    except ValueError as e:
+        return jsonify({"error": f"Invalid listing parameters: {e}"}), 400
 
-        return jsonify(appointments_list)
+    try:
+        # --- MongoDB Query ---
+        # One page (or a stream) of the doctor's appointments, newest first
+        return appointment_list_response(query, DOCTOR_LIST_PROJECTION, doctor_appointment_row, limit)
     except Exception as e:
-        app.logger.error(f"Failed to fetch appointments for doctor {doctor_id_str}: {e}")
+        current_app.logger.error(f"Failed to fetch appointments for doctor {doctor_id_str}: {e}")
         return jsonify({"error": f"Failed to fetch appointments: {e}"}), 500
 
+@bp.route('/api/appointments/events/ticket', methods=['POST'])
+def appointment_events_ticket():
+    """Issues a ticket that opens the caller's events stream for the next EVENTS_TICKET_SECONDS."""
+    user, error, status_code = get_user_from_token()
+    if error: return jsonify(error), status_code
+
+    lifetime = current_app.config['EVENTS_TICKET_SECONDS']
+    ticket_payload = {
+        'user_id': user['_id'],
+        'user_type': user.get('token_user_type'),
+        'aud': EVENTS_TICKET_AUDIENCE,
+        'exp': datetime.utcnow() + timedelta(seconds=lifetime)
+    }
+    if user.get('doctor_id'):
+        ticket_payload['doctor_id'] = user['doctor_id']
+    ticket = jwt.encode(ticket_payload, current_app.config['SECRET_KEY'], algorithm='HS256')
+    return jsonify({"ticket": ticket, "expiresIn": lifetime}), 200
+
+
+@bp.route('/api/appointments/events', methods=['GET'])
+def appointment_events():
+    """Server-sent events stream of changes to the caller's appointments (see events.py).
+
+    Each event is {type: created|rescheduled|cancelled|completed|expired,
+    appointment: {...list row fields}}; a 'resync' event means changes were
+    missed and the list should be fetched again. Authenticates with the
+    Authorization header or, since EventSource cannot set headers, a ticket
+    from POST /api/appointments/events/ticket as ?ticket=. A client opening a
+    new stream resumes with the Last-Event-ID header or ?lastEventId=.
+    """
+    user, error, status_code = get_user_from_token(ticket_audience=EVENTS_TICKET_AUDIENCE)
+    if error: return jsonify(error), status_code
+
+    if user.get('token_user_type') == 'doctor':
+        if not user.get('doctor_id'):
+            return jsonify({"error": "Internal server error: Doctor context missing."}), 500
+        topic = doctor_topic(user['doctor_id'])
+    elif user.get('token_user_type') == 'patient':
+        topic = patient_topic(user['_id'])
+    else:
+        return jsonify({"error": "Unauthorized: Only doctors and patients can follow appointments."}), 403
+
+    app = current_app._get_current_object()
+    config = app.config
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    subscription = event_broker.subscribe([topic], last_event_id)
+
+    def generate():
+        # Ends on its own after EVENTS_STREAM_MAX_SECONDS or when the worker drains; the browser reconnects
+        deadline = time.monotonic() + config['EVENTS_STREAM_MAX_SECONDS']
+        keepalive = config['EVENTS_KEEPALIVE_SECONDS']
+        idle_since = time.monotonic()
+        try:
+            yield f"retry: {config['EVENTS_RETRY_MS']}\n\n"
+            while not config.get('DRAINING') and time.monotonic() < deadline:
+                event = subscription.get(timeout=1.0)
+                if event is None:
+                    if time.monotonic() - idle_since >= keepalive:
+                        idle_since = time.monotonic()
+                        yield ": keepalive\n\n"
+                    continue
+                idle_since = time.monotonic()
+                if event['id'] is None:
+                    yield f"event: resync\ndata: {json.dumps({'type': 'resync'})}\n\n"
+                else:
+                    yield f"id: {event['id']}\nevent: appointment\ndata: {json.dumps(event)}\n\n"
+        finally:
+            event_broker.unsubscribe(subscription)
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Keep nginx from buffering the stream
+    return response
+
 # Use string for ObjectId
-@app.route('/api/appointments/<string:appointment_id_str>', methods=['DELETE'])
+@bp.route('/api/appointments/<string:appointment_id_str>', methods=['DELETE'])
 def cancel_appointment(appointment_id_str):
     # patient_user is a dictionary
     patient_user, error, status_code = get_user_from_token()
@@ -791,7 +1999,7 @@ def cancel_appointment(appointment_id_str):
         # --- Authorization Check ---
         # Ensure the patient_id in the appointment matches the logged-in user
         if appointment.get('patient_id') != patient_oid:
-            app.logger.warning(f"Forbidden attempt by patient {patient_oid} to cancel appointment {appointment_oid} belonging to {appointment.get('patient_id')}")
+            current_app.logger.warning(f"Forbidden attempt by patient {patient_oid} to cancel appointment {appointment_oid} belonging to {appointment.get('patient_id')}")
             return jsonify({"error": "Forbidden: You can only cancel your own appointments."}), 403
 
         # --- Status Check ---
@@ -799,28 +2007,35 @@ def cancel_appointment(appointment_id_str):
             return jsonify({"error": f"Cannot cancel appointment with status '{appointment.get('status')}'."}), 400
 
         # --- Update Status in MongoDB ---
+        # The status is part of the filter: a concurrent cancel (or expiry) since the read matches nothing
         update_result = db.appointments.update_one(
-            {'_id': appointment_oid},
-            {'$set': {'status': 'cancelled'}}
+            {'_id': appointment_oid, 'status': 'upcoming'},
+            {'$set': {'status': 'cancelled', 'updated_at': datetime.utcnow()}}
         )
 
         if update_result.modified_count == 1:
+            # Free the slot for other patients
+            release_claim(db, appointment_oid)
+            invalidate_doctor_slots(appointment.get('doctor_id'))
+            if appointment.get('appointment_datetime'):
+                availability_index.remove_booking(appointment.get('doctor_id'), appointment_cells(
+                    appointment['appointment_datetime'], appointment_end(appointment)))
+                record_stats(appointment.get('doctor_id'), appointment['appointment_datetime'], cancelled=1,
+                             booked_minutes=-appointment_minutes(appointment['appointment_datetime'],
+                                                                 appointment_end(appointment)))
+            publish_appointment_event('cancelled', {**appointment, 'status': 'cancelled'})
             return jsonify({"message": "Appointment cancelled successfully."}), 200
-        elif update_result.matched_count == 1 and update_result.modified_count == 0:
-             # This means it was already cancelled or status was different but matched _id
-             app.logger.warning(f"Attempted to cancel appointment {appointment_oid} which was not modified (possibly already cancelled).")
-             return jsonify({"message": "Appointment status was not 'upcoming' or already cancelled."}), 400 # Or return 200 if idempotent is ok
         else:
-             # Should not happen if find_one succeeded, but safety check
-             app.logger.error(f"Failed to find appointment {appointment_oid} during update for cancellation.")
-             return jsonify({"error": "Appointment not found during update."}), 404
+             # Cancelled, expired or archived by another request since it was read
+             current_app.logger.warning(f"Appointment {appointment_oid} changed before it could be cancelled.")
+             return jsonify({"error": "Appointment status was not 'upcoming' or already cancelled."}), 400
 
     except Exception as e:
-        app.logger.error(f"Failed to cancel appointment {appointment_id_str} for patient {patient_oid}: {e}")
+        current_app.logger.error(f"Failed to cancel appointment {appointment_id_str} for patient {patient_oid}: {e}")
         return jsonify({"error": f"Failed to cancel appointment: {e}"}), 500
 
 # Use string for ObjectId
-@app.route('/api/appointments/<string:appointment_id_str>', methods=['PUT'])
+@bp.route('/api/appointments/<string:appointment_id_str>', methods=['PUT'])
 def update_appointment(appointment_id_str):
     # patient_user is a dictionary
     patient_user, error, status_code = get_user_from_token()
@@ -852,7 +2067,7 @@ def update_appointment(appointment_id_str):
 
         # --- Authorization Check ---
         if appointment.get('patient_id') != patient_oid:
-            app.logger.warning(f"Forbidden attempt by patient {patient_oid} to update appointment {appointment_oid} belonging to {appointment.get('patient_id')}")
+            current_app.logger.warning(f"Forbidden attempt by patient {patient_oid} to update appointment {appointment_oid} belonging to {appointment.get('patient_id')}")
             return jsonify({"error": "Forbidden: You can only reschedule your own appointments."}), 403
 
         # --- Status Check ---
@@ -862,55 +2077,72 @@ def update_appointment(appointment_id_str):
         # --- Check New Slot Availability ---
         doctor_oid = appointment.get('doctor_id') # Get doctor ObjectId from the appointment
         if not doctor_oid:
-             app.logger.error(f"Appointment {appointment_oid} is missing doctor_id.")
+             current_app.logger.error(f"Appointment {appointment_oid} is missing doctor_id.")
              return jsonify({"error": "Internal server error: Appointment data inconsistent."}), 500
 
-        # Pass doctor's ObjectId *string* to availability check
-        if not check_backend_availability(str(doctor_oid), new_date_str, new_time_str):
-            # Fetch doctor name for a more informative error message
-            doctor = db.doctors.find_one({'_id': doctor_oid}, {'name': 1})
-            doctor_name = doctor.get('name', 'Doctor') if doctor else 'Doctor'
-            return jsonify({"error": f"Dr. {doctor_name} is not available at the selected new time or the slot is booked."}), 409
-
-        # --- Update Appointment Datetime ---
         try:
             new_appointment_datetime = datetime.strptime(f"{new_date_str} {new_time_str}", "%Y-%m-%d %H:%M")
+        except ValueError:
+            return jsonify({"error": "Invalid date or time format provided."}), 400
+
+        doctor = db.doctors.find_one({'_id': doctor_oid}, {'name': 1, 'availability': 1, 'availability_slots': 1})
+        doctor_name = doctor.get('name', 'Doctor') if doctor else 'Doctor'
+        unavailable_error = {"error": f"Dr. {doctor_name} is not available at the selected new time or the slot is booked."}
+        # The appointment keeps its length
+        old_cells = []
+        length = timedelta(minutes=current_app.config['APPOINTMENT_SLOT_MINUTES'])
+        if appointment.get('appointment_datetime'):
+            old_end = appointment_end(appointment)
+            old_cells = appointment_cells(appointment['appointment_datetime'], old_end)
+            length = old_end - appointment['appointment_datetime']
+        new_appointment_end = new_appointment_datetime + length
+        if not check_backend_availability(doctor, new_appointment_datetime, new_appointment_end):
+            return jsonify(unavailable_error), 409
+
+        # Move the claims first: fails, keeping the old ones, if any new cell is taken
+        new_cells = appointment_cells(new_appointment_datetime, new_appointment_end)
+        try:
+            move_claim(db, appointment_oid, doctor_oid, new_cells)
+        except SlotTakenError:
+            return jsonify(unavailable_error), 409
+        invalidate_doctor_slots(doctor_oid)
+        availability_index.move_booking(doctor_oid, old_cells, new_cells)
 
+        # --- Update Appointment Datetime ---
+        try:
             update_result = db.appointments.update_one(
-                {'_id': appointment_oid},
-                {'$set': {'appointment_datetime': new_appointment_datetime}}
+                {'_id': appointment_oid, 'status': 'upcoming'},
+                {'$set': {'appointment_datetime': new_appointment_datetime, 'appointment_end': new_appointment_end,
+                          'updated_at': datetime.utcnow()}}
             )
+        except Exception:
+            resync_claims(appointment_oid, doctor_oid, new_cells)
+            raise
 
-            if update_result.modified_count == 1:
-                # Construct response data (can re-fetch or use existing data + new datetime)
-                updated_appointment_data = {
-                    "id": str(appointment_oid),
-                    "doctorId": str(doctor_oid),
-                    "doctorName": appointment.get('doctor_name'),
-                    "patientId": str(patient_oid),
-                    "patientName": appointment.get('patient_name'),
-                    "date": new_appointment_datetime.strftime('%Y-%m-%d'),
-                    "time": new_appointment_datetime.strftime('%H:%M'),
-                    "reason": appointment.get('reason'),
-                    "status": appointment.get('status') # Status remains 'upcoming'
-                }
-                return jsonify({"message": "Appointment rescheduled successfully!", "appointment": updated_appointment_data}), 200
-            elif update_result.matched_count == 1 and update_result.modified_count == 0:
-                app.logger.warning(f"Appointment {appointment_oid} was not modified during reschedule (new time might be same as old).")
-                return jsonify({"message": "Appointment time was not changed."}), 200 # Or return updated data anyway
-            else:
-                app.logger.error(f"Failed to find appointment {appointment_oid} during update for reschedule.")
-                return jsonify({"error": "Appointment not found during update."}), 404
-
-        except ValueError:
-            return jsonify({"error": "Invalid date or time format provided."}), 400
+        if update_result.modified_count == 1:
+            rescheduled = {**appointment, 'appointment_datetime': new_appointment_datetime,
+                           'appointment_end': new_appointment_end}
+            # The appointment counts for the day it now takes place on
+            minutes = length // timedelta(minutes=1)
+            old_datetime = appointment.get('appointment_datetime')
+            if not old_datetime or old_datetime.date() != new_appointment_datetime.date():
+                if old_datetime:
+                    record_stats(doctor_oid, old_datetime, booked=-1, booked_minutes=-minutes)
+                record_stats(doctor_oid, new_appointment_datetime, booked=1, booked_minutes=minutes)
+            publish_appointment_event('rescheduled', rescheduled)
+            return jsonify({"message": "Appointment rescheduled successfully!", "appointment": appointment_data(rescheduled)}), 200
+        else:
+            # The claims already moved; give the appointment back the cells of what is stored
+            resync_claims(appointment_oid, doctor_oid, new_cells)
+            current_app.logger.warning(f"Appointment {appointment_oid} changed before it could be rescheduled.")
+            return jsonify({"error": "Appointment status was not 'upcoming' or it was cancelled meanwhile."}), 400
 
     except Exception as e:
-        app.logger.error(f"Failed to reschedule appointment {appointment_id_str} for patient {patient_oid}: {e}")
+        current_app.logger.error(f"Failed to reschedule appointment {appointment_id_str} for patient {patient_oid}: {e}")
         return jsonify({"error": f"Failed to reschedule: {e}"}), 500
 
 # Use string for ObjectId
-@app.route('/api/appointments/<string:appointment_id_str>/complete', methods=['PUT'])
+@bp.route('/api/appointments/<string:appointment_id_str>/complete', methods=['PUT'])
 def complete_appointment(appointment_id_str):
     # doctor_user is a dictionary
     doctor_user, error, status_code = get_user_from_token()
@@ -923,7 +2155,7 @@ def complete_appointment(appointment_id_str):
     # Get doctor's profile ID string from token context
     doctor_id_str = doctor_user.get('doctor_id')
     if not doctor_id_str:
-        app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during appointment completion.")
+        current_app.logger.error(f"Doctor user {doctor_user.get('_id')} missing doctor_id in token context during appointment completion.")
         return jsonify({"error": "Internal server error: Doctor context missing."}), 500
 
     try:
@@ -942,40 +2174,266 @@ def complete_appointment(appointment_id_str):
         # --- Authorization Check ---
         # Ensure the doctor_id in the appointment matches the logged-in doctor's profile ID
         if appointment.get('doctor_id') != doctor_oid:
-            app.logger.warning(f"Forbidden attempt by doctor {doctor_oid} to complete appointment {appointment_oid} belonging to doctor {appointment.get('doctor_id')}")
+            current_app.logger.warning(f"Forbidden attempt by doctor {doctor_oid} to complete appointment {appointment_oid} belonging to doctor {appointment.get('doctor_id')}")
             return jsonify({"error": "Forbidden: You can only complete your own appointments."}), 403
 
         # --- Status Check ---
-        if appointment.get('status') != 'upcoming':
+        # Expired appointments were never marked by the doctor; they can still be completed
+        if appointment.get('status') not in ('upcoming', 'expired'):
             return jsonify({"error": f"Cannot complete appointment with status '{appointment.get('status')}'."}), 400
 
         # --- Update Status in MongoDB ---
+        # Filtered on the status just read, so a concurrent change is detected and the
+        # expired counter below is only corrected for an appointment that really was expired
         update_result = db.appointments.update_one(
-            {'_id': appointment_oid},
-            {'$set': {'status': 'completed'}}
+            {'_id': appointment_oid, 'status': appointment.get('status')},
+            {'$set': {'status': 'completed', 'updated_at': datetime.utcnow()}}
         )
 
         if update_result.modified_count == 1:
+            publish_appointment_event('completed', {**appointment, 'status': 'completed'})
+            if appointment.get('appointment_datetime'):
+                record_stats(doctor_oid, appointment['appointment_datetime'], completed=1,
+                             expired=-1 if appointment.get('status') == 'expired' else 0)
             return jsonify({"message": "Appointment marked as complete."}), 200
-        elif update_result.matched_count == 1 and update_result.modified_count == 0:
-             app.logger.warning(f"Attempted to complete appointment {appointment_oid} which was not modified (possibly already completed).")
-             return jsonify({"message": "Appointment status was not 'upcoming' or already completed."}), 400 # Or return 200 if idempotent is ok
         else:
-             app.logger.error(f"Failed to find appointment {appointment_oid} during update for completion.")
-             return jsonify({"error": "Appointment not found during update."}), 404
+             # Completed, cancelled, expired or archived by another request since it was read
+             current_app.logger.warning(f"Appointment {appointment_oid} changed before it could be completed.")
+             return jsonify({"error": "Appointment status was not 'upcoming' or already completed."}), 400
 
     except Exception as e:
-        app.logger.error(f"Failed to complete appointment {appointment_id_str} for doctor {doctor_id_str}: {e}")
+        current_app.logger.error(f"Failed to complete appointment {appointment_id_str} for doctor {doctor_id_str}: {e}")
         return jsonify({"error": f"Failed to complete appointment: {e}"}), 500
 
 # --- Static File Serving (for uploaded images) ---
-@app.route('/uploads/profile_pics/<filename>')
+@bp.route('/uploads/profile_pics/<filename>')
 def uploaded_file(filename):
-    # Serve files from the configured UPLOAD_FOLDER
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Serve files from the configured UPLOAD_FOLDER with validators and long-lived caching.
+    # Range requests and If-None-Match / If-Modified-Since are answered by send_file.
+    config = current_app.config
+    path = safe_join(config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    immutable = is_content_name(filename)
+    # A content name is its own strong validator; legacy files fall back to mtime/size/path
+    etag = filename.split('.', 1)[0] if immutable else True
+    max_age = config['UPLOAD_IMMUTABLE_MAX_AGE'] if immutable else config['UPLOAD_LEGACY_MAX_AGE']
+    mode = config['UPLOAD_SENDFILE_MODE']
+
+    # In either offload mode the file is never opened here; the body is left to the web server
+    response = send_file(path, request.environ, etag=etag, max_age=max_age,
+                         use_x_sendfile=mode in ('x-sendfile', 'x-accel-redirect'),
+                         response_class=current_app.response_class)
+    if mode and response.status_code in (200, 206):
+        # The web server answers any Range itself from the full file
+        response.status_code = 200
+        response.headers.pop('Content-Range', None)
+        response.headers.pop('Content-Length', None)
+    if mode == 'x-accel-redirect':
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = config['UPLOAD_ACCEL_PREFIX'] + filename
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable
+    return response
+
+
+# --- Database Bootstrap ---
+def bootstrap_database(verify=True):
+    """Creates indexes, backfills slot claims and optionally checks query plans."""
+    ensure_indexes(db, logger=current_app.logger)
+    backfill_claims(db, current_app.config['APPOINTMENT_CLAIM_MINUTES'], current_app.config['APPOINTMENT_SLOT_MINUTES'],
+                    logger=current_app.logger)
+    if verify:
+        # Raises QueryPlanError listing every query shape that is not index-backed
+        verify_query_plans(db, logger=current_app.logger)
+
+
+@click.command('init-db')
+@click.option('--skip-verify', is_flag=True, help='Create indexes without checking query plans.')
+@with_appcontext
+def init_db_command(skip_verify):
+    """Creates MongoDB indexes and verifies handler query plans."""
+    bootstrap_database(verify=not skip_verify)
+    click.echo('Indexes are in place.' if skip_verify else 'Indexes are in place and every query plan is index-backed.')
+
+
+def sweep_appointments():
+    """Expires stale upcoming appointments and archives old finished ones. Returns (expired, archived)."""
+    config = current_app.config
+    now = datetime.now() # Appointment times are stored as local wall-clock times
+    expired = expire_stale(db, now - timedelta(hours=config['APPOINTMENT_EXPIRE_AFTER_HOURS']),
+                           config['SWEEPER_BATCH_SIZE'], on_expired=on_appointments_expired)
+    archived = archive_finished(db, now - timedelta(days=config['APPOINTMENT_ARCHIVE_AFTER_DAYS']),
+                                config['SWEEPER_BATCH_SIZE'])
+    if expired or archived:
+        current_app.logger.info(f"Appointment sweep: {expired} expired, {archived} archived")
+    return expired, archived
+
+
+def on_appointments_expired(appointments):
+    for appt in appointments:
+        publish_appointment_event('expired', appt)
+        record_stats(appt.get('doctor_id'), appt['appointment_datetime'], expired=1)
+
+
+def scheduled_sweep(app):
+    """Sweeper callback: sweeps if this process holds (or can take) the sweeper lease."""
+    with app.app_context():
+        # The lease outlives one interval so a slow sweep is not started twice
+        if acquire_lease(db, 'appointment-sweeper', lease_owner(), app.config['SWEEPER_INTERVAL'] * 2):
+            sweep_appointments()
+
+
+@click.command('sweep-appointments')
+@with_appcontext
+def sweep_appointments_command():
+    """Expires stale upcoming appointments and archives old finished ones now."""
+    expired, archived = sweep_appointments()
+    click.echo(f'Expired {expired} appointments, archived {archived}.')
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """Recomputes the per-doctor daily counters from all appointments, archived ones included."""
+    written = rebuild_doctor_stats(db, ['appointments', ARCHIVE_COLLECTION],
+                                   current_app.config['APPOINTMENT_SLOT_MINUTES'], logger=current_app.logger)
+    click.echo(f'Rebuilt statistics for {written} doctor-days.')
+
+
+@click.command('migrate-uploads')
+@with_appcontext
+def migrate_uploads_command():
+    """Moves legacy uuid-named profile pictures to content-addressed storage."""
+    migrated = migrate_legacy_uploads(db, current_app.config['UPLOAD_FOLDER'], logger=current_app.logger)
+    invalidate_doctor_directory()
+    click.echo(f'Migrated {migrated} profile pictures.')
+
+
+# --- Health Checks ---
+@bp.route('/healthz', methods=['GET'])
+def health_check():
+    # Liveness: the worker process is up and serving requests
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+
+@bp.route('/readyz', methods=['GET'])
+def readiness_check():
+    # Readiness: the database answers and the worker is not shutting down
+    if current_app.config.get('DRAINING'):
+        return jsonify({"status": "draining"}), 503
+    try:
+        db.command('ping')
+    except Exception as e:
+        current_app.logger.error(f"Readiness check failed: {e}")
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    return jsonify({"status": "ready"}), 200
+
+
+# --- App Factory ---
+def configure_services(config):
+    """Applies the app config to the module-level caches and worker pools."""
+    principal_cache.maxsize = config['PRINCIPAL_CACHE_SIZE']
+    principal_cache.ttl = config['PRINCIPAL_CACHE_TTL']
+    slot_cache.maxsize = config['SLOT_CACHE_SIZE']
+    slot_cache.ttl = config['SLOT_CACHE_TTL']
+    directory_cache.ttl = config['DOCTOR_DIRECTORY_CACHE_TTL']
+    directory_page_cache.ttl = config['DOCTOR_DIRECTORY_CACHE_TTL']
+    availability_index.slot_minutes = config['APPOINTMENT_SLOT_MINUTES']
+    password_hasher.configure(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_WORKERS'],
+                              config['PASSWORD_HASH_QUEUE_LIMIT'], config['PASSWORD_HASH_TIMEOUT'])
+    event_broker.configure(config['EVENTS_HISTORY_SIZE'], config['EVENTS_QUEUE_SIZE'])
+    configure_page_tokens(config['SECRET_KEY'], config['APPOINTMENT_CURSOR_MAX_AGE_SECONDS'],
+                          config['APPOINTMENT_SYNC_TOKEN_MAX_AGE_SECONDS'])
+    admission_control.limit = config['MAX_IN_FLIGHT_REQUESTS']
+    if config['RATE_LIMIT_ENABLED']:
+        if config['RATE_LIMIT_STORAGE'] == 'shared' and fcntl is not None:
+            rate_limiter.use(SharedBuckets(config['RATE_LIMIT_SHARED_PATH'], config['RATE_LIMIT_SHARED_SLOTS']))
+        elif config['RATE_LIMIT_STORAGE'] in ('shared', 'memory'):
+            rate_limiter.use(MemoryBuckets())
+        else:
+            raise ValueError(f"Unknown RATE_LIMIT_STORAGE '{config['RATE_LIMIT_STORAGE']}' (expected 'shared' or 'memory')")
+
+
+def create_app(config=None):
+    """Builds the Flask app. Settings come from DEFAULT_CONFIG, then APPOINTIX_* env vars, then `config`."""
+    app = Flask(__name__)
+    app.json = AppointixJSONProvider(app)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.from_prefixed_env('APPOINTIX')
+    if config:
+        app.config.update(config)
+
+    # Ensure upload folder exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Storage settings; the client / connections are opened on first use in each process
+    listeners = [metrics.command_listener] if app.config['METRICS_ENABLED'] else []
+    if app.config['STORAGE_BACKEND'] == 'sqlite':
+        sqlite_storage.configure(app.config['SQLITE_PATH'], event_listeners=listeners,
+                                 pool_size=app.config['SQLITE_POOL_SIZE'])
+        db.bind(sqlite_storage)
+        app.teardown_appcontext(release_storage_connection)
+    elif app.config['STORAGE_BACKEND'] == 'mongo':
+        client_options = {'maxPoolSize': app.config['MONGO_MAX_POOL_SIZE']}
+        if listeners:
+            client_options['event_listeners'] = listeners
+        mongo.configure(app.config['MONGO_URI'], app.config['MONGO_DBNAME'], **client_options)
+        db.bind(mongo)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND '{app.config['STORAGE_BACKEND']}' (expected 'mongo' or 'sqlite')")
+    if app.config['EVENTS_SOURCE'] not in ('local', 'change-stream'):
+        raise ValueError(f"Unknown EVENTS_SOURCE '{app.config['EVENTS_SOURCE']}' (expected 'local' or 'change-stream')")
+    if app.config['EVENTS_SOURCE'] == 'change-stream' and app.config['STORAGE_BACKEND'] != 'mongo':
+        raise ValueError("EVENTS_SOURCE 'change-stream' requires STORAGE_BACKEND 'mongo'")
+    configure_services(app.config)
+    # Parsed once; a malformed budget fails here rather than on the first request
+    app.extensions['appointix_rate_budgets'] = {
+        'ip': {route: parse_rate(rate) for route, rate in app.config['RATE_LIMITS_PER_IP'].items()},
+        'user': {route: parse_rate(rate) for route, rate in app.config['RATE_LIMITS_PER_USER'].items()},
+    }
+    if app.config['TRUSTED_PROXY_COUNT']:
+        # request.remote_addr becomes the client address the proxies saw
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
+    # Allow API requests
+    CORS(app, resources={
+        r"/api/*": {"origins": app.config['CORS_ORIGIN'],
+                    "expose_headers": ["X-Next-Cursor", "X-Total-Count", "X-Sync-Token", "X-Sync-More"]},
+        r"/uploads/*": {"origins": app.config['CORS_ORIGIN']}
+    })
+
+    app.register_blueprint(bp)
+    if app.config['METRICS_ENABLED']:
+        app.before_request(begin_request_metrics)
+        app.after_request(end_request_metrics)
+    # After the metrics hook, so refused requests are still counted
+    app.before_request(admit_request)
+    app.teardown_request(release_admission)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_uploads_command)
+    app.cli.add_command(sweep_appointments_command)
+    app.cli.add_command(rebuild_stats_command)
+    if app.config['SWEEPER_ENABLED']:
+        # Started by the first request of each worker process
+        sweeper = Sweeper(partial(scheduled_sweep, app), app.config['SWEEPER_INTERVAL'], logger=app.logger)
+        app.extensions['appointix_sweeper'] = sweeper
+        app.before_request(sweeper.ensure_started)
+    if app.config['EVENTS_SOURCE'] == 'change-stream':
+        # Like the sweeper, each worker opens its change stream on its first request
+        relay = ChangeStreamRelay(event_broker, lambda: db.appointments, logger=app.logger)
+        app.extensions['appointix_event_relay'] = relay
+        app.before_request(relay.ensure_started)
+    return app
 
 
 # --- Run the App ---
 if __name__ == '__main__':
+    # Development server. For production run gunicorn with gunicorn.conf.py instead.
+    app = create_app()
+    with app.app_context():
+        # The unique claim index is what prevents double bookings, so create indexes before serving
+        bootstrap_database(verify=app.config['VERIFY_QUERY_PLANS'])
     # Use port 5001 to avoid conflict with React's default 3000
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001)
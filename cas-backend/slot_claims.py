@@ -0,0 +1,181 @@
+"""Slot reservations backed by a unique index on (doctor_id, slot_start).
+
+Time is divided into fixed cells (APPOINTMENT_CLAIM_MINUTES) and an upcoming
+appointment owns one claim document for every cell its [start, end) interval
+touches. Because the index is unique, no two overlapping appointments can
+both hold their cells, and claiming an interval is all or nothing: cells
+taken before a collision are released again.
+
+Cells are inserted one after another in ascending order, stopping at the
+first one already taken (an ordered insert_many), so concurrent claims
+acquire cells the way locks are taken in a fixed order. Two bookings of the
+same interval always have a winner: whoever gets the first cell gets them all.
+Inserted unordered, each could take a cell the other needs and both fail.
+Checking an interval for overlaps is one range lookup on the same compound
+index.
+"""
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+CLAIMS_COLLECTION = 'slot_claims'
+
+
+class SlotTakenError(Exception):
+    """Raised when another appointment already holds part of the requested interval."""
+
+
+def slot_start_for(appt_datetime, slot_minutes):
+    """Floors a datetime onto the slot grid (slots start at midnight)."""
+    minutes = appt_datetime.hour * 60 + appt_datetime.minute
+    minutes -= minutes % slot_minutes
+    return appt_datetime.replace(hour=minutes // 60, minute=minutes % 60, second=0, microsecond=0)
+
+
+def claim_cells(start, end, cell_minutes):
+    """Returns the start of every claim cell that the interval [start, end) touches."""
+    cell = slot_start_for(start, cell_minutes)
+    step = timedelta(minutes=cell_minutes)
+    cells = []
+    while cell < end:
+        cells.append(cell)
+        cell += step
+    return cells
+
+
+def ensure_claim_indexes(db):
+    """Creates the claim indexes. Safe to call repeatedly."""
+    claims = db[CLAIMS_COLLECTION]
+    if 'appointment_unique' in claims.index_information():
+        # One claim per appointment no longer holds now that appointments span several cells
+        claims.drop_index('appointment_unique')
+    claims.create_index([('doctor_id', ASCENDING), ('slot_start', ASCENDING)],
+                        unique=True, name='doctor_slot_unique')
+    claims.create_index([('appointment_id', ASCENDING), ('slot_start', ASCENDING)], name='appointment_cells')
+
+
+def _lost_appointments(error):
+    errors = error.details.get('writeErrors', [])
+    if any(err.get('code') != 11000 for err in errors):
+        raise error
+    return set(err['op']['appointment_id'] for err in errors)
+
+
+def claim_slot(db, doctor_oid, cells, appointment_oid):
+    """Reserves every cell of an appointment id that is about to be inserted; all or nothing."""
+    now = datetime.utcnow()
+    try:
+        db[CLAIMS_COLLECTION].insert_many([
+            {'doctor_id': doctor_oid, 'slot_start': cell, 'appointment_id': appointment_oid, 'claimed_at': now}
+            for cell in sorted(cells)
+        ], ordered=True)
+    except BulkWriteError as e:
+        _lost_appointments(e)
+        release_claim(db, appointment_oid)
+        raise SlotTakenError(f"Interval starting {cells[0]} overlaps a claimed slot for doctor {doctor_oid}")
+
+
+def claim_slots(db, claims):
+    """Reserves the cells of several appointments with one unordered insert_many.
+
+    `claims` is a list of (doctor_oid, cells, appointment_oid). Every
+    appointment whose cells are all free is claimed even when others collide;
+    the cells an appointment did get are released again if any of its other
+    cells was taken. Returns the set of appointment ids that lost. Each
+    appointment's cells are still sent in ascending order.
+    """
+    if not claims:
+        return set()
+    now = datetime.utcnow()
+    try:
+        db[CLAIMS_COLLECTION].insert_many([
+            {'doctor_id': doctor_oid, 'slot_start': cell, 'appointment_id': appointment_oid, 'claimed_at': now}
+            for doctor_oid, cells, appointment_oid in claims for cell in sorted(cells)
+        ], ordered=False)
+    except BulkWriteError as e:
+        lost = _lost_appointments(e)
+        release_claims(db, lost)
+        return lost
+    return set()
+
+
+def move_claim(db, appointment_oid, doctor_oid, cells):
+    """Moves an appointment's claims onto a new set of cells.
+
+    Cells the appointment already holds are kept, so moving by less than its
+    own length does not collide with itself. New cells are claimed (in
+    ascending order, like claim_slot) before old ones are released; if any is
+    taken the appointment keeps its old cells.
+    Appointments booked before claims existed pick theirs up here.
+    """
+    claims = db[CLAIMS_COLLECTION]
+    held = set(claim['slot_start'] for claim in claims.find({'appointment_id': appointment_oid}, {'slot_start': 1}))
+    wanted = set(cells)
+    added = sorted(wanted - held)
+    if added:
+        now = datetime.utcnow()
+        try:
+            claims.insert_many([
+                {'doctor_id': doctor_oid, 'slot_start': cell, 'appointment_id': appointment_oid, 'claimed_at': now}
+                for cell in added
+            ], ordered=True)
+        except BulkWriteError as e:
+            _lost_appointments(e)
+            claims.delete_many({'appointment_id': appointment_oid, 'slot_start': {'$in': added}})
+            raise SlotTakenError(f"Interval starting {cells[0]} overlaps a claimed slot for doctor {doctor_oid}")
+    stale = list(held - wanted)
+    if stale:
+        claims.delete_many({'appointment_id': appointment_oid, 'slot_start': {'$in': stale}})
+
+
+def release_claim(db, appointment_oid):
+    """Frees the cells held by an appointment (e.g. after cancellation)."""
+    return db[CLAIMS_COLLECTION].delete_many({'appointment_id': appointment_oid}).deleted_count
+
+
+def release_claims(db, appointment_oids):
+    """Frees the cells held by several appointments."""
+    if not appointment_oids:
+        return 0
+    return db[CLAIMS_COLLECTION].delete_many({'appointment_id': {'$in': list(appointment_oids)}}).deleted_count
+
+
+def backfill_claims(db, cell_minutes, default_minutes, logger=None):
+    """Makes the claims of every upcoming appointment match the cells of its interval.
+
+    Appointments booked without claims, or before claims covered whole
+    intervals (one claim on a coarser grid), get their missing cells and lose
+    stale ones. Appointments without appointment_end last default_minutes.
+    Returns the number of claims inserted. Cells that collide with another
+    appointment (historic double bookings) are logged and left unclaimed.
+    """
+    claims = db[CLAIMS_COLLECTION]
+    held = {}
+    for claim in claims.find({}, {'appointment_id': 1, 'slot_start': 1}):
+        held.setdefault(claim['appointment_id'], set()).add(claim['slot_start'])
+    missing = []
+    now = datetime.utcnow()
+    for appt in db.appointments.find({'status': 'upcoming'},
+                                     {'doctor_id': 1, 'appointment_datetime': 1, 'appointment_end': 1}):
+        start = appt.get('appointment_datetime')
+        if not start:
+            continue
+        cells = claim_cells(start, appt.get('appointment_end') or start + timedelta(minutes=default_minutes),
+                            cell_minutes)
+        have = held.get(appt['_id'], set())
+        stale = list(have - set(cells))
+        if stale:
+            claims.delete_many({'appointment_id': appt['_id'], 'slot_start': {'$in': stale}})
+        missing.extend({'doctor_id': appt['doctor_id'], 'slot_start': cell, 'appointment_id': appt['_id'],
+                        'claimed_at': now} for cell in cells if cell not in have)
+    if not missing:
+        return 0
+    try:
+        return len(claims.insert_many(missing, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if logger:
+            for err in e.details.get('writeErrors', []):
+                logger.warning(f"Could not backfill slot claim for appointment {err['op']['appointment_id']}: "
+                               f"cell {err['op']['slot_start']} already claimed")
+        return e.details.get('nInserted', 0)
@@ -0,0 +1,759 @@
+"""Embedded SQLite storage with the subset of the pymongo API the backend uses.
+
+Single-clinic deployments can run without a MongoDB server: with
+STORAGE_BACKEND='sqlite', `db` resolves to an SQLiteDatabase whose
+collections accept the same calls the handlers already make and raise the
+same pymongo exceptions.
+
+It is not a general MongoDB emulator. It implements exactly the calls and
+operators listed in COLLECTION_METHODS, CURSOR_METHODS, QUERY_OPERATORS and
+UPDATE_OPERATORS below, and anything else raises NotImplementedError.
+tests/test_sqlite_whitelist.py fails as soon as backend code uses a call or
+operator outside these lists, and tests/test_storage_conformance.py runs
+every route and command on both backends. A handler that needs more must
+extend both lists and tests, not just this module.
+
+Each collection is a table of (_id, doc) rows, the document stored as JSON.
+ObjectId and datetime values are stored as tagged strings whose text order
+matches their natural order, so filters and sorts compile to plain SQL over
+json_extract() and indexes are SQLite expression indexes. The database runs
+in WAL mode: readers never block the single writer, and every
+read-modify-write runs inside BEGIN IMMEDIATE.
+"""
+import copy
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# The pymongo surface this store implements (see the module docstring)
+COLLECTION_METHODS = frozenset({
+    'find', 'find_one', 'count_documents', 'insert_one', 'insert_many', 'update_one', 'update_many',
+    'find_one_and_update', 'find_one_and_delete', 'delete_one', 'delete_many', 'create_index', 'drop_index', 'index_information',
+})
+CURSOR_METHODS = frozenset({'sort', 'limit', 'skip', 'batch_size', 'close', 'explain'})
+DATABASE_COMMANDS = frozenset({'ping'})
+# Field conditions, the $and/$or combinators, and $options (only next to $regex)
+QUERY_OPERATORS = frozenset({'$and', '$or', '$ne', '$gt', '$gte', '$lt', '$lte', '$in', '$regex', '$options'})
+UPDATE_OPERATORS = frozenset({'$set', '$setOnInsert', '$inc'})
+
+OID_TAG = '\x01o'
+DATE_TAG = '\x01d'
+INDEX_TABLE = '_indexes'
+
+
+# --- Value encoding ---
+
+def encode_value(value):
+    """Converts a document value to its JSON-storable form (see module docstring)."""
+    if isinstance(value, ObjectId):
+        return OID_TAG + str(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        # BSON dates have millisecond precision; keep the same so round trips match MongoDB
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return DATE_TAG + value.isoformat(timespec='microseconds')
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, str) and value[:1] == '\x01':
+        if value.startswith(OID_TAG):
+            return ObjectId(value[len(OID_TAG):])
+        if value.startswith(DATE_TAG):
+            return datetime.fromisoformat(value[len(DATE_TAG):])
+        return value
+    if isinstance(value, dict):
+        return {key: decode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
+
+
+def dumps(document):
+    return json.dumps(encode_value(document), separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(text):
+    return decode_value(json.loads(text))
+
+
+# --- Document paths ---
+
+def _get_path(document, path, default=None):
+    for part in path.split('.'):
+        if not isinstance(document, dict) or part not in document:
+            return default
+        document = document[part]
+    return document
+
+
+def _set_path(document, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _project(document, projection):
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    fields = {field: flag for field, flag in projection.items() if field != '_id'}
+    if any(fields.values()):
+        projected = {}
+        if projection.get('_id', 1) and '_id' in document:
+            projected['_id'] = document['_id']
+        for field in fields:
+            value = _get_path(document, field, _MISSING)
+            if value is not _MISSING:
+                _set_path(projected, field, value)
+        return projected
+    for field in fields:
+        _unset_path(document, field)
+    if not projection.get('_id', 1):
+        document.pop('_id', None)
+    return document
+
+
+_MISSING = object()
+
+
+# --- Filter compilation ---
+
+class _Params:
+    """Collects bound parameters, or inlines them as SQL literals (for partial index WHERE clauses)."""
+
+    def __init__(self, inline=False):
+        self.inline = inline
+        self.values = []
+
+    def add(self, value):
+        value = encode_value(value)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+            return f'json({self._bind(value)})'
+        return self._bind(value)
+
+    def _bind(self, value):
+        if not self.inline:
+            self.values.append(value)
+            return '?'
+        if value is None:
+            return 'NULL'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, (int, float)):
+            return repr(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+
+def _json_path(field):
+    return '$.' + '.'.join('"' + part.replace('"', '""') + '"' for part in field.split('.'))
+
+
+def field_sql(field):
+    """SQL expression for a document field; identical text is used by indexes and queries."""
+    if field == '_id':
+        return '_id'
+    return "json_extract(doc, '" + _json_path(field).replace("'", "''") + "')"
+
+
+def _regex_pattern(pattern, options=''):
+    options = ''.join(sorted(set(options or '') & set('imsx')))
+    return f'(?{options}){pattern}' if options else pattern
+
+
+def _compile_field(field, condition, params):
+    expr = field_sql(field)
+    if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+        if condition is None:
+            return f'{expr} IS NULL'
+        return f'{expr} = {params.add(condition)}'
+
+    clauses = []
+    for op, value in condition.items():
+        if op not in QUERY_OPERATORS or op in ('$and', '$or'):
+            raise NotImplementedError(f"SQLite storage does not support the {op} query operator")
+        if op == '$ne':
+            if value is None:
+                clauses.append(f'{expr} IS NOT NULL')
+            else:
+                clauses.append(f'({expr} IS NULL OR {expr} != {params.add(value)})')
+        elif op in ('$gt', '$gte', '$lt', '$lte'):
+            sql_op = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}[op]
+            clauses.append(f'{expr} {sql_op} {params.add(value)}')
+        elif op == '$in':
+            values = list(value)
+            present = [v for v in values if v is not None]
+            parts = []
+            if present:
+                parts.append(f"{expr} IN ({', '.join(params.add(v) for v in present)})")
+            if len(present) != len(values):
+                parts.append(f'{expr} IS NULL')
+            clauses.append('(' + ' OR '.join(parts) + ')' if parts else '0')
+        elif op == '$regex':
+            pattern = _regex_pattern(value, condition.get('$options', ''))
+            clauses.append(f'regexp({params.add(pattern)}, {expr})')
+        elif op == '$options':
+            continue
+    return ' AND '.join(clauses) or '1'
+
+
+def compile_filter(query, params):
+    """Translates a MongoDB filter document to an SQL boolean expression."""
+    clauses = []
+    for key, condition in (query or {}).items():
+        if key in ('$and', '$or'):
+            parts = [compile_filter(part, params) for part in condition]
+            joined = '(' + (' AND ' if key == '$and' else ' OR ').join(f'({part})' for part in parts) + ')'
+            if not parts:
+                joined = '1' if key == '$and' else '0'
+            clauses.append(joined)
+        elif key.startswith('$'):
+            raise NotImplementedError(f"SQLite storage does not support the {key} query operator")
+        else:
+            clauses.append(_compile_field(key, condition, params))
+    return ' AND '.join(clauses) or '1'
+
+
+def _normalize_sort(key_or_list, direction=None):
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def _order_by(sort):
+    if not sort:
+        return ''
+    return ' ORDER BY ' + ', '.join(f"{field_sql(key)} {'DESC' if direction == -1 else 'ASC'}"
+                                    for key, direction in sort)
+
+
+def _equality_fields(query, document):
+    """Copies the equality conditions of a filter into a new document (for upserts)."""
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            for part in condition:
+                _equality_fields(part, document)
+        elif key.startswith('$'):
+            continue
+        elif not (isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition)):
+            _set_path(document, key, copy.deepcopy(condition))
+
+
+def apply_update(document, update, inserting=False):
+    """Applies update operators to a document in place."""
+    if not update or not all(key.startswith('$') for key in update):
+        raise ValueError("update only works with $ operators")
+    for op, fields in update.items():
+        if op not in UPDATE_OPERATORS:
+            raise NotImplementedError(f"SQLite storage does not support the {op} update operator")
+        for path, value in fields.items():
+            if op == '$set' or (op == '$setOnInsert' and inserting):
+                _set_path(document, path, copy.deepcopy(value))
+            elif op == '$inc':
+                _set_path(document, path, _get_path(document, path, 0) + value)
+
+
+def _regexp(pattern, value):
+    if not isinstance(value, str):
+        return False
+    return _compiled(pattern).search(value) is not None
+
+
+_pattern_cache = {}
+
+
+def _compiled(pattern):
+    compiled = _pattern_cache.get(pattern)
+    if compiled is None:
+        if len(_pattern_cache) > 256:
+            _pattern_cache.clear()
+        compiled = _pattern_cache[pattern] = re.compile(pattern)
+    return compiled
+
+
+# --- Connections ---
+
+class _CommandEvent:
+    """Minimal stand-in for pymongo's CommandSucceeded/FailedEvent, passed to command listeners."""
+    __slots__ = ('command_name', 'duration_micros')
+
+    def __init__(self, command_name, duration_micros):
+        self.command_name = command_name
+        self.duration_micros = duration_micros
+
+
+class _Lease:
+    """A thread's hold on a pooled connection; returns it to the pool when the thread's locals go away."""
+    __slots__ = ('conn', 'pool', 'pid')
+
+    def __init__(self, conn, pool, pid):
+        self.conn, self.pool, self.pid = conn, pool, pid
+
+    def __del__(self):
+        if self.conn is not None:
+            self.pool._check_in(self.conn, self.pid)
+
+
+class SQLiteConnection:
+    """Pooled SQLite connections to one database file, reopened after fork.
+
+    Mirrors MongoConnection: configure() stores the settings and `database`
+    returns the database object for the current process. A thread leases a
+    connection on first use and keeps it until release() (the app calls it
+    at the end of every request) or until the thread exits. At most
+    pool_size idle connections are kept for the next threads; the rest are
+    closed, so a server that starts a thread per request does not pile up
+    connections and their page caches.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.event_listeners = []
+        self.pool_size = 8
+        self._local = threading.local()
+        self._open = set()  # Every connection of this process not closed yet (leased or idle)
+        self._idle = []
+        self._pid = None
+        self._lock = threading.RLock()  # Re-entrant: dropping a lease under the lock checks it in
+        self._database = None
+
+    def configure(self, path, event_listeners=None, busy_timeout=5.0, pool_size=8):
+        self.close()
+        with self._lock:
+            self.path = path
+            self.busy_timeout = busy_timeout
+            self.pool_size = pool_size
+            self.event_listeners = list(event_listeners or [])
+            self._database = SQLiteDatabase(self)
+
+    def connection(self):
+        """Returns this thread's connection, leasing one on first use."""
+        pid = os.getpid()
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None and lease.pid == pid and self._pid == pid:
+            return lease.conn
+        if self.path is None:
+            raise RuntimeError("SQLite storage used before configure() was called")
+        with self._lock:
+            if self._pid != pid:
+                # Connections inherited through fork must not be used; forget them
+                self._open, self._idle = set(), []
+                self._pid = pid
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._open_connection()
+            with self._lock:
+                self._open.add(conn)
+        self._local.lease = _Lease(conn, self, pid)
+        return conn
+
+    def _open_connection(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # Durable at checkpoints; safe with WAL
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-16000')  # ~16 MB page cache per connection
+        conn.create_function('regexp', 2, _regexp, deterministic=True)
+        return conn
+
+    def release(self):
+        """Gives this thread's connection back to the pool; the next use leases one again."""
+        lease = getattr(self._local, 'lease', None)
+        if lease is not None:
+            self._local.lease = None
+            conn, lease.conn = lease.conn, None
+            self._check_in(conn, lease.pid)
+
+    def _check_in(self, conn, pid):
+        with self._lock:
+            if self._pid != pid or conn not in self._open:
+                return  # Closed by close() or left behind by a fork
+            if len(self._idle) < self.pool_size and not conn.in_transaction:
+                self._idle.append(conn)
+                return
+            self._open.discard(conn)
+        try: conn.close()
+        except sqlite3.Error: pass
+
+    @property
+    def open_connections(self):
+        """Connections of this process currently open, leased or idle."""
+        return len(self._open) if self._pid == os.getpid() else 0
+
+    @property
+    def database(self):
+        if self._database is None:
+            raise RuntimeError("SQLite storage used before configure() was called")
+        return self._database
+
+    def notify(self, command_name, started, failed=False):
+        if not self.event_listeners:
+            return
+        event = _CommandEvent(command_name, int((time.perf_counter() - started) * 1e6))
+        for listener in self.event_listeners:
+            (listener.failed if failed else listener.succeeded)(event)
+
+    def close(self):
+        """Closes every connection this process opened (e.g. in a parent before forking)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                for conn in self._open:
+                    try: conn.close()
+                    except sqlite3.Error: pass
+            self._open, self._idle = set(), []
+            self._pid = None
+            self._local = threading.local()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT on the thread's connection: one writer at a time."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class SQLiteDatabase:
+    """Stands in for a pymongo Database."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.setdefault(name, SQLiteCollection(self._connection, name))
+        return collection
+
+    def command(self, name, *args, **kwargs):
+        if name not in DATABASE_COMMANDS:
+            raise NotImplementedError(f"SQLite storage does not support the {name} command")
+        self._connection.connection().execute('SELECT 1')
+        return {'ok': 1.0}
+
+
+class SQLiteCollection:
+    """Stands in for a pymongo Collection backed by one table."""
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self.name = name
+        self._table = '"' + name.replace('"', '""') + '"'
+        self._ready_pid = None
+
+    def _conn(self):
+        conn = self._connection.connection()
+        if self._ready_pid != os.getpid():
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self._table} (_id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {INDEX_TABLE} '
+                         '(collection TEXT, name TEXT, spec TEXT, PRIMARY KEY (collection, name))')
+            self._ready_pid = os.getpid()
+        return conn
+
+    def _duplicate(self, error, document=None):
+        return DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} ({error})", 11000,
+                                 {'code': 11000, 'errmsg': str(error), 'op': document})
+
+    def _select(self, query, sort=None, limit=0, skip=0, columns='rowid, _id, doc'):
+        params = _Params()
+        if isinstance(query, ObjectId):
+            query = {'_id': query}
+        sql = f'SELECT {columns} FROM {self._table} WHERE {compile_filter(query, params)}{_order_by(sort)}'
+        if limit or skip:
+            sql += f' LIMIT {int(abs(limit)) if limit else -1} OFFSET {int(skip)}'
+        return sql, params.values
+
+    # --- Reads ---
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, skip=0, batch_size=0, **kwargs):
+        return SQLiteCursor(self, filter, projection, _normalize_sort(sort), limit, skip)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def count_documents(self, filter, limit=0, skip=0, **kwargs):
+        started = time.perf_counter()
+        sql, params = self._select(filter, limit=limit, skip=skip, columns='1')
+        count = self._conn().execute(f'SELECT COUNT(*) FROM ({sql})', params).fetchone()[0]
+        self._connection.notify('count', started)
+        return count
+
+    # --- Writes ---
+
+    def insert_one(self, document, **kwargs):
+        started = time.perf_counter()
+        document.setdefault('_id', ObjectId())
+        try:
+            self._conn().execute(f'INSERT INTO {self._table} (_id, doc) VALUES (?, ?)',
+                                 (encode_value(document['_id']), dumps(document)))
+        except sqlite3.IntegrityError as e:
+            self._connection.notify('insert', started, failed=True)
+            raise self._duplicate(e, document)
+        self._connection.notify('insert', started)
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        started = time.perf_counter()
+        inserted, errors = [], []
+        with _Transaction(self._conn()) as conn:
+            for index, document in enumerate(documents):
+                document.setdefault('_id', ObjectId())
+                try:
+                    conn.execute(f'INSERT INTO {self._table} (_id, doc) VALUES (?, ?)',
+                                 (encode_value(document['_id']), dumps(document)))
+                    inserted.append(document['_id'])
+                except sqlite3.IntegrityError as e:
+                    errors.append({'index': index, 'code': 11000, 'errmsg': f'E11000 duplicate key error: {e}',
+                                   'op': document})
+                    if ordered:
+                        break
+        self._connection.notify('insert', started, failed=bool(errors))
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [], 'nInserted': len(inserted),
+                                  'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []})
+        return InsertManyResult(inserted, True)
+
+    def _update(self, filter, update, upsert, many, sort=None):
+        """Returns (matched, modified, upserted_id, before, after) for the last document touched."""
+        matched = modified = 0
+        upserted_id = before = after = None
+        with _Transaction(self._conn()) as conn:
+            sql, params = self._select(filter, sort=sort, limit=0 if many else 1)
+            for rowid, _, text in conn.execute(sql, params).fetchall():
+                before = loads(text)
+                after = copy.deepcopy(before)
+                apply_update(after, update)
+                matched += 1
+                new_text = dumps(after)
+                if new_text != text:
+                    try:
+                        conn.execute(f'UPDATE {self._table} SET doc = ? WHERE rowid = ?', (new_text, rowid))
+                    except sqlite3.IntegrityError as e:
+                        raise self._duplicate(e, after)
+                    modified += 1
+            if not matched and upsert:
+                after = {}
+                _equality_fields(filter if isinstance(filter, dict) else {'_id': filter}, after)
+                apply_update(after, update, inserting=True)
+                after.setdefault('_id', ObjectId())
+                try:
+                    conn.execute(f'INSERT INTO {self._table} (_id, doc) VALUES (?, ?)',
+                                 (encode_value(after['_id']), dumps(after)))
+                except sqlite3.IntegrityError as e:
+                    raise self._duplicate(e, after)
+                upserted_id = after['_id']
+        return matched, modified, upserted_id, before, after
+
+    def _update_result(self, command, filter, update, upsert, many):
+        started = time.perf_counter()
+        try:
+            matched, modified, upserted_id, _, _ = self._update(filter, update, upsert, many)
+        except Exception:
+            self._connection.notify(command, started, failed=True)
+            raise
+        self._connection.notify(command, started)
+        raw = {'n': matched + (1 if upserted_id is not None else 0), 'nModified': modified}
+        if upserted_id is not None:
+            raw['upserted'] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        return self._update_result('update', filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        return self._update_result('update', filter, update, upsert, many=True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=ReturnDocument.BEFORE, **kwargs):
+        started = time.perf_counter()
+        try:
+            _, _, upserted_id, before, after = self._update(filter, update, upsert, False, _normalize_sort(sort))
+        except Exception:
+            self._connection.notify('findAndModify', started, failed=True)
+            raise
+        self._connection.notify('findAndModify', started)
+        document = after if return_document == ReturnDocument.AFTER else (None if upserted_id is not None else before)
+        return _project(document, projection) if document is not None else None
+
+    def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        started = time.perf_counter()
+        with _Transaction(self._conn()) as conn:
+            sql, params = self._select(filter, sort=_normalize_sort(sort), limit=1)
+            row = conn.execute(sql, params).fetchone()
+            if row is not None:
+                conn.execute(f'DELETE FROM {self._table} WHERE rowid = ?', (row[0],))
+        self._connection.notify('findAndModify', started)
+        return _project(loads(row[2]), projection) if row is not None else None
+
+    def _delete(self, filter, many):
+        started = time.perf_counter()
+        sql, params = self._select(filter, limit=0 if many else 1, columns='rowid')
+        deleted = self._conn().execute(f'DELETE FROM {self._table} WHERE rowid IN ({sql})', params).rowcount
+        self._connection.notify('delete', started)
+        return DeleteResult({'n': deleted}, True)
+
+    def delete_one(self, filter, **kwargs):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter, **kwargs):
+        return self._delete(filter, many=True)
+
+    # --- Indexes ---
+
+    def create_index(self, keys, name=None, unique=False, partialFilterExpression=None, **kwargs):
+        keys = _normalize_sort(keys, 1)
+        for key, direction in keys:
+            if direction not in (1, -1):
+                raise NotImplementedError(f"SQLite storage only supports ascending/descending indexes, not {direction}")
+        name = name or '_'.join(f'{key}_{direction}' for key, direction in keys)
+        columns = ', '.join(f"{field_sql(key)} {'DESC' if direction == -1 else 'ASC'}" for key, direction in keys)
+        where = ''
+        if partialFilterExpression:
+            where = ' WHERE ' + compile_filter(partialFilterExpression, _Params(inline=True))
+        index = '"' + f'{self.name}__{name}'.replace('"', '""') + '"'
+        spec = json.dumps({'key': keys, 'unique': bool(unique), 'partialFilterExpression': encode_value(
+            partialFilterExpression)}, separators=(',', ':'))
+        conn = self._conn()
+        try:
+            conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index} "
+                         f"ON {self._table} ({columns}){where}")
+        except sqlite3.IntegrityError as e:
+            raise self._duplicate(e)
+        conn.execute(f'INSERT OR REPLACE INTO {INDEX_TABLE} (collection, name, spec) VALUES (?, ?, ?)',
+                     (self.name, name, spec))
+        return name
+
+    def drop_index(self, name):
+        conn = self._conn()
+        conn.execute('DROP INDEX IF EXISTS "' + f'{self.name}__{name}'.replace('"', '""') + '"')
+        conn.execute(f'DELETE FROM {INDEX_TABLE} WHERE collection = ? AND name = ?', (self.name, name))
+
+    def index_information(self):
+        info = {'_id_': {'key': [('_id', 1)]}}
+        for name, spec in self._conn().execute(f'SELECT name, spec FROM {INDEX_TABLE} WHERE collection = ?',
+                                               (self.name,)):
+            spec = json.loads(spec)
+            entry = {'key': [tuple(key) for key in spec['key']]}
+            if spec.get('unique'):
+                entry['unique'] = True
+            if spec.get('partialFilterExpression'):
+                entry['partialFilterExpression'] = decode_value(spec['partialFilterExpression'])
+            info[name] = entry
+        return info
+
+
+class SQLiteCursor:
+    """Lazy result set; the query runs when iteration starts."""
+
+    def __init__(self, collection, filter, projection, sort, limit, skip):
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._sort = sort
+        self._limit = limit
+        self._skip = skip
+        self._batch_size = 100
+        self._rows = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size or 100
+        return self
+
+    def _sql(self):
+        return self._collection._select(self._filter, self._sort, self._limit, self._skip, columns='doc')
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._rows is None:
+            started = time.perf_counter()
+            sql, params = self._sql()
+            self._rows = self._collection._conn().execute(sql, params)
+            self._buffer = []
+            self._collection._connection.notify('find', started)
+        if not self._buffer:
+            self._buffer = self._rows.fetchmany(self._batch_size)[::-1]
+            if not self._buffer:
+                raise StopIteration
+        return _project(loads(self._buffer.pop()[0]), self._projection)
+
+    def close(self):
+        if self._rows is not None:
+            self._rows.close()
+        self._rows = None
+
+    def explain(self):
+        """Reports the SQLite plan in the shape verify_query_plans() reads (COLLSCAN / IXSCAN / SORT)."""
+        sql, params = self._sql()
+        details = [row[3] for row in self._collection._conn().execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        stage = None
+        for detail in details:
+            if detail.startswith(('SEARCH', 'SCAN')):
+                name = 'IXSCAN' if 'USING' in detail else 'COLLSCAN'
+                stage = {'stage': name, 'detail': detail, **({'inputStage': stage} if stage else {})}
+            elif 'TEMP B-TREE' in detail:
+                stage = {'stage': 'SORT', 'detail': detail, **({'inputStage': stage} if stage else {})}
+        return {'queryPlanner': {'winningPlan': stage or {}, 'sqlite': details}}
@@ -0,0 +1,133 @@
+"""Per-doctor daily appointment counters.
+
+One document per doctor and day (the day an appointment takes place) holds
+
+    booked          appointments on that day, whatever happened to them since
+    cancelled, completed, expired   how many of those ended that way
+    booked_minutes  time taken by the ones not cancelled
+
+The handlers that change appointments keep them current with $inc upserts
+(record()), so reading a date range is an index range scan returning at
+most one document per doctor and day. rebuild() recomputes every counter
+from the appointments and their archive; it is the fix for counters that
+drifted (e.g. a write that failed half way) and the way to seed them for
+appointments stored before counters existed.
+"""
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+STATS_COLLECTION = 'doctor_daily_stats'
+COUNTERS = ('booked', 'cancelled', 'completed', 'expired', 'booked_minutes')
+STATUS_COUNTERS = ('cancelled', 'completed', 'expired')
+
+
+def day_of(when):
+    return datetime(when.year, when.month, when.day)
+
+
+def appointment_minutes(start, end):
+    return int((end - start) // timedelta(minutes=1))
+
+
+def record(db, doctor_id, when, **increments):
+    """Adds `increments` (counter name -> delta) to the counters of doctor_id on when's day."""
+    increments = {name: delta for name, delta in increments.items() if delta}
+    if not increments:
+        return
+    selector = {'doctor_id': doctor_id, 'day': day_of(when)}
+    try:
+        db[STATS_COLLECTION].update_one(selector, {'$inc': increments}, upsert=True)
+    except DuplicateKeyError:
+        # Another request created the day's document between our match and insert
+        db[STATS_COLLECTION].update_one(selector, {'$inc': increments})
+
+
+def _minutes_expression(default_minutes):
+    # Appointments booked before durations existed have no stored end and last one default slot
+    end = {'$ifNull': ['$appointment_end',
+                       {'$add': ['$appointment_datetime', default_minutes * 60000]}]}
+    return {'$divide': [{'$subtract': [end, '$appointment_datetime']}, 60000]}
+
+
+def rebuild_pipeline(default_minutes):
+    """Groups appointments into one row of counters per doctor and day."""
+    def count_status(status):
+        return {'$sum': {'$cond': [{'$eq': ['$status', status]}, 1, 0]}}
+
+    return [
+        {'$match': {'appointment_datetime': {'$type': 'date'}}},
+        {'$group': {
+            '_id': {
+                'doctor_id': '$doctor_id',
+                'day': {'$dateFromParts': {'year': {'$year': '$appointment_datetime'},
+                                           'month': {'$month': '$appointment_datetime'},
+                                           'day': {'$dayOfMonth': '$appointment_datetime'}}},
+            },
+            'booked': {'$sum': 1},
+            **{status: count_status(status) for status in STATUS_COUNTERS},
+            'booked_minutes': {'$sum': {'$cond': [{'$eq': ['$status', 'cancelled']}, 0,
+                                                  _minutes_expression(default_minutes)]}},
+        }},
+    ]
+
+
+def _grouped_in_python(collection, default_minutes):
+    # Storage without aggregate() (the SQLite backend): the same grouping over a projected scan
+    rows = {}
+    projection = {'doctor_id': 1, 'appointment_datetime': 1, 'appointment_end': 1, 'status': 1}
+    for appt in collection.find({}, projection):
+        start = appt.get('appointment_datetime')
+        if not isinstance(start, datetime):
+            continue
+        key = (appt.get('doctor_id'), day_of(start))
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {'_id': {'doctor_id': key[0], 'day': key[1]}, **dict.fromkeys(COUNTERS, 0)}
+        row['booked'] += 1
+        status = appt.get('status')
+        if status in STATUS_COUNTERS:
+            row[status] += 1
+        if status != 'cancelled':
+            end = appt.get('appointment_end') or start + timedelta(minutes=default_minutes)
+            row['booked_minutes'] += appointment_minutes(start, end)
+    return rows.values()
+
+
+def rebuild(db, collections, default_minutes, batch_size=1000, logger=None):
+    """Recomputes every counter from `collections` (names). Returns how many day documents were written.
+
+    Run it while bookings are quiet: changes made during the rebuild may be
+    counted twice or not at all until the next rebuild.
+    """
+    totals = {}
+    for name in collections:
+        collection = db[name]
+        if hasattr(collection, 'aggregate'):
+            rows = collection.aggregate(rebuild_pipeline(default_minutes), allowDiskUse=True)
+        else:
+            rows = _grouped_in_python(collection, default_minutes)
+        for row in rows:
+            key = (row['_id']['doctor_id'], row['_id']['day'])
+            counters = totals.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for counter in COUNTERS:
+                counters[counter] += int(row.get(counter) or 0)
+
+    stats = db[STATS_COLLECTION]
+    stats.delete_many({})
+    documents = [{'doctor_id': doctor_id, 'day': day, **counters} for (doctor_id, day), counters in totals.items()]
+    for i in range(0, len(documents), batch_size):
+        stats.insert_many(documents[i:i + batch_size])
+    if logger:
+        logger.info(f"Doctor stats rebuilt: {len(documents)} doctor-days from {', '.join(collections)}")
+    return len(documents)
+
+
+def read_counters(db, doctor_ids, start_day, end_day):
+    """Returns {(doctor_id, day): counters} for the days in [start_day, end_day]."""
+    query = {'day': {'$gte': day_of(start_day), '$lte': day_of(end_day)}}
+    query['doctor_id'] = doctor_ids[0] if len(doctor_ids) == 1 else {'$in': doctor_ids}
+    return {
+        (doc['doctor_id'], doc['day'].date()): {counter: doc.get(counter, 0) for counter in COUNTERS}
+        for doc in db[STATS_COLLECTION].find(query, {'_id': 0})
+    }
@@ -0,0 +1,52 @@
+"""Streaming JSON array responses built straight from a pymongo cursor.
+
+Rows are encoded as the cursor yields them and flushed in groups, so a
+request holds at most one cursor batch and one encoded group in memory no
+matter how many rows it returns, and the first bytes go out as soon as the
+first batch arrives.
+"""
+import heapq
+import json
+
+from serializers import json_default
+
+
+def iter_json_array(rows, transform, flush_every=100):
+    """Yields a JSON array as text chunks, encoding `transform(row)` for each row."""
+    encode = json.JSONEncoder(separators=(',', ':'), default=json_default).encode
+    yield '['
+    pending = []
+    first = True
+    for row in rows:
+        item = encode(transform(row))
+        if first:
+            pending.append(item)
+            first = False
+        else:
+            pending.append(',' + item)
+        if len(pending) >= flush_every:
+            yield ''.join(pending)
+            pending = []
+    if pending:
+        yield ''.join(pending)
+    yield ']'
+
+
+def stream_cursor(cursor, transform, batch_size):
+    """Yields JSON text for every document of a cursor and closes it when done."""
+    cursor.batch_size(batch_size)
+    try:
+        yield from iter_json_array(cursor, transform, flush_every=batch_size)
+    finally:
+        cursor.close()
+
+
+def stream_merged(cursors, key, transform, batch_size):
+    """Like stream_cursor for several cursors sorted descending by `key`, interleaved into one array."""
+    for cursor in cursors:
+        cursor.batch_size(batch_size)
+    try:
+        yield from iter_json_array(heapq.merge(*cursors, key=key, reverse=True), transform, flush_every=batch_size)
+    finally:
+        for cursor in cursors:
+            cursor.close()
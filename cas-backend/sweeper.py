@@ -0,0 +1,143 @@
+"""Background upkeep of the appointments collection.
+
+Two passes keep db.appointments limited to recent and upcoming visits:
+
+* expire_stale() marks 'upcoming' appointments whose start lies further
+  back than the expiry horizon as 'expired' (nobody completed them; a
+  doctor can still do so) and frees their slot claims.
+* archive_finished() moves completed, cancelled and expired appointments
+  older than the archive horizon into appointments_archive, which the
+  listing endpoints only read when history is requested.
+
+Both work in bounded batches and are idempotent, so an interrupted sweep is
+simply finished by the next one. Sweeper runs them on a daemon thread in
+every worker process; a lease document makes sure only one worker sweeps
+per interval.
+"""
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from slot_claims import release_claims
+
+ARCHIVE_COLLECTION = 'appointments_archive'
+LEASE_COLLECTION = 'leases'
+FINISHED_STATUSES = ['completed', 'cancelled', 'expired']
+# What change events need to describe an expired appointment
+EXPIRED_PROJECTION = {'doctor_id': 1, 'patient_id': 1, 'doctor_name': 1, 'patient_name': 1,
+                      'appointment_datetime': 1, 'appointment_end': 1, 'reason': 1}
+
+
+def expire_stale(db, cutoff, batch_size, now=None, on_expired=None):
+    """Marks upcoming appointments that started before `cutoff` as expired. Returns how many were.
+
+    on_expired, if given, is called with each batch of expired documents:
+    only those this sweep changed, not ones cancelled or completed between
+    its read and its update.
+    """
+    now = now or datetime.utcnow()
+    # Stored dates keep milliseconds; the stamp must read back equal to identify this sweep's rows
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    expired = 0
+    while True:
+        batch = list(db.appointments.find({'status': 'upcoming', 'appointment_datetime': {'$lt': cutoff}},
+                                          {'_id': 1}).limit(batch_size))
+        if not batch:
+            return expired
+        ids = [appt['_id'] for appt in batch]
+        result = db.appointments.update_many({'_id': {'$in': ids}, 'status': 'upcoming'},
+                                             {'$set': {'status': 'expired', 'expired_at': now, 'updated_at': now}})
+        if not result.modified_count:
+            continue  # All of them changed status meanwhile
+        # The status filter let only still-upcoming rows through, and only those carry this stamp
+        changed = list(db.appointments.find({'_id': {'$in': ids}, 'status': 'expired', 'expired_at': now},
+                                            EXPIRED_PROJECTION))
+        release_claims(db, [appt['_id'] for appt in changed])
+        expired += len(changed)
+        if on_expired and changed:
+            for appt in changed:
+                appt['status'] = 'expired'
+            on_expired(changed)
+
+
+def archive_finished(db, cutoff, batch_size, now=None):
+    """Moves finished appointments that started before `cutoff` to the archive. Returns how many moved."""
+    now = now or datetime.utcnow()
+    moved = 0
+    while True:
+        batch = list(db.appointments.find(
+            {'status': {'$in': FINISHED_STATUSES}, 'appointment_datetime': {'$lt': cutoff}}).limit(batch_size))
+        if not batch:
+            return moved
+        for appt in batch:
+            appt['archived_at'] = now
+        try:
+            db[ARCHIVE_COLLECTION].insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Copies left behind by an interrupted sweep are already archived
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+        ids = [appt['_id'] for appt in batch]
+        db.appointments.delete_many({'_id': {'$in': ids}})
+        # Completing an appointment does not release its claims; these are all in the past
+        release_claims(db, ids)
+        moved += len(ids)
+
+
+def acquire_lease(db, name, owner, seconds):
+    """Takes or renews a named lease until now + seconds. Returns False if another owner holds it."""
+    now = datetime.utcnow()
+    try:
+        db[LEASE_COLLECTION].find_one_and_update(
+            {'_id': name, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Sweeper:
+    """Calls `run` every `interval` seconds on a daemon thread.
+
+    The thread is started lazily per process (see ensure_started), because a
+    thread started before the workers fork would not exist in them.
+    """
+
+    def __init__(self, run, interval, logger=None):
+        self._run_once = run
+        self.interval = interval
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._stop = threading.Event()
+                threading.Thread(target=self._loop, name='appointment-sweeper', daemon=True).start()
+                self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+        self._pid = None
+
+    def _loop(self):
+        stop = self._stop
+        while not stop.wait(self.interval):
+            try:
+                self._run_once()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Appointment sweep failed: {e}")
@@ -0,0 +1,102 @@
+"""Fixtures shared by the backend tests.
+
+Every test that takes `app` (or `client`) runs once per storage backend:
+MongoDB and the embedded SQLite store. MongoDB is a live server when
+APPOINTIX_TEST_MONGO_URI is set (its 'appointix_test' database is dropped
+first), otherwise the in-process mongomock stand-in; without either the
+MongoDB run is skipped.
+
+    cd cas-backend && python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import server  # noqa: E402
+
+TEST_DBNAME = 'appointix_test'
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+@pytest.fixture(params=['mongo', 'sqlite'])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def app(backend, tmp_path, monkeypatch):
+    config = {
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'VERIFY_QUERY_PLANS': False,
+        'SWEEPER_ENABLED': False,
+        'RATE_LIMIT_ENABLED': False,
+        'MAX_IN_FLIGHT_REQUESTS': 0,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',  # Fast; the tests are not about hashing
+        'PASSWORD_HASH_WORKERS': 0,
+    }
+    live_uri = os.environ.get('APPOINTIX_TEST_MONGO_URI')
+    if backend == 'sqlite':
+        config.update(STORAGE_BACKEND='sqlite', SQLITE_PATH=str(tmp_path / 'appointix.sqlite3'))
+    else:
+        if not live_uri:
+            mongomock = pytest.importorskip('mongomock', reason='set APPOINTIX_TEST_MONGO_URI or install mongomock')
+            monkeypatch.setattr(database, 'MongoClient', mongomock.MongoClient)
+        config.update(STORAGE_BACKEND='mongo', MONGO_URI=live_uri or 'mongodb://localhost:27017/',
+                      MONGO_DBNAME=TEST_DBNAME)
+    app = server.create_app(config)
+    if backend == 'mongo':
+        server.mongo.client.drop_database(TEST_DBNAME)
+
+    # Module-level caches and indexes outlive an app; start every test from an empty directory
+    server.principal_cache.clear()
+    server.invalidate_doctor_directory()
+    server.availability_index.loaded_at = None
+    server.doctor_search_index.loaded_at = None
+
+    with app.app_context():
+        server.bootstrap_database(verify=False)
+    yield app
+    if backend == 'sqlite':
+        server.sqlite_storage.close()
+    else:
+        server.mongo.close()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def register(client, email, user_type, name='Test User', specialization=None):
+    """Registers and logs in a user. Returns the login response (token, and doctorId for doctors)."""
+    payload = {'email': email, 'password': 'test-password', 'userType': user_type, 'name': name}
+    if specialization:
+        payload['specialization'] = specialization
+    response = client.post('/api/register', json=payload)
+    assert response.status_code == 201, response.get_json()
+    response = client.post('/api/login', json={'email': email, 'password': 'test-password', 'userType': user_type})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.fixture
+def doctor(client):
+    """A doctor available 09:00-17:00 every day."""
+    login = register(client, 'doctor@example.com', 'doctor', 'Dr. Test', 'Cardiology')
+    hours = {day: {'startTime': '09:00', 'endTime': '17:00', 'isAvailable': True} for day in WEEKDAYS}
+    response = client.put('/api/doctors/me/availability', json=hours, headers=auth(login['token']))
+    assert response.status_code == 200, response.get_json()
+    return login
+
+
+@pytest.fixture
+def patient(client):
+    return register(client, 'patient@example.com', 'patient', 'Pat Test')
@@ -0,0 +1,33 @@
+"""POST /api/appointments/batch: the atomic flag."""
+import pytest
+
+from conftest import auth, register
+
+OCCURRENCES = [{'date': '2030-01-07', 'time': '10:00'}, {'date': '2030-01-08', 'time': '10:00'}]
+
+
+def book_batch(client, patient, doctor, **fields):
+    return client.post('/api/appointments/batch', json={'doctorId': doctor['doctorId'], 'occurrences': OCCURRENCES,
+                                                        **fields}, headers=auth(patient['token']))
+
+
+@pytest.mark.parametrize('value', ['false', 'true', 0, 1, None, []])
+def test_atomic_must_be_a_json_boolean(client, doctor, patient, value):
+    response = book_batch(client, patient, doctor, atomic=value)
+    assert response.status_code == 400
+    assert 'atomic' in response.get_json()['error']
+    listed = client.get('/api/appointments/patient', headers=auth(patient['token'])).get_json()
+    assert listed == []
+
+
+def test_atomic_books_nothing_when_one_occurrence_is_taken(client, doctor, patient):
+    other = register(client, 'other@example.com', 'patient', 'Other Patient')
+    assert book_batch(client, other, doctor, occurrences=OCCURRENCES[1:]).status_code == 201
+
+    assert book_batch(client, patient, doctor, atomic=True).status_code == 409
+    assert client.get('/api/appointments/patient', headers=auth(patient['token'])).get_json() == []
+
+    response = book_batch(client, patient, doctor, atomic=False)
+    assert response.status_code == 201, response.get_json()
+    listed = client.get('/api/appointments/patient', headers=auth(patient['token'])).get_json()
+    assert [row['date'] for row in listed] == ['2030-01-07']
@@ -0,0 +1,121 @@
+"""Simultaneous bookings of one slot, hundreds at once or interleaved step by step: exactly one may win."""
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+import server
+from conftest import register
+from slot_claims import CLAIMS_COLLECTION, SlotTakenError, claim_cells, claim_slot
+from test_storage_conformance import DAY, book
+
+THREADS = 200
+
+
+def run_at_once(count, target):
+    """Starts `count` threads that all call target(i) at the same moment; returns their results."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = target(i)
+        except Exception as e:  # Reported through the results, so one failure does not hang the rest
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_parallel_claims_of_one_slot_have_one_winner(app):
+    doctor_oid = ObjectId()
+    start = datetime(DAY.year, DAY.month, DAY.day, 10, 0)
+    cells = claim_cells(start, start + timedelta(minutes=30), app.config['APPOINTMENT_CLAIM_MINUTES'])
+    appointment_ids = [ObjectId() for _ in range(THREADS)]
+
+    def claim(i):
+        with app.app_context():
+            try:
+                claim_slot(server.db, doctor_oid, cells, appointment_ids[i])
+                return 'won'
+            except SlotTakenError:
+                return 'taken'
+
+    results = run_at_once(THREADS, claim)
+    assert Counter(results) == {'won': 1, 'taken': THREADS - 1}
+    winner = appointment_ids[results.index('won')]
+    with app.app_context():
+        claims = list(server.db[CLAIMS_COLLECTION].find({'doctor_id': doctor_oid}))
+    # The winner holds every cell; losers left nothing behind
+    assert sorted(claim['slot_start'] for claim in claims) == cells
+    assert set(claim['appointment_id'] for claim in claims) == {winner}
+
+
+def test_parallel_bookings_of_one_slot_have_one_winner(app, client, doctor):
+    patients = [register(client, f'patient-{i}@example.com', 'patient', f'Patient {i}') for i in range(THREADS)]
+    when = datetime(DAY.year, DAY.month, DAY.day, 10, 0)
+
+    def attempt(i):
+        return book(app.test_client(), patients[i], doctor, when).status_code
+
+    statuses = run_at_once(THREADS, attempt)
+    assert Counter(statuses) == {201: 1, 409: THREADS - 1}
+    with app.app_context():
+        stored = server.db.appointments.count_documents({'doctor_id': ObjectId(doctor['doctorId']),
+                                                         'appointment_datetime': when})
+    assert stored == 1
+
+
+class InterleavedClaims:
+    """Stands in for `db` in claim_slot(): right after its insert_many, before any rollback, runs
+    `interleave()` as another booking's next step would on a server that does not serialize them."""
+
+    def __init__(self, real, interleave):
+        self._real = real
+        self._interleave = interleave
+
+    def __getitem__(self, name):
+        return self if name == CLAIMS_COLLECTION else self._real[name]
+
+    def __getattr__(self, name):
+        return getattr(self._real[CLAIMS_COLLECTION], name)
+
+    def insert_many(self, *args, **kwargs):
+        try:
+            return self._real[CLAIMS_COLLECTION].insert_many(*args, **kwargs)
+        finally:
+            self._interleave()
+
+
+def test_colliding_claims_of_one_interval_do_not_both_lose(app):
+    doctor_oid, first, second = ObjectId(), ObjectId(), ObjectId()
+    start = datetime(DAY.year, DAY.month, DAY.day, 10, 0)
+    cells = claim_cells(start, start + timedelta(minutes=60), app.config['APPOINTMENT_CLAIM_MINUTES'])
+    assert len(cells) > 1
+    with app.app_context():
+        claims = server.db[CLAIMS_COLLECTION]
+        # The first booking has taken the first cell and is about to take the rest
+        claims.insert_one({'doctor_id': doctor_oid, 'slot_start': cells[0], 'appointment_id': first})
+        rest = []
+
+        def first_continues():
+            for cell in cells[1:]:
+                try:
+                    claims.insert_one({'doctor_id': doctor_oid, 'slot_start': cell, 'appointment_id': first})
+                    rest.append(cell)
+                except DuplicateKeyError:
+                    break
+
+        # The second booking collides on the first cell; it must not have taken any later one
+        with pytest.raises(SlotTakenError):
+            claim_slot(InterleavedClaims(server.db, first_continues), doctor_oid, list(reversed(cells)), second)
+        assert rest == cells[1:]
+        assert claims.count_documents({'appointment_id': second}) == 0
@@ -0,0 +1,115 @@
+"""Doctor search: prefix matching, normalization, ranking, and keeping the index current."""
+import io
+from datetime import datetime
+
+import pytest
+
+from conftest import WEEKDAYS, auth, register
+from doctor_search import DoctorSearchIndex, normalize
+
+CARDS = [
+    {'id': '1', 'name': 'Dr. José Carter', 'specialization': 'Cardiology'},
+    {'id': '2', 'name': 'Dr. Carla Jones', 'specialization': 'Dermatology'},
+    {'id': '3', 'name': 'Dr. Joseph Brown', 'specialization': 'Cardiology'},
+    {'id': '4', 'name': 'Dr. Ann Carson', 'specialization': 'Pediatric Cardiology'},
+    {'id': '5', 'name': 'Dr. Jo Adams', 'specialization': 'Neurology'},
+]
+
+
+@pytest.fixture
+def index():
+    index = DoctorSearchIndex()
+    index.load(CARDS, datetime.utcnow())
+    return index
+
+
+def ids(cards):
+    return [card['id'] for card in cards]
+
+
+def test_normalize_strips_accents_and_case():
+    assert normalize('Dr. JOSÉ Müller') == 'dr. jose muller'
+    assert normalize(None) == ''
+
+
+def test_every_query_word_must_prefix_a_word(index):
+    assert set(ids(index.search('car'))) == {'1', '2', '3', '4'}
+    # Carla Jones matches too ('car'la, 'jo'nes), and ties José Carter; Joseph Brown only has Cardiology for 'car'
+    assert ids(index.search('jo car')) == ['2', '1', '3']
+    assert ids(index.search('car xyz')) == []
+    # Titles are ignored rather than matching everyone
+    assert ids(index.search('dr')) == ids(index.search(''))
+    assert ids(index.search('dr carter')) == ['1']
+
+
+@pytest.mark.parametrize('query', ['JOSE', 'josé', '  jose  ', 'Jose,', 'jOsÉ   carter'])
+def test_queries_are_normalized(index, query):
+    assert ids(index.search(query))[0] == '1'
+
+
+def test_ranking(index):
+    # Whole-word name match, then first-name prefix, then other name prefix, then specialization only
+    assert ids(index.search('jo')) == ['5', '1', '3', '2']
+    assert ids(index.search('carson')) == ['4']
+    # Specialization-only matches tie and go by name
+    assert ids(index.search('cardiology')) == ['4', '1', '3']
+    assert ids(index.search('car')) == ['2', '4', '1', '3']
+    assert ids(index.search('jo', limit=2)) == ['5', '1']
+
+
+def test_specialization_is_a_prefix_filter(index):
+    assert ids(index.search(specialization='cardio')) == ['1', '3']
+    assert ids(index.search(specialization=' CARDIOLOGY ')) == ['1', '3']
+    assert ids(index.search(specialization='pediatric')) == ['4']
+    assert ids(index.search('jo', specialization='cardio')) == ['1', '3']
+    # Without a query the results are alphabetical
+    assert ids(index.search()) == ['4', '2', '5', '1', '3']
+
+
+def test_upsert_and_remove_update_the_index(index):
+    index.upsert({'id': '2', 'name': 'Dr. Carla Smith', 'specialization': 'Oncology'})
+    assert ids(index.search('jones')) == []
+    assert ids(index.search('smith')) == ['2']
+    assert ids(index.search(specialization='derma')) == []
+    assert ids(index.search('onco')) == ['2']
+    index.upsert({'id': '6', 'name': 'Dr. Zoe Carter', 'specialization': 'Cardiology'})
+    assert ids(index.search('carter')) == ['1', '6']
+    index.remove('1')
+    assert ids(index.search('carter')) == ['6']
+    assert len(index) == 5
+
+
+# --- API ---
+
+def search(client, query='', **params):
+    response = client.get('/api/doctors/search', query_string={'q': query, **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_search_sees_registrations_and_profile_changes(client, patient):
+    carter = register(client, 'carter@example.com', 'doctor', 'Dr. José Carter', 'Cardiology')
+    # Built on the first search, then kept current by the writes of this process
+    assert [card['name'] for card in search(client, 'jose')] == ['Dr. José Carter']
+    register(client, 'jones@example.com', 'doctor', 'Dr. Carla Jones', 'Dermatology')
+    assert [card['name'] for card in search(client, 'car')] == ['Dr. Carla Jones', 'Dr. José Carter']
+    assert [card['id'] for card in search(client, specialization='cardio')] == [carter['doctorId']]
+
+    response = client.post('/api/doctors/me/profile-picture', data={'profilePic': (io.BytesIO(b'picture'), 'me.png')},
+                           headers=auth(carter['token']), content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert search(client, 'carter')[0]['profilePictureUrl'] == response.get_json()['profilePictureUrl']
+
+    hours = {day: {'startTime': '09:00', 'endTime': '12:00', 'isAvailable': True} for day in WEEKDAYS}
+    assert client.put('/api/doctors/me/availability', json=hours, headers=auth(carter['token'])).status_code == 200
+    assert search(client, 'carter')[0]['availability']['Monday']['endTime'] == '12:00'
+
+
+def test_search_returns_cards_only_and_bounds_the_limit(app, client):
+    for i in range(3):
+        register(client, f'doctor-{i}@example.com', 'doctor', f'Dr. Test {i}', 'Cardiology')
+    cards = search(client, 'test', limit=2)
+    assert len(cards) == 2
+    assert set(cards[0]) == {'id', 'name', 'specialization', 'profilePictureUrl', 'availability'}
+    assert len(search(client, 'test', limit=0)) == 1
+    assert client.get('/api/doctors/search?limit=many').status_code == 400
@@ -0,0 +1,55 @@
+"""Event streams open with a short-lived ticket in the URL, never with the login token."""
+import pytest
+
+from conftest import auth
+
+EVENTS = '/api/appointments/events'
+TICKET = '/api/appointments/events/ticket'
+
+
+@pytest.fixture
+def short_streams(app):
+    # Streams end right after the retry hint, so reading one does not block the test
+    app.config['EVENTS_STREAM_MAX_SECONDS'] = 0
+
+
+def ticket_for(client, login):
+    response = client.post(TICKET, headers=auth(login['token']))
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['expiresIn'] == 60
+    return response.get_json()['ticket']
+
+
+@pytest.mark.parametrize('user', ['doctor', 'patient'])
+def test_ticket_opens_the_stream(client, short_streams, request, user):
+    login = request.getfixturevalue(user)
+    response = client.get(f'{EVENTS}?ticket={ticket_for(client, login)}')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.get_data(as_text=True).startswith('retry: ')
+
+
+def test_header_still_opens_the_stream(client, short_streams, patient):
+    assert client.get(EVENTS, headers=auth(patient['token'])).status_code == 200
+
+
+def test_login_token_is_refused_in_the_url(client, short_streams, patient):
+    assert client.get(f"{EVENTS}?token={patient['token']}").status_code == 401
+    assert client.get(f"{EVENTS}?ticket={patient['token']}").status_code == 401
+    assert client.get(EVENTS).status_code == 401
+
+
+def test_ticket_is_not_a_login_token(client, patient):
+    ticket = ticket_for(client, patient)
+    assert client.get('/api/appointments/patient', headers=auth(ticket)).status_code == 401
+    assert client.post(TICKET, headers=auth(ticket)).status_code == 401
+
+
+def test_expired_ticket_is_refused(app, client, short_streams, patient):
+    app.config['EVENTS_TICKET_SECONDS'] = -1
+    response = client.post(TICKET, headers=auth(patient['token']))
+    assert client.get(f"{EVENTS}?ticket={response.get_json()['ticket']}").status_code == 401
+
+
+def test_ticket_needs_a_login(client):
+    assert client.post(TICKET).status_code == 401
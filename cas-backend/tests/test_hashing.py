@@ -0,0 +1,38 @@
+"""PasswordHasher admission: a timed-out hash keeps its slot until the pool is done with it."""
+import time
+
+import pytest
+
+from hashing import HasherBusyError, PasswordHasher
+
+METHOD = 'pbkdf2:sha256:1000'
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(METHOD, workers=1, queue_limit=0, timeout=0.2)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_verify(hasher):
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.verify(pwhash, 'wrong')
+
+
+def test_timed_out_hash_holds_its_slot_until_it_finishes(hasher):
+    hasher.hash('warm-up')  # Start the worker process outside the timed part
+    with pytest.raises(HasherBusyError, match='timed out'):
+        hasher._run(time.sleep, 1.0)
+    # Still running in the pool: no capacity for another hash
+    with pytest.raises(HasherBusyError, match='capacity'):
+        hasher.hash('secret')
+    time.sleep(1.2)
+    assert hasher.verify(hasher.hash('secret'), 'secret')
+
+
+def test_inline_hashing_releases_its_slot():
+    hasher = PasswordHasher(METHOD, workers=0, queue_limit=0)
+    for _ in range(3):
+        assert hasher.verify(hasher.hash('secret'), 'secret')
@@ -0,0 +1,17 @@
+"""Index bootstrap keeps only the indexes the handlers' queries use."""
+from pymongo import ASCENDING
+
+import server
+from indexes import INDEXES, RETIRED_INDEXES, ensure_indexes
+
+
+def test_retired_indexes_are_dropped(app):
+    with app.app_context():
+        appointments = server.db.appointments
+        appointments.create_index([('doctor_id', ASCENDING), ('status', ASCENDING),
+                                   ('appointment_datetime', ASCENDING)], name='doctor_status_datetime')
+        ensure_indexes(server.db)
+        existing = appointments.index_information()
+    assert not set(RETIRED_INDEXES['appointments']) & set(existing)
+    assert {options['name'] for _, options in INDEXES['appointments']} <= set(existing)
+
@@ -0,0 +1,28 @@
+"""/metrics and the operator routes under /api/internal/ need the configured operator token."""
+import pytest
+
+OPERATOR_TOKEN = 'operator-secret'
+INTERNAL_ROUTES = ['/metrics', '/api/internal/cache-stats', '/api/internal/doctor-stats']
+
+
+@pytest.mark.parametrize('route', INTERNAL_ROUTES)
+def test_disabled_without_a_configured_token(client, route):
+    assert client.get(route).status_code == 404
+    assert client.get(route, headers={'X-Operator-Token': ''}).status_code == 404
+
+
+@pytest.mark.parametrize('route', INTERNAL_ROUTES)
+def test_token_required_when_configured(app, client, route):
+    app.config['OPERATOR_TOKEN'] = OPERATOR_TOKEN
+    assert client.get(route).status_code == 401
+    assert client.get(route, headers={'X-Operator-Token': 'wrong'}).status_code == 401
+    response = client.get(route, headers={'X-Operator-Token': OPERATOR_TOKEN})
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+
+def test_anonymous_metrics_scrape_reveals_nothing(app, client):
+    app.config['OPERATOR_TOKEN'] = OPERATOR_TOKEN
+    for headers in ({}, {'X-Operator-Token': 'wrong'}):
+        response = client.get('/metrics', headers=headers)
+        assert response.status_code == 401
+        assert 'appointix_' not in response.get_data(as_text=True)
@@ -0,0 +1,76 @@
+"""Shared profile pictures: the file goes only with its last reference, even when an upload races the release."""
+import io
+import os
+
+import pytest
+
+import server
+from media_store import MEDIA_COLLECTION, add_reference, publish, release_reference, write_content_addressed
+
+PICTURE = b'the same picture'
+
+
+class InterleavedRefs:
+    """Stands in for `db` in release_reference(): right after the media_refs call named `after`,
+    runs `interleave()` as a concurrent upload of the same content would."""
+
+    def __init__(self, real, after, interleave):
+        self._real = real
+        self._after = after
+        self._interleave = interleave
+
+    def __getitem__(self, name):
+        return self if name == MEDIA_COLLECTION else self._real[name]
+
+    def __getattr__(self, name):
+        method = getattr(self._real[MEDIA_COLLECTION], name)
+        if name != self._after:
+            return method
+
+        def interleaved(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._interleave()
+        return interleaved
+
+
+@pytest.fixture
+def folder(app):
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return app.config['UPLOAD_FOLDER']
+
+
+def upload(folder):
+    filename, temp_path = write_content_addressed(io.BytesIO(PICTURE), folder, 'png')
+    add_reference(server.db, filename)
+    publish(temp_path, folder, filename)
+    return filename
+
+
+def test_file_goes_with_its_last_reference(app, folder):
+    with app.app_context():
+        filename = upload(folder)
+        assert upload(folder) == filename
+        assert release_reference(server.db, filename, folder) is False
+        assert os.path.exists(os.path.join(folder, filename))
+        assert release_reference(server.db, filename, folder) is True
+        assert not os.path.exists(os.path.join(folder, filename))
+        assert server.db[MEDIA_COLLECTION].find_one({'_id': filename}) is None
+        # A stray release of a file nobody references is harmless
+        assert release_reference(server.db, filename, folder) is False
+
+
+@pytest.mark.parametrize('after', ['find_one_and_update', 'find_one_and_delete'])
+def test_upload_during_the_last_release_keeps_the_file(app, folder, after):
+    with app.app_context():
+        filename = upload(folder)
+        # The upload lands after the count reached zero, or after the zero-count document was deleted
+        refs = InterleavedRefs(server.db, after, lambda: upload(folder))
+        release_reference(refs, filename, folder)
+        assert os.path.exists(os.path.join(folder, filename))
+        assert server.db[MEDIA_COLLECTION].find_one({'_id': filename})['refcount'] == 1
+        # The upload's reference is the last one now, and releasing it removes the file
+        assert release_reference(server.db, filename, folder) is True
+        assert not os.path.exists(os.path.join(folder, filename))
+        assert os.listdir(folder) == []
@@ -0,0 +1,137 @@
+"""Cursors and sync tokens: signed, kind-checked and expiring, and exact when rows tie on the sort key."""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import pagination
+import server
+from conftest import auth
+from pagination import TokenExpiredError, decode_cursor, decode_sync_token, encode_cursor, encode_sync_token
+
+WHEN = datetime(2030, 1, 7, 10, 0)
+OID = ObjectId()
+
+
+@pytest.fixture
+def signed():
+    pagination.configure('test-secret', cursor_max_age=60, sync_max_age=600)
+
+
+def tampered(token):
+    """The token with the position swapped for another one, keeping the original signature."""
+    forged = encode_cursor({'appointment_datetime': WHEN - timedelta(days=1), '_id': ObjectId()})
+    return forged.split('.')[0] + '.' + token.split('.')[1]
+
+
+# --- Tokens ---
+
+def test_tokens_round_trip(signed):
+    assert decode_cursor(encode_cursor({'appointment_datetime': WHEN, '_id': OID})) == (WHEN, OID)
+    assert decode_sync_token(encode_sync_token(WHEN, OID)) == (WHEN, OID)
+
+
+@pytest.mark.parametrize('decode', [decode_cursor, decode_sync_token])
+def test_forged_and_malformed_tokens_are_rejected(signed, decode):
+    token = encode_cursor({'appointment_datetime': WHEN, '_id': OID}) if decode is decode_cursor \
+        else encode_sync_token(WHEN, OID)
+    for bad in (tampered(token), token.split('.')[0], token + 'x', 'not-a-token', '', 'a.b.c'):
+        with pytest.raises(ValueError) as raised:
+            decode(bad)
+        assert raised.type is ValueError
+    # The same position signed with another key
+    pagination.configure('other-secret', 60, 600)
+    foreign = encode_cursor({'appointment_datetime': WHEN, '_id': OID}) if decode is decode_cursor \
+        else encode_sync_token(WHEN, OID)
+    pagination.configure('test-secret', 60, 600)
+    with pytest.raises(ValueError):
+        decode(foreign)
+
+
+def test_a_cursor_is_not_a_sync_token(signed):
+    with pytest.raises(ValueError):
+        decode_sync_token(encode_cursor({'appointment_datetime': WHEN, '_id': OID}))
+    with pytest.raises(ValueError):
+        decode_cursor(encode_sync_token(WHEN, OID))
+
+
+def test_tokens_expire(signed):
+    issued = int(time.time())
+    cursor = encode_cursor({'appointment_datetime': WHEN, '_id': OID}, now=issued)
+    sync_token = encode_sync_token(WHEN, OID, now=issued)
+    assert decode_cursor(cursor, now=issued + 60) == (WHEN, OID)
+    with pytest.raises(TokenExpiredError):
+        decode_cursor(cursor, now=issued + 61)
+    # Sync tokens live longer: a dashboard may come back after a while
+    assert decode_sync_token(sync_token, now=issued + 61) == (WHEN, OID)
+    with pytest.raises(TokenExpiredError):
+        decode_sync_token(sync_token, now=issued + 601)
+
+
+# --- Listings ---
+
+def insert_appointments(app, patient, rows):
+    """Inserts appointments of the patient directly: [(appointment_datetime, updated_at), ...]. Returns ids."""
+    docs = [{'_id': ObjectId(), 'doctor_id': ObjectId(), 'doctor_name': 'Dr. Tie',
+             'appointment_datetime': when, 'appointment_end': when + timedelta(hours=1), 'reason': 'checkup',
+             'status': 'upcoming', 'updated_at': updated_at} for when, updated_at in rows]
+    with app.app_context():
+        patient_oid = server.db.users.find_one({'email': 'patient@example.com'})['_id']
+        for doc in docs:
+            doc['patient_id'] = patient_oid
+        server.db.appointments.insert_many(docs)
+    return [str(doc['_id']) for doc in docs]
+
+
+def test_pages_split_rows_that_tie_on_the_sort_key(app, client, patient):
+    # Seven appointments at the same minute: only _id orders them
+    ids = insert_appointments(app, patient, [(WHEN, datetime.utcnow())] * 7)
+    seen, url = [], '/api/appointments/patient?limit=3'
+    while url:
+        response = client.get(url, headers=auth(patient['token']))
+        assert response.status_code == 200
+        seen.extend(row['id'] for row in response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f'/api/appointments/patient?cursor={cursor}&limit=3' if cursor else None
+    assert seen == sorted(ids, reverse=True)
+
+
+def test_sync_splits_changes_that_tie_on_updated_at(app, client, patient):
+    stamped = datetime.utcnow() - timedelta(hours=1)
+    ids = insert_appointments(app, patient, [(WHEN + timedelta(days=i), stamped) for i in range(5)])
+    with app.app_context():
+        token = encode_sync_token(stamped - timedelta(minutes=1))
+    seen = []
+    while True:
+        response = client.get(f'/api/appointments/patient?since={token}&limit=2', headers=auth(patient['token']))
+        assert response.status_code == 200
+        seen.extend(row['id'] for row in response.get_json())
+        token = response.headers['X-Sync-Token']
+        if not response.headers.get('X-Sync-More'):
+            break
+    assert seen == sorted(ids)
+    # Nothing changed since: the final token returns nothing
+    response = client.get(f'/api/appointments/patient?since={token}', headers=auth(patient['token']))
+    assert response.get_json() == []
+
+
+def test_listings_refuse_forged_and_expired_tokens(app, client, patient):
+    insert_appointments(app, patient, [(WHEN, datetime.utcnow())] * 2)
+    response = client.get('/api/appointments/patient?limit=1', headers=auth(patient['token']))
+    cursor, sync_token = response.headers['X-Next-Cursor'], response.headers['X-Sync-Token']
+    for name, token in (('cursor', cursor), ('since', sync_token)):
+        response = client.get(f'/api/appointments/patient?{name}={tampered(token)}', headers=auth(patient['token']))
+        assert response.status_code == 400
+    # Unsigned tokens of the earlier format are refused too
+    assert client.get(f"/api/appointments/patient?cursor={cursor.split('.')[0]}",
+                      headers=auth(patient['token'])).status_code == 400
+
+    old = time.time() - app.config['APPOINTMENT_SYNC_TOKEN_MAX_AGE_SECONDS'] - 1
+    with app.app_context():
+        expired = {'cursor': encode_cursor({'appointment_datetime': WHEN, '_id': OID}, now=old),
+                   'since': encode_sync_token(WHEN, OID, now=old)}
+    for name, token in expired.items():
+        response = client.get(f'/api/appointments/patient?{name}={token}', headers=auth(patient['token']))
+        assert response.status_code == 410
+        assert 'expired' in response.get_json()['error']
@@ -0,0 +1,132 @@
+"""Token buckets (in memory and shared between processes) and the in-flight cap of a worker."""
+import multiprocessing
+
+import pytest
+
+import server
+from conftest import auth
+from ratelimit import AdmissionControl, MemoryBuckets, SharedBuckets, fcntl, parse_rate
+
+shared_only = pytest.mark.skipif(fcntl is None, reason='shared buckets need fcntl')
+
+
+@pytest.fixture(params=['memory', pytest.param('shared', marks=shared_only)])
+def buckets(request, tmp_path):
+    store = MemoryBuckets() if request.param == 'memory' else SharedBuckets(str(tmp_path / 'buckets'), slots=64)
+    yield store
+    if hasattr(store, 'close'):
+        store.close()
+
+
+def test_parse_rate():
+    assert parse_rate('10/minute') == (10, 60)
+    assert parse_rate('3/hours') == (3, 3600)
+    assert parse_rate('5') == (5, 1)
+    for bad in ('0/minute', 'ten/minute', '10/fortnight', ''):
+        with pytest.raises(ValueError):
+            parse_rate(bad)
+
+
+def test_burst_up_to_capacity_then_wait(buckets):
+    # 3 per minute: three at once, then one token every 20 seconds
+    assert [buckets.take('k', 3, 60, now=1000.0) for _ in range(3)] == [None] * 3
+    assert buckets.take('k', 3, 60, now=1000.0) == pytest.approx(20)
+    assert buckets.take('k', 3, 60, now=1010.0) == pytest.approx(10)
+    assert buckets.take('other', 3, 60, now=1010.0) is None
+
+
+def test_refill(buckets):
+    for _ in range(3):
+        buckets.take('k', 3, 60, now=1000.0)
+    assert buckets.take('k', 3, 60, now=1020.0) is None
+    assert buckets.take('k', 3, 60, now=1020.0) is not None
+    # A long pause refills the bucket to its capacity, not beyond
+    assert [buckets.take('k', 3, 60, now=5000.0) for _ in range(4)][3] is not None
+
+
+def take_in_child(path, count, results):
+    store = SharedBuckets(path, slots=64)
+    results.put([store.take('shared-key', 5, 60, now=1000.0) for _ in range(count)])
+    store.close()
+
+
+@shared_only
+def test_shared_buckets_are_shared_across_processes(tmp_path):
+    path = str(tmp_path / 'buckets')
+    parent = SharedBuckets(path, slots=64)
+    assert parent.take('shared-key', 5, 60, now=1000.0) is None
+    # Another worker process spends three more tokens of the same bucket
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    child = context.Process(target=take_in_child, args=(path, 3, results))
+    child.start()
+    assert results.get(timeout=10) == [None] * 3
+    child.join(10)
+    assert child.exitcode == 0
+    assert parent.take('shared-key', 5, 60, now=1000.0) is None
+    assert parent.take('shared-key', 5, 60, now=1000.0) == pytest.approx(12)
+    parent.close()
+
+
+@shared_only
+def test_shared_buckets_recycle_the_stalest_slot_when_full(tmp_path):
+    store = SharedBuckets(str(tmp_path / 'buckets'), slots=SharedBuckets.PROBES)
+    for i in range(SharedBuckets.PROBES):
+        store.take(f'key-{i}', 1, 60, now=1000.0 + i)
+    # Every slot is taken: a new key takes over key-0's slot, and key-0 starts again with a full bucket
+    assert store.take('newcomer', 1, 60, now=2000.0) is None
+    assert store.take('key-0', 1, 60, now=2000.0) is None
+    store.close()
+
+
+# --- Admission control ---
+
+def test_admission_control_counts_and_sheds():
+    control = AdmissionControl(limit=2)
+    assert control.enter() and control.enter()
+    assert not control.enter()
+    control.leave()
+    assert control.enter()
+    assert (control.in_flight, control.shed) == (2, 1)
+    assert AdmissionControl(limit=0).enter()
+
+
+@pytest.fixture
+def limited(app):
+    app.config['RATE_LIMIT_ENABLED'] = True
+    server.rate_limiter.use(MemoryBuckets())
+    server.admission_control.limit = 1
+    yield app
+    server.admission_control.limit = 0
+
+
+def test_slot_is_released_when_a_view_raises(limited):
+    def broken():
+        raise RuntimeError('boom')
+    limited.add_url_rule('/api/broken', 'broken', broken)
+    client = limited.test_client()
+    assert client.get('/api/broken').status_code == 500
+    assert server.admission_control.in_flight == 0
+    # The only slot is free again
+    assert client.get('/').status_code == 200
+
+
+def test_slot_is_released_when_refused_or_rejected(limited):
+    client = limited.test_client()
+    login = {'email': 'nobody@example.com', 'password': 'wrong', 'userType': 'patient'}
+    statuses = [client.post('/api/login', json=login).status_code for _ in range(21)]
+    # 20 per minute per IP: the 21st is refused before the handler runs
+    assert statuses[:20] == [401] * 20 and statuses[20] == 429
+    assert server.admission_control.in_flight == 0
+    assert client.get('/api/appointments/patient', headers=auth('not-a-token')).status_code == 401
+    assert server.admission_control.in_flight == 0
+
+
+def test_shed_request_takes_no_slot(limited):
+    client = limited.test_client()
+    assert server.admission_control.enter()  # Another request holds the only slot
+    response = client.get('/')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    server.admission_control.leave()
+    assert server.admission_control.in_flight == 0
+    assert client.get('/').status_code == 200
@@ -0,0 +1,162 @@
+"""Compiled schedule bitmaps and the earliest-slot index, without a database."""
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from availability_index import AvailabilityIndex
+from scheduling import DAY_NAMES, CompiledSchedule, validate_availability
+
+MONDAY = date(2030, 1, 7)
+GRANULARITY = 15
+
+
+def at(day, hhmm):
+    hours, minutes = map(int, hhmm.split(':'))
+    return datetime(day.year, day.month, day.day, hours, minutes)
+
+
+def hours(start, end, available=True):
+    return {'startTime': start, 'endTime': end, 'isAvailable': available}
+
+
+def compiled(weekly, overrides=None, granularity=GRANULARITY):
+    return CompiledSchedule.compile(weekly, overrides, granularity)
+
+
+def cells(slot, minutes):
+    # Claim cells of GRANULARITY minutes, the way bookings reserve them
+    return [slot + timedelta(minutes=offset) for offset in range(0, minutes, GRANULARITY)]
+
+
+# --- CompiledSchedule ---
+
+def test_compile_sets_one_bit_per_cell():
+    schedule = compiled({'Monday': hours('09:00', '10:00'), 'Tuesday': hours('09:00', '10:00', available=False)})
+    # 09:00 is cell 36 of the day at 15-minute granularity; the hour spans cells 36-39
+    assert schedule.week[0] == 0b1111 << 36
+    assert schedule.week[1:] == [0] * 6
+    assert schedule.available_minutes(MONDAY) == 60
+    assert schedule.day_offsets(MONDAY, 30) == (540, 570)
+
+
+@pytest.mark.parametrize('start, end, covered', [
+    ('09:00', '17:00', True),    # The whole day
+    ('09:00', '09:15', True),    # First cell
+    ('16:45', '17:00', True),    # Last cell, ending exactly at endTime
+    ('08:45', '09:15', False),   # Starts before the doctor does
+    ('16:45', '17:15', False),   # Runs past endTime
+    ('12:00', '12:00', False),   # Empty
+    ('12:10', '12:20', True),    # Off the grid, inside open cells
+])
+def test_covers_boundaries(start, end, covered):
+    schedule = compiled({'Monday': hours('09:00', '17:00')})
+    assert schedule.covers(at(MONDAY, start), at(MONDAY, end)) is covered
+
+
+def test_covers_rounds_a_partial_minute_up():
+    schedule = compiled({'Monday': hours('09:00', '10:00')})
+    assert schedule.covers(at(MONDAY, '09:00'), at(MONDAY, '10:00'))
+    assert not schedule.covers(at(MONDAY, '09:00'), at(MONDAY, '10:00') + timedelta(seconds=1))
+
+
+def test_covers_needs_every_cell_across_a_gap():
+    schedule = compiled({'Monday': hours('09:00', '12:00')},
+                        [{'date': MONDAY.isoformat(), **hours('09:00', '10:00')},
+                         {'date': MONDAY.isoformat(), **hours('11:00', '12:00')}])
+    assert schedule.covers(at(MONDAY, '09:00'), at(MONDAY, '10:00'))
+    assert schedule.covers(at(MONDAY, '11:00'), at(MONDAY, '12:00'))
+    assert not schedule.covers(at(MONDAY, '09:30'), at(MONDAY, '11:30'))
+    assert schedule.day_offsets(MONDAY, 30) == (540, 570, 660, 690)
+
+
+def test_overnight_hours_are_rejected_and_never_covered():
+    with pytest.raises(ValueError, match='before endTime'):
+        validate_availability({'Monday': hours('22:00', '02:00')}, GRANULARITY)
+    # Open until the last cell of Monday and from midnight Tuesday: a visit across midnight still does not fit
+    schedule = compiled({'Monday': hours('23:00', '23:45'), 'Tuesday': hours('00:00', '01:00')})
+    assert schedule.covers(at(MONDAY, '23:00'), at(MONDAY, '23:45'))
+    assert not schedule.covers(at(MONDAY, '23:30'), at(MONDAY, '23:30') + timedelta(minutes=45))
+    assert schedule.covers(at(MONDAY + timedelta(days=1), '00:00'), at(MONDAY + timedelta(days=1), '00:30'))
+
+
+def test_legacy_schedule_compiles_to_the_minute():
+    schedule = CompiledSchedule.from_document({'availability': {'Monday': hours('09:07', '09:52')}})
+    assert schedule.granularity == 1
+    assert schedule.covers(at(MONDAY, '09:07'), at(MONDAY, '09:52'))
+    assert not schedule.covers(at(MONDAY, '09:06'), at(MONDAY, '09:30'))
+
+
+def test_overrides_replace_the_weekly_hours_of_their_date():
+    holiday, extra = MONDAY + timedelta(days=7), MONDAY + timedelta(days=5)  # A Monday off, a Saturday on
+    weekly, overrides = validate_availability({
+        'Monday': hours('09:00', '17:00'),
+        'overrides': [{'date': extra.isoformat(), **hours('10:00', '11:00')},
+                      {'date': holiday.isoformat(), 'isAvailable': False}],
+    }, GRANULARITY)
+    schedule = compiled(weekly, overrides)
+    assert schedule.covers(at(MONDAY, '10:00'), at(MONDAY, '11:00'))
+    assert not schedule.covers(at(holiday, '10:00'), at(holiday, '11:00'))
+    assert schedule.covers(at(extra, '10:00'), at(extra, '11:00'))
+    assert not schedule.covers(at(extra + timedelta(days=7), '10:00'), at(extra + timedelta(days=7), '11:00'))
+    assert schedule.day_offsets(holiday, 30) == ()
+
+
+def test_stored_document_round_trips():
+    schedule = compiled({day: hours('08:00', '12:00') for day in DAY_NAMES},
+                        [{'date': MONDAY.isoformat(), **hours('13:00', '14:00')}])
+    restored = CompiledSchedule.from_document({'availability_slots': schedule.to_document()})
+    assert (restored.granularity, restored.week, restored.overrides) == \
+        (schedule.granularity, schedule.week, schedule.overrides)
+
+
+# --- AvailabilityIndex ---
+
+def doctor_doc(name, specialization, weekly, overrides=None, duration=None):
+    doc = {'_id': name, 'name': name, 'specialization': specialization,
+           'availability_slots': compiled(weekly, overrides).to_document()}
+    if duration:
+        doc['appointment_durations'] = {'default': duration}
+    return doc
+
+
+def earliest(index, specialization, after, limit=3):
+    return [(slot, entry.doctor_id) for slot, entry in index.earliest(specialization, after, limit, 14)]
+
+
+def test_earliest_skips_claimed_cells():
+    index = AvailabilityIndex(30, cells)
+    index.load([doctor_doc('a', 'Cardiology', {'Monday': hours('09:00', '11:00')})], [])
+    assert earliest(index, 'cardiology', at(MONDAY, '08:00')) == [
+        (at(MONDAY, '09:00'), 'a'), (at(MONDAY, '09:30'), 'a'), (at(MONDAY, '10:00'), 'a')]
+    # One claimed cell is enough to take a slot; releasing it gives the slot back
+    index.add_booking('a', [at(MONDAY, '09:15')])
+    assert earliest(index, 'cardiology', at(MONDAY, '08:00'), limit=2) == [
+        (at(MONDAY, '09:30'), 'a'), (at(MONDAY, '10:00'), 'a')]
+    index.remove_booking('a', [at(MONDAY, '09:15')])
+    assert earliest(index, 'cardiology', at(MONDAY, '08:00'), limit=1) == [(at(MONDAY, '09:00'), 'a')]
+
+
+def test_earliest_merges_doctors_and_wraps_into_next_week():
+    index = AvailabilityIndex(30, cells)
+    index.load([doctor_doc('a', 'Cardiology', {'Monday': hours('09:00', '10:00')}),
+                doctor_doc('b', ' cardiology ', {'Monday': hours('09:30', '10:00')}),
+                doctor_doc('c', 'Dermatology', {'Monday': hours('08:00', '09:00')})],
+               [{'doctor_id': 'a', 'slot_start': at(MONDAY, '09:00')}])
+    # Doctors free at the same time come back in no particular order
+    assert sorted(earliest(index, 'Cardiology', at(MONDAY, '08:00'))) == [
+        (at(MONDAY, '09:30'), 'a'), (at(MONDAY, '09:30'), 'b'), (at(MONDAY + timedelta(days=7), '09:00'), 'a')]
+    # Past the last slot of the week the walk continues with next Monday
+    next_monday = MONDAY + timedelta(days=7)
+    assert earliest(index, '', at(MONDAY, '10:00'), limit=1) == [(at(next_monday, '08:00'), 'c')]
+
+
+def test_earliest_honours_overrides_and_durations():
+    saturday, next_monday = MONDAY + timedelta(days=5), MONDAY + timedelta(days=7)
+    index = AvailabilityIndex(30, cells)
+    index.load([doctor_doc('a', 'Cardiology', {'Monday': hours('09:00', '10:00')},
+                           [{'date': saturday.isoformat(), **hours('14:00', '15:00')},
+                            {'date': next_monday.isoformat(), **hours('09:30', '10:00')}], duration=60)], [])
+    # Hour-long visits: the override-only Saturday session counts, the shortened next Monday has no room,
+    # and the Monday after falls past the 14-day horizon
+    assert earliest(index, 'cardiology', at(MONDAY, '08:00'), limit=5) == [
+        (at(MONDAY, '09:00'), 'a'), (at(saturday, '14:00'), 'a')]
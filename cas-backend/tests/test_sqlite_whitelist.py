@@ -0,0 +1,112 @@
+"""Backend code may only use the pymongo calls and operators the SQLite store implements.
+
+Scans the source of every backend module, so a handler that starts using,
+say, $elemMatch or distinct() fails here on every machine rather than at
+runtime on SQLite deployments only.
+"""
+import ast
+import os
+
+import pytest
+
+import server
+import sqlite_store
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = sorted(name for name in os.listdir(BACKEND) if name.endswith('.py') and name != 'sqlite_store.py')
+
+# pymongo Collection, Cursor and Database methods whose names nothing else in the backend uses
+# (find, sort, update, count, drop, ... are shared with builtins and checked by running the flows)
+PYMONGO_METHODS = {
+    'find_one', 'count_documents', 'estimated_document_count', 'distinct', 'insert_one', 'insert_many',
+    'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many', 'bulk_write',
+    'find_one_and_update', 'find_one_and_delete', 'find_one_and_replace', 'aggregate', 'aggregate_raw_batches',
+    'watch', 'create_index', 'create_indexes', 'drop_index', 'drop_indexes', 'index_information', 'list_indexes',
+    'batch_size', 'explain', 'hint', 'max_time_ms', 'collation', 'rewind', 'list_collection_names',
+    'drop_collection', 'create_collection', 'with_options',
+}
+
+# Code that only ever runs against MongoDB: (module, function or class) -> why
+MONGO_ONLY_SCOPES = {
+    ('stats.py', 'rebuild_pipeline'): "the aggregation pipeline; SQLite collections have no aggregate()",
+    ('stats.py', '_minutes_expression'): "an aggregation expression used only by rebuild_pipeline",
+    ('events.py', 'ChangeStreamRelay'): "EVENTS_SOURCE='change-stream' requires STORAGE_BACKEND='mongo'",
+}
+MONGO_ONLY_CALLS = {
+    ('stats.py', 'aggregate'): "guarded by hasattr(collection, 'aggregate')",
+}
+
+
+def walk_outside_mongo_only(module, tree):
+    """Yields the nodes of a module, skipping the bodies of MONGO_ONLY_SCOPES."""
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) and (module, node.name) in MONGO_ONLY_SCOPES:
+            continue
+        yield node
+        stack.extend(ast.iter_child_nodes(node))
+
+
+def operator_keys(node):
+    """'$...' strings used as dict keys or subscripts: the operators of filters and updates."""
+    if isinstance(node, ast.Dict):
+        keys = node.keys
+    elif isinstance(node, ast.Subscript):
+        keys = [node.slice]
+    else:
+        return []
+    return [key.value for key in keys
+            if isinstance(key, ast.Constant) and isinstance(key.value, str) and key.value.startswith('$')]
+
+
+def uses(module):
+    with open(os.path.join(BACKEND, module), encoding='utf-8') as source:
+        tree = ast.parse(source.read(), module)
+    operators, methods, commands = set(), set(), set()
+    for node in walk_outside_mongo_only(module, tree):
+        operators.update(operator_keys(node))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            name = node.func.attr
+            if name in PYMONGO_METHODS and (module, name) not in MONGO_ONLY_CALLS:
+                methods.add(name)
+            if name == 'command' and node.args and isinstance(node.args[0], ast.Constant):
+                if isinstance(node.func.value, ast.Name) and node.func.value.id == 'db':
+                    commands.add(node.args[0].value)
+    return operators, methods, commands
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_module_stays_within_the_sqlite_whitelist(module):
+    operators, methods, commands = uses(module)
+    supported = sqlite_store.QUERY_OPERATORS | sqlite_store.UPDATE_OPERATORS
+    assert operators <= supported, f"{module} uses operators SQLite storage lacks: {sorted(operators - supported)}"
+    supported = sqlite_store.COLLECTION_METHODS | sqlite_store.CURSOR_METHODS
+    assert methods <= supported, f"{module} calls methods SQLite storage lacks: {sorted(methods - supported)}"
+    assert commands <= sqlite_store.DATABASE_COMMANDS, f"{module} runs unsupported commands: {sorted(commands)}"
+
+
+def test_scan_sees_what_the_handlers_use():
+    # Guards the scanner itself: if it found nothing it would pass any code
+    operators, methods, commands = uses('server.py')
+    assert {'$set', '$in', '$regex'} <= operators
+    assert {'find_one', 'insert_one', 'update_one'} <= methods
+    assert commands == {'ping'}
+
+
+@pytest.mark.parametrize('query', [{'tags': {'$elemMatch': {'a': 1}}}, {'n': {'$nin': [1]}}, {'$nor': [{'n': 1}]}])
+def test_unsupported_query_operators_raise(app, backend, query):
+    if backend != 'sqlite':
+        pytest.skip('SQLite storage only')
+    with app.app_context():
+        with pytest.raises(NotImplementedError):
+            server.db['things'].find_one(query)
+
+
+def test_unsupported_update_operators_raise(app, backend):
+    if backend != 'sqlite':
+        pytest.skip('SQLite storage only')
+    with app.app_context():
+        server.db['things'].insert_one({'code': 'a'})
+        with pytest.raises(NotImplementedError):
+            server.db['things'].update_one({'code': 'a'}, {'$push': {'log': 'x'}})
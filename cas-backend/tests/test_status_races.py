@@ -0,0 +1,138 @@
+"""A status change that lands between a handler's read and its update must not be applied twice."""
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+import server
+from conftest import auth, register
+from slot_claims import CLAIMS_COLLECTION
+from stats import STATS_COLLECTION
+from test_storage_conformance import DAY, book
+
+
+class RacingDatabase:
+    """Wraps `db` so that the next appointments.find_one() is followed by `race()`, as if another
+    request changed the appointment right after this one read it."""
+
+    def __init__(self, real, race, fail_updates=False):
+        self._real = real
+        self._race = race
+        self.fail_updates = fail_updates
+
+    def __getattr__(self, name):
+        if name == 'appointments':
+            return RacingCollection(self._real.appointments, self)
+        return getattr(self._real, name)
+
+    def __getitem__(self, name):
+        return self.appointments if name == 'appointments' else self._real[name]
+
+
+class RacingCollection:
+    def __init__(self, real, database):
+        self._real = real
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+    def find_one(self, *args, **kwargs):
+        document = self._real.find_one(*args, **kwargs)
+        race, self._database._race = self._database._race, None
+        if race:
+            race()
+        return document
+
+    def update_one(self, *args, **kwargs):
+        if self._database.fail_updates:
+            raise RuntimeError("update failed")
+        return self._real.update_one(*args, **kwargs)
+
+
+@pytest.fixture
+def booked(app, client, doctor, patient):
+    response = book(client, patient, doctor, datetime(DAY.year, DAY.month, DAY.day, 10, 0))
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['appointment']
+
+
+@pytest.fixture
+def published(monkeypatch):
+    events = []
+    monkeypatch.setattr(server, 'publish_appointment_event', lambda kind, appointment: events.append(kind))
+    return events
+
+
+def stats_of(app, doctor):
+    with app.app_context():
+        return server.db[STATS_COLLECTION].find_one({'doctor_id': ObjectId(doctor['doctorId'])},
+                                                    {'_id': 0, 'day': 0, 'doctor_id': 0})
+
+
+def race_to(app, monkeypatch, appointment_id, status):
+    def change():
+        server.db.appointments.update_one({'_id': ObjectId(appointment_id)}, {'$set': {'status': status}})
+        if status != 'completed':
+            server.release_claim(server.db, ObjectId(appointment_id))  # As cancel and expiry do
+    with app.app_context():
+        monkeypatch.setattr(server, 'db', RacingDatabase(server.db, change))
+
+
+def claimed_cells(app, appointment_id):
+    with app.app_context():
+        return sorted(claim['slot_start'].strftime('%Y-%m-%d %H:%M') for claim in server.db[CLAIMS_COLLECTION].find(
+            {'appointment_id': ObjectId(appointment_id)}))
+
+
+@pytest.mark.parametrize('status', ['cancelled', 'expired'])
+def test_cancel_loses_to_a_concurrent_change(app, client, doctor, patient, booked, published, monkeypatch, status):
+    before = stats_of(app, doctor)
+    race_to(app, monkeypatch, booked['id'], status)
+    response = client.delete(f"/api/appointments/{booked['id']}", headers=auth(patient['token']))
+    assert response.status_code == 400
+    assert published == []
+    assert stats_of(app, doctor) == before
+
+
+def test_complete_loses_to_a_concurrent_cancel(app, client, doctor, booked, published, monkeypatch):
+    before = stats_of(app, doctor)
+    race_to(app, monkeypatch, booked['id'], 'cancelled')
+    response = client.put(f"/api/appointments/{booked['id']}/complete", headers=auth(doctor['token']))
+    assert response.status_code == 400
+    assert published == []
+    assert stats_of(app, doctor) == before
+
+
+def test_reschedule_loses_to_a_concurrent_cancel(app, client, doctor, patient, booked, published, monkeypatch):
+    before = stats_of(app, doctor)
+    race_to(app, monkeypatch, booked['id'], 'cancelled')
+    response = client.put(f"/api/appointments/{booked['id']}", json={'date': '2030-01-08', 'time': '11:00'},
+                          headers=auth(patient['token']))
+    assert response.status_code == 400
+    assert published == []
+    assert stats_of(app, doctor) == before
+    # The claims moved to the new time are given up, and it stays bookable
+    assert claimed_cells(app, booked['id']) == []
+    other = register(client, 'other@example.com', 'patient', 'Other Patient')
+    assert book(client, other, doctor, datetime(2030, 1, 8, 11, 0)).status_code == 201
+
+
+def test_reschedule_keeps_the_old_claims_when_the_update_fails(app, client, doctor, patient, booked, monkeypatch):
+    old_cells = claimed_cells(app, booked['id'])
+    real = server.db
+    monkeypatch.setattr(server, 'db', RacingDatabase(real, None, fail_updates=True))
+    response = client.put(f"/api/appointments/{booked['id']}", json={'date': '2030-01-08', 'time': '11:00'},
+                          headers=auth(patient['token']))
+    assert response.status_code == 500
+    monkeypatch.setattr(server, 'db', real)
+    assert claimed_cells(app, booked['id']) == old_cells
+    other = register(client, 'other@example.com', 'patient', 'Other Patient')
+    assert book(client, other, doctor, datetime(2030, 1, 8, 11, 0)).status_code == 201
+
+
+def test_cancel_twice_counts_once(app, client, doctor, patient, booked, published):
+    assert client.delete(f"/api/appointments/{booked['id']}", headers=auth(patient['token'])).status_code == 200
+    assert client.delete(f"/api/appointments/{booked['id']}", headers=auth(patient['token'])).status_code == 400
+    assert published == ['cancelled']
+    assert stats_of(app, doctor)['cancelled'] == 1
@@ -0,0 +1,266 @@
+"""The same collection calls and API flows must behave alike on MongoDB and on the SQLite store."""
+import io
+from datetime import date, datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from flask import request, request_started
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import server
+from conftest import auth, register
+
+# A Monday far enough ahead that every slot is bookable
+DAY = date(2030, 1, 7)
+
+
+@pytest.fixture
+def things(app):
+    with app.app_context():
+        collection = server.db['conformance_things']
+        collection.create_index([('code', 1)], unique=True, name='code_unique')
+        yield collection
+
+
+# --- Collection API ---
+
+def codes(cursor):
+    return [doc['code'] for doc in cursor]
+
+
+def test_insert_and_find_round_trip_types(things):
+    oid, when = ObjectId(), datetime(2030, 1, 7, 9, 30)
+    things.insert_one({'_id': oid, 'code': 'a', 'owner': ObjectId('65f000000000000000000001'), 'when': when,
+                       'tags': ['x', 'y'], 'nested': {'n': 1}})
+    doc = things.find_one({'_id': oid})
+    assert doc == {'_id': oid, 'code': 'a', 'owner': ObjectId('65f000000000000000000001'), 'when': when,
+                   'tags': ['x', 'y'], 'nested': {'n': 1}}
+    assert things.find_one({'_id': oid}, {'code': 1, '_id': 0}) == {'code': 'a'}
+    assert things.find_one({'nested.n': 1})['_id'] == oid
+    assert things.find_one({'code': 'missing'}) is None
+
+
+def test_filters_sort_skip_limit(things):
+    start = datetime(2030, 1, 7, 9, 0)
+    things.insert_many([{'code': f'c{i}', 'n': i, 'when': start + timedelta(hours=i), 'even': i % 2 == 0}
+                        for i in range(10)])
+    assert codes(things.find({'n': {'$gte': 3, '$lt': 6}}).sort('n', 1)) == ['c3', 'c4', 'c5']
+    assert codes(things.find({'n': {'$in': [1, 8]}}).sort('n', -1)) == ['c8', 'c1']
+    assert codes(things.find({'$or': [{'n': 0}, {'code': 'c9'}]}).sort('n', 1)) == ['c0', 'c9']
+    assert codes(things.find({'when': {'$gt': start + timedelta(hours=7)}}).sort('when', 1)) == ['c8', 'c9']
+    assert codes(things.find({'even': True}).sort([('n', -1)]).skip(1).limit(2)) == ['c6', 'c4']
+    assert codes(things.find({'code': {'$regex': '^c[12]$'}}).sort('n', 1)) == ['c1', 'c2']
+    assert codes(things.find({'n': {'$ne': 0}, '$and': [{'n': {'$lte': 2}}]}).sort('n', 1)) == ['c1', 'c2']
+    assert things.count_documents({'even': False}) == 5
+
+
+def test_updates_and_results(things):
+    things.insert_one({'code': 'a', 'n': 1, 'status': 'upcoming'})
+    result = things.update_one({'code': 'a', 'status': 'upcoming'}, {'$set': {'status': 'cancelled'}, '$inc': {'n': 2}})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    # The filter no longer matches: nothing is modified
+    result = things.update_one({'code': 'a', 'status': 'upcoming'}, {'$set': {'status': 'cancelled'}})
+    assert (result.matched_count, result.modified_count) == (0, 0)
+    assert things.find_one({'code': 'a'}, {'_id': 0}) == {'code': 'a', 'n': 3, 'status': 'cancelled'}
+
+    result = things.update_one({'code': 'b'}, {'$inc': {'n': 1}, '$setOnInsert': {'new': True}}, upsert=True)
+    assert result.upserted_id is not None
+    assert things.find_one({'code': 'b'}, {'_id': 0}) == {'code': 'b', 'n': 1, 'new': True}
+
+    after = things.find_one_and_update({'code': 'b'}, {'$set': {'new': False}, '$inc': {'n': 1}},
+                                       projection={'_id': 0}, return_document=ReturnDocument.AFTER)
+    assert after == {'code': 'b', 'n': 2, 'new': False}
+    assert things.update_many({}, {'$set': {'flag': 1}}).modified_count == 2
+    assert things.find_one_and_delete({'code': 'b', 'n': {'$lte': 1}}) is None
+    assert things.find_one_and_delete({'code': 'b'}, projection={'_id': 0, 'n': 1}) == {'n': 2}
+    assert things.delete_one({'code': 'a'}).deleted_count == 1
+    assert things.delete_many({}).deleted_count == 0
+
+
+def test_unique_index_raises_duplicate_key(things):
+    things.insert_one({'code': 'a'})
+    with pytest.raises(DuplicateKeyError):
+        things.insert_one({'code': 'a'})
+    assert 'code_unique' in things.index_information()
+
+
+# --- API flows ---
+
+def book(client, patient, doctor, when):
+    return client.post('/api/appointments', json={'doctorId': doctor['doctorId'], 'date': when.strftime('%Y-%m-%d'),
+                                                  'time': when.strftime('%H:%M'), 'reason': 'checkup'},
+                       headers=auth(patient['token']))
+
+
+def test_booking_and_cancel_flow(client, doctor, patient):
+    when = datetime(DAY.year, DAY.month, DAY.day, 10, 0)
+    response = book(client, patient, doctor, when)
+    assert response.status_code == 201, response.get_json()
+    appointment = response.get_json()['appointment']
+    assert (appointment['date'], appointment['time'], appointment['status']) == ('2030-01-07', '10:00', 'upcoming')
+
+    # The slot is taken, for this patient and any other
+    assert book(client, patient, doctor, when).status_code == 409
+    other = register(client, 'other@example.com', 'patient', 'Other Patient')
+    assert book(client, other, doctor, when).status_code == 409
+
+    listed = client.get('/api/appointments/patient', headers=auth(patient['token'])).get_json()
+    assert [row['id'] for row in listed] == [appointment['id']]
+    listed = client.get('/api/appointments/doctor', headers=auth(doctor['token'])).get_json()
+    assert [(row['id'], row['patientName']) for row in listed] == [(appointment['id'], 'Pat Test')]
+
+    response = client.delete(f"/api/appointments/{appointment['id']}", headers=auth(patient['token']))
+    assert response.status_code == 200, response.get_json()
+    assert client.delete(f"/api/appointments/{appointment['id']}", headers=auth(patient['token'])).status_code == 400
+    listed = client.get('/api/appointments/patient', headers=auth(patient['token'])).get_json()
+    assert [row['status'] for row in listed] == ['cancelled']
+
+    # Cancelling gave the slot back
+    assert book(client, other, doctor, when).status_code == 201
+
+
+def test_pagination_walks_every_row_once(client, doctor, patient):
+    booked = []
+    for hour in range(9, 17):
+        response = book(client, patient, doctor, datetime(DAY.year, DAY.month, DAY.day, hour, 0))
+        assert response.status_code == 201, response.get_json()
+        booked.append(response.get_json()['appointment']['id'])
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        url = '/api/appointments/patient?limit=3' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=auth(patient['token']))
+        assert response.status_code == 200, response.get_json()
+        rows = response.get_json()
+        assert len(rows) <= 3
+        seen.extend(row['id'] for row in rows)
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert pages == 3
+    # Newest first, each appointment exactly once
+    assert seen == list(reversed(booked))
+
+
+def test_listing_without_limit_or_cursor_returns_every_row(app, client, doctor, patient):
+    app.config['APPOINTMENTS_PAGE_SIZE'] = 3
+    for hour in range(9, 17):
+        assert book(client, patient, doctor, datetime(DAY.year, DAY.month, DAY.day, hour, 0)).status_code == 201
+    for listing, login in (('patient', patient), ('doctor', doctor)):
+        response = client.get(f'/api/appointments/{listing}', headers=auth(login['token']))
+        assert response.status_code == 200
+        assert len(response.get_json()) == 8
+        assert 'X-Next-Cursor' not in response.headers
+    # Asking for pages still pages; a cursor alone gets the configured page size
+    response = client.get('/api/appointments/patient?limit=5', headers=auth(patient['token']))
+    assert len(response.get_json()) == 5
+    response = client.get(f"/api/appointments/patient?cursor={response.headers['X-Next-Cursor']}",
+                          headers=auth(patient['token']))
+    assert len(response.get_json()) == 3
+
+
+def test_directory_without_limit_or_offset_lists_every_doctor(app, client):
+    app.config['DOCTOR_DIRECTORY_PAGE_SIZE'] = 3
+    for i in range(5):
+        register(client, f'doctor-{i}@example.com', 'doctor', f'Dr. {i}', 'Cardiology')
+    response = client.get('/api/doctors')
+    assert len(response.get_json()) == 5 and response.headers['X-Total-Count'] == '5'
+    assert len(client.get('/api/doctors?specialization=cardiology').get_json()) == 5
+    assert len(client.get('/api/doctors?limit=2').get_json()) == 2
+    assert len(client.get('/api/doctors?offset=1').get_json()) == 3
+
+
+# --- Every route and command on both backends ---
+
+OPERATOR = {'X-Operator-Token': 'operator-secret'}
+# Extra arguments per CLI command; every registered command is run
+COMMAND_ARGS = {'init-db': ['--skip-verify']}
+
+
+def tour(client, doctor, patient):
+    """Calls every API route once with a valid request. Yields (label, response)."""
+    doctor_id = doctor['doctorId']
+    yield 'index', client.get('/')
+    yield 'health', client.get('/healthz')
+    yield 'ready', client.get('/readyz')
+    yield 'register', client.post('/api/register', json={'email': 'second@example.com', 'password': 'test-password',
+                                                        'userType': 'patient', 'name': 'Second Patient'})
+    yield 'login', client.post('/api/login', json={'email': 'patient@example.com', 'password': 'test-password',
+                                                  'userType': 'patient'})
+    hours = {day: {'startTime': '09:00', 'endTime': '17:00', 'isAvailable': True}
+             for day in ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')}
+    yield 'availability', client.put('/api/doctors/me/availability', json=hours, headers=auth(doctor['token']))
+    yield 'profile', client.put('/api/doctors/me/profile', json={'bio': 'Heart specialist', 'phone': '555'},
+                                headers=auth(doctor['token']))
+    response = client.post('/api/doctors/me/profile-picture', data={'profilePic': (io.BytesIO(b'picture'), 'me.png')},
+                           headers=auth(doctor['token']), content_type='multipart/form-data')
+    yield 'picture', response
+    yield 'picture file', client.get(response.get_json()['profilePictureUrl'])
+
+    yield 'directory', client.get('/api/doctors?specialization=cardiology&limit=1&offset=0', headers=auth(patient['token']))
+    yield 'search', client.get('/api/doctors/search?q=dr tes&specialization=Cardiology',
+                                headers=auth(patient['token']))
+    yield 'details', client.get(f'/api/doctors/{doctor_id}', headers=auth(patient['token']))
+    yield 'slots', client.get(f'/api/doctors/{doctor_id}/slots?from={DAY}&to={DAY}', headers=auth(patient['token']))
+    yield 'earliest', client.get('/api/search/earliest?specialization=Cardiology&limit=2', headers=auth(patient['token']))
+
+    response = book(client, patient, doctor, datetime(DAY.year, DAY.month, DAY.day, 10, 0))
+    yield 'book', response
+    first = response.get_json()['appointment']['id']
+    response = client.post('/api/appointments/batch', headers=auth(patient['token']), json={
+        'doctorId': doctor_id, 'date': (DAY + timedelta(days=1)).isoformat(), 'time': '11:00',
+        'recurrence': {'frequency': 'weekly', 'count': 2}})
+    yield 'batch', response
+    second = response.get_json()['appointments'][0]['id']
+    yield 'reschedule', client.put(f'/api/appointments/{first}', json={'date': DAY.isoformat(), 'time': '12:00'},
+                                   headers=auth(patient['token']))
+    yield 'complete', client.put(f'/api/appointments/{first}/complete', headers=auth(doctor['token']))
+    yield 'cancel', client.delete(f'/api/appointments/{second}', headers=auth(patient['token']))
+
+    for login, listing in ((patient, 'patient'), (doctor, 'doctor')):
+        yield listing, client.get(f'/api/appointments/{listing}?status=upcoming&from={DAY}', headers=auth(login['token']))
+        response = client.get(f'/api/appointments/{listing}?limit=1', headers=auth(login['token']))
+        yield f'{listing} page', response
+        yield f'{listing} next page', client.get(f"/api/appointments/{listing}?cursor={response.headers['X-Next-Cursor']}",
+                                                 headers=auth(login['token']))
+        yield f'{listing} history', client.get(f'/api/appointments/{listing}?history=1', headers=auth(login['token']))
+        response = client.get(f'/api/appointments/{listing}?since=', headers=auth(login['token']))
+        yield f'{listing} sync', client.get(f"/api/appointments/{listing}?since={response.headers['X-Sync-Token']}",
+                                            headers=auth(login['token']))
+    response = client.post('/api/appointments/events/ticket', headers=auth(patient['token']))
+    yield 'ticket', response
+    yield 'events', client.get(f"/api/appointments/events?ticket={response.get_json()['ticket']}")
+
+    yield 'my stats', client.get(f'/api/doctors/me/stats?from={DAY}&to={DAY}', headers=auth(doctor['token']))
+    yield 'doctor stats', client.get(f'/api/internal/doctor-stats?doctorId={doctor_id}&from={DAY}&to={DAY}',
+                                     headers=OPERATOR)
+    yield 'cache stats', client.get('/api/internal/cache-stats', headers=OPERATOR)
+    yield 'metrics', client.get('/metrics', headers=OPERATOR)
+
+
+def test_every_route_answers_on_both_backends(app, client, doctor, patient):
+    app.config.update(OPERATOR_TOKEN='operator-secret', METRICS_ENABLED=True, EVENTS_STREAM_MAX_SECONDS=0)
+    visited = set()
+
+    def record(sender, **extra):
+        visited.add(request.endpoint)
+
+    with request_started.connected_to(record, app):
+        for label, response in tour(client, doctor, patient):
+            # A query the SQLite store cannot run surfaces as a 500 from the handler
+            assert response.status_code < 400, (label, response.status_code, response.get_data(as_text=True)[:500])
+    # A new route fails here until it is added to the tour
+    routes = {rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'}
+    assert routes - visited == set()
+
+
+def test_every_command_runs_on_both_backends(app, client, doctor, patient):
+    assert book(client, patient, doctor, datetime(DAY.year, DAY.month, DAY.day, 10, 0)).status_code == 201
+    runner = app.test_cli_runner()
+    commands = set(app.cli.list_commands(None)) - {'routes', 'run', 'shell'} # Flask's own
+    assert {'init-db', 'sweep-appointments', 'rebuild-stats', 'migrate-uploads'} <= commands
+    for name in sorted(commands):
+        result = runner.invoke(args=[name, *COMMAND_ARGS.get(name, [])])
+        assert result.exit_code == 0, (name, result.output, result.exception)
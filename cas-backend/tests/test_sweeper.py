@@ -0,0 +1,95 @@
+"""expire_stale() must only report the appointments it actually expired."""
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import server
+from slot_claims import CLAIMS_COLLECTION
+from sweeper import expire_stale
+
+CUTOFF = datetime(2030, 1, 10)
+
+
+class RacingDatabase:
+    """Passes `db` through, running `race()` right after the first appointments.find()."""
+
+    def __init__(self, real, race):
+        self._real = real
+        self._race = race
+
+    def __getattr__(self, name):
+        if name == 'appointments':
+            return RacingCollection(self._real.appointments, self)
+        return getattr(self._real, name)
+
+    def __getitem__(self, name):
+        return self.appointments if name == 'appointments' else self._real[name]
+
+
+class RacingCollection:
+    def __init__(self, real, database):
+        self._real = real
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+    def find(self, *args, **kwargs):
+        rows = list(self._real.find(*args, **kwargs))
+        race, self._database._race = self._database._race, None
+        if race:
+            race()
+        return ListCursor(rows)
+
+
+class ListCursor(list):
+    def limit(self, count):
+        return ListCursor(self[:count]) if count else self
+
+
+@pytest.fixture
+def stale(app):
+    """Five upcoming appointments before the cutoff, each holding one claim."""
+    doctor_oid = ObjectId()
+    ids = [ObjectId() for _ in range(5)]
+    with app.app_context():
+        for i, appointment_oid in enumerate(ids):
+            start = datetime(2030, 1, 7, 9 + i)
+            server.db.appointments.insert_one({'_id': appointment_oid, 'doctor_id': doctor_oid,
+                                               'patient_id': ObjectId(), 'appointment_datetime': start,
+                                               'appointment_end': start + timedelta(minutes=30),
+                                               'status': 'upcoming'})
+            server.db[CLAIMS_COLLECTION].insert_one({'doctor_id': doctor_oid, 'slot_start': start,
+                                                     'appointment_id': appointment_oid})
+    return ids
+
+
+def statuses(ids):
+    return [server.db.appointments.find_one({'_id': oid})['status'] for oid in ids]
+
+
+def test_expires_and_reports_every_stale_appointment(app, stale):
+    reported = []
+    with app.app_context():
+        assert expire_stale(server.db, CUTOFF, batch_size=2, on_expired=reported.extend) == 5
+        assert statuses(stale) == ['expired'] * 5
+        assert server.db[CLAIMS_COLLECTION].count_documents({}) == 0
+    assert sorted(appt['_id'] for appt in reported) == sorted(stale)
+    assert all(appt['status'] == 'expired' for appt in reported)
+
+
+def test_appointments_changed_meanwhile_are_not_reported(app, stale):
+    cancelled, completed = stale[0], stale[1]
+
+    def race():
+        server.db.appointments.update_one({'_id': cancelled}, {'$set': {'status': 'cancelled'}})
+        server.db.appointments.update_one({'_id': completed}, {'$set': {'status': 'completed'}})
+
+    reported = []
+    with app.app_context():
+        assert expire_stale(RacingDatabase(server.db, race), CUTOFF, batch_size=10, on_expired=reported.extend) == 3
+        assert statuses(stale) == ['cancelled', 'completed', 'expired', 'expired', 'expired']
+        # The completed appointment keeps its claim; cancel itself releases the cancelled one's
+        assert server.db[CLAIMS_COLLECTION].count_documents({'appointment_id': completed}) == 1
+    assert sorted(appt['_id'] for appt in reported) == sorted(stale[2:])
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom'; // Import useNavigate
 import AppointmentList from '../components/AppointmentList';
+import { subscribeToAppointmentEvents, applyAppointmentEvent } from '../utils/appointmentEvents';
 import '../styles/dashboard.css';
 import '../styles/main.css';
 
@@ -8,6 +9,7 @@ function DoctorDashboard() {
   const [appointments, setAppointments] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [reloadCount, setReloadCount] = useState(0); // Bumped to refetch after missed live updates
   const navigate = useNavigate(); // Initialize useNavigate
 
   useEffect(() => {
@@ -48,7 +50,20 @@ function DoctorDashboard() {
     };
 
     fetchAppointments();
-  }, []); // Empty dependency array means run once on mount
+  }, [reloadCount]); // Runs on mount, and again when live updates ask for a resync
+
+  // Keep the list current: apply appointment changes pushed by the server
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token || localStorage.getItem('userType') !== 'doctor') {
+      return undefined;
+    }
+    return subscribeToAppointmentEvents(
+      token,
+      (event) => setAppointments(prevAppointments => applyAppointmentEvent(prevAppointments, event)),
+      () => setReloadCount(count => count + 1)
+    );
+  }, []);
 
   const handleComplete = async (appointmentId) => {
     const token = localStorage.getItem('token');
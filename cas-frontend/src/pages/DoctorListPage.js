@@ -7,14 +7,20 @@ function DoctorListPage() {
   const [doctors, setDoctors] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(''); // Add error state
+  const [query, setQuery] = useState('');
+  const [specialization, setSpecialization] = useState('');
 
   useEffect(() => {
     const fetchDoctors = async () => {
-      setLoading(true);
       setError('');
       try {
-        // Fetch from the backend API (running on port 5001)
-        const response = await fetch('http://localhost:5001/api/doctors');
+        // Fetch from the backend API (running on port 5001); the full list when not searching
+        let url = 'http://localhost:5001/api/doctors';
+        if (query.trim() || specialization.trim()) {
+          const params = new URLSearchParams({ q: query.trim(), specialization: specialization.trim() });
+          url = `http://localhost:5001/api/doctors/search?${params}`;
+        }
+        const response = await fetch(url);
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
@@ -28,8 +34,10 @@ function DoctorListPage() {
       }
     };
 
-    fetchDoctors();
-  }, []); // Empty dependency array means this runs once on mount
+    // Wait for a pause in typing instead of searching on every keystroke
+    const timer = setTimeout(fetchDoctors, query || specialization ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [query, specialization]);
 
   if (loading) {
     return <div className="loading">Loading doctors...</div>;
@@ -47,12 +55,29 @@ function DoctorListPage() {
         <h2>Available Doctors</h2>
         {/* Optional: Add subtitle <p>Find the right specialist for your needs.</p> */}
       </div>
+      <div className="doctor-search">
+        <input
+          type="search"
+          className="form-control"
+          placeholder="Search by name"
+          value={query}
+          onChange={e => setQuery(e.target.value)}
+        />
+        <input
+          type="search"
+          className="form-control"
+          placeholder="Specialization"
+          value={specialization}
+          onChange={e => setSpecialization(e.target.value)}
+        />
+      </div>
       {/* Use the correct grid class name */}
       <div className="doctors-grid">
         {doctors.map(doctor => (
           <DoctorCard key={doctor.id} doctor={doctor} />
         ))}
       </div>
+      {doctors.length === 0 && <p className="no-doctors">No doctors match your search.</p>}
     </div>
   );
 }
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom'; // Import useNavigate
 import AppointmentList from '../components/AppointmentList';
 import EditAppointmentModal from '../components/EditAppointmentModal';
+import { subscribeToAppointmentEvents, applyAppointmentEvent } from '../utils/appointmentEvents';
 import '../styles/dashboard.css';
 import '../styles/main.css';
 import '../styles/modal.css';
@@ -32,6 +33,7 @@ function PatientDashboard() {
   const [appointments, setAppointments] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [reloadCount, setReloadCount] = useState(0); // Bumped to refetch after missed live updates
   const navigate = useNavigate(); // Initialize useNavigate
   const [isEditModalOpen, setIsEditModalOpen] = useState(false);
   const [appointmentToEdit, setAppointmentToEdit] = useState(null);
@@ -76,7 +78,20 @@ function PatientDashboard() {
     };
 
     fetchAppointments();
-  }, []); // Empty dependency array means run once on mount
+  }, [reloadCount]); // Runs on mount, and again when live updates ask for a resync
+
+  // Keep the list current: apply appointment changes pushed by the server
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    if (!token || localStorage.getItem('userType') !== 'patient') {
+      return undefined;
+    }
+    return subscribeToAppointmentEvents(
+      token,
+      (event) => setAppointments(prevAppointments => applyAppointmentEvent(prevAppointments, event)),
+      () => setReloadCount(count => count + 1)
+    );
+  }, []);
 
   const handleCancel = async (appointmentId) => {
     const token = localStorage.getItem('token');
@@ -0,0 +1,107 @@
+const EVENTS_URL = 'http://localhost:5001/api/appointments/events';
+const TICKET_URL = 'http://localhost:5001/api/appointments/events/ticket';
+const RECONNECT_MS = 5000;
+
+/**
+ * Opens the server-sent events stream of changes to the logged-in user's appointments.
+ * EventSource cannot set headers, and anything in its URL may be logged, so every connection
+ * is opened with a fresh short-lived ticket (?ticket=) rather than the login token. After an
+ * error the stream is reopened with a new ticket, resuming from the last event received.
+ *
+ * @param {string} token - The user's JWT (only sent as a header, to get tickets).
+ * @param {function} onEvent - Called with each change: { type: 'created'|'rescheduled'|'cancelled'|'completed'|'expired', appointment }.
+ * @param {function} onResync - Called when changes were missed and the list should be fetched again.
+ * @returns {function} - Closes the stream (use as the useEffect cleanup).
+ */
+export function subscribeToAppointmentEvents(token, onEvent, onResync) {
+  if (typeof EventSource === 'undefined' || !token) {
+    return () => {};
+  }
+  let source = null;
+  let reconnectTimer = null;
+  let closed = false;
+  let lastEventId = null;
+
+  const reconnectLater = () => {
+    if (!closed) {
+      reconnectTimer = setTimeout(connect, RECONNECT_MS);
+    }
+  };
+
+  async function connect() {
+    let ticket;
+    try {
+      const response = await fetch(TICKET_URL, {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${token}`
+        }
+      });
+      if (response.status === 401 || response.status === 403) {
+        return; // Logged out or not allowed: retrying will not help
+      }
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      ticket = (await response.json()).ticket;
+    } catch (err) {
+      console.error('Could not open appointment events:', err);
+      reconnectLater();
+      return;
+    }
+    if (closed) {
+      return;
+    }
+
+    const params = new URLSearchParams({ ticket });
+    if (lastEventId) {
+      params.set('lastEventId', lastEventId);
+    }
+    source = new EventSource(`${EVENTS_URL}?${params}`);
+
+    source.addEventListener('appointment', (message) => {
+      lastEventId = message.lastEventId || lastEventId;
+      try {
+        onEvent(JSON.parse(message.data));
+      } catch (err) {
+        console.error('Malformed appointment event:', err);
+      }
+    });
+    source.addEventListener('resync', () => onResync());
+    // EventSource would retry with the same, by then expired, ticket
+    source.onerror = () => {
+      source.close();
+      reconnectLater();
+    };
+  }
+
+  connect();
+
+  return () => {
+    closed = true;
+    clearTimeout(reconnectTimer);
+    if (source) {
+      source.close();
+    }
+  };
+}
+
+/**
+ * Applies one appointment change to a list of appointment rows (newest first).
+ *
+ * @param {Array} appointments - The current rows.
+ * @param {object} event - An event from subscribeToAppointmentEvents.
+ * @returns {Array} - The updated rows.
+ */
+export function applyAppointmentEvent(appointments, event) {
+  const changed = event.appointment;
+  if (!changed) {
+    return appointments;
+  }
+  const existing = appointments.find(appt => appt.id === changed.id);
+  if (existing) {
+    return appointments.map(appt => (appt.id === changed.id ? { ...appt, ...changed } : appt));
+  }
+  const startOf = appt => `${appt.date} ${appt.time}`;
+  return [...appointments, changed].sort((a, b) => startOf(b).localeCompare(startOf(a)));
+}